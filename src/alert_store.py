@@ -0,0 +1,362 @@
+import bisect
+import sys
+from array import array
+from datetime import datetime
+
+from src.rules import DROP, RISE, TRAIL, MOVE, RULES, rule_of
+
+# Attributes AlertRecord keeps in slots; anything else rides along in `extra`
+_SLOTTED = {
+    'chat_id', 'symbol', 'threshold_percent', 'interval_minutes', 'baseline_price',
+    'alert_sent', 'last_check', 'due_shard', 'next_due',
+    'rule', 'cooldown_minutes', 'window_minutes',
+    'peak_price', 'window_high', 'window_high_at', 'window_low', 'window_low_at',
+}
+
+
+class AlertRecord:
+    """
+    One active alert with its numbers converted once: floats instead of
+    Decimals, the trigger price precomputed, and the next check as epoch
+    seconds instead of an ISO string. high/low are the rolling state of
+    trail (peak in high) and move rules (window extremes and when they were
+    seen). scheduled is False for alerts stored without due fields, whose
+    next_due is only inferred.
+    """
+    __slots__ = (
+        'chat_id', 'symbol', 'baseline', 'threshold', 'interval_minutes', 'trigger', 'next_due', 'extra',
+        'rule', 'cooldown', 'window', 'high', 'high_at', 'low', 'low_at', 'scheduled',
+    )
+
+    def __init__(self, chat_id, symbol, baseline, threshold, interval_minutes, next_due, extra=None,
+                 rule=DROP, cooldown=0, window=0, high=None, high_at=0, low=None, low_at=0, scheduled=True):
+        self.chat_id = chat_id
+        self.symbol = symbol
+        self.baseline = baseline
+        self.threshold = threshold
+        self.interval_minutes = interval_minutes
+        # Same expression the checker has always used, so edge cases match
+        if rule == RISE:
+            self.trigger = baseline * (1 + threshold / 100)
+        else:
+            self.trigger = baseline * (1 - threshold / 100)
+        self.next_due = next_due
+        self.extra = extra
+        self.rule = rule
+        self.cooldown = cooldown
+        self.window = window
+        self.high = baseline if high is None else high
+        self.high_at = high_at
+        self.low = baseline if low is None else low
+        self.low_at = low_at
+        self.scheduled = scheduled
+
+    @classmethod
+    def from_item(cls, item):
+        interval = float(item.get('interval_minutes', 0))
+        if item.get('next_due') is not None:
+            next_due = int(item['next_due'])
+        elif item.get('last_check'):
+            next_due = int(datetime.fromisoformat(item['last_check']).timestamp() + interval * 60)
+        else:
+            next_due = 0
+        extra = {k: v for k, v in item.items() if k not in _SLOTTED} or None
+        rule = rule_of(item)
+        high = item.get('peak_price') if rule == TRAIL else item.get('window_high')
+        return cls(
+            item['chat_id'], item['symbol'],
+            float(item.get('baseline_price', 0)), float(item.get('threshold_percent', 0)),
+            int(interval) if interval.is_integer() else interval, next_due, extra,
+            rule, float(item.get('cooldown_minutes', 0)), float(item.get('window_minutes', 0)),
+            None if high is None else float(high), int(item.get('window_high_at', 0)),
+            None if item.get('window_low') is None else float(item['window_low']), int(item.get('window_low_at', 0)),
+            item.get('next_due') is not None and item.get('due_shard') is not None,
+        )
+
+    def rearm(self, price, now_ts):
+        """
+        Restart the rule from price after it fired, for cooldown re-arming.
+        """
+        self.baseline = self.high = self.low = price
+        self.high_at = self.low_at = int(now_ts)
+
+    def to_item(self, alert_sent, last_check, due=None):
+        """
+        Rebuild the stored item. Numbers go back as the Decimals !set wrote
+        (Decimal(str(float)) for prices and percents, whole minutes).
+        """
+        from decimal import Decimal
+        item = dict(self.extra) if self.extra else {}
+        item.update({
+            'chat_id': self.chat_id,
+            'symbol': self.symbol,
+            'threshold_percent': Decimal(repr(self.threshold)),
+            'interval_minutes': Decimal(str(self.interval_minutes)),
+            'alert_sent': alert_sent,
+            'baseline_price': Decimal(repr(self.baseline)),
+            'last_check': last_check,
+        })
+        if self.rule != DROP:
+            item['rule'] = self.rule
+        if self.cooldown:
+            item['cooldown_minutes'] = Decimal(str(int(self.cooldown)))
+        if self.rule == MOVE:
+            item['window_minutes'] = Decimal(str(int(self.window)))
+        item.update(self.state_fields())
+        if due:
+            item.update(due)
+        return item
+
+    def state_fields(self):
+        """
+        The rule's rolling state as stored attributes (none for drop and rise).
+        """
+        from decimal import Decimal
+        if self.rule == TRAIL:
+            return {'peak_price': Decimal(repr(self.high))}
+        if self.rule == MOVE:
+            return {
+                'window_high': Decimal(repr(self.high)), 'window_high_at': self.high_at,
+                'window_low': Decimal(repr(self.low)), 'window_low_at': self.low_at,
+            }
+        return {}
+
+
+class _Block:
+    """
+    One symbol's rules compiled into a single evaluator: parallel columns,
+    grouped by rule kind (drop, rise, trail, move) and sorted by trigger
+    price within each group. Only chat ids are Python objects (interned, so
+    a chat's alerts share one string); the numbers live in typed arrays.
+    Rolling state columns exist only for the trail and move rows; minutes
+    is the set of distinct check intervals and unscheduled the rows stored
+    without due fields.
+    """
+    __slots__ = (
+        'chat_ids', 'baselines', 'thresholds', 'intervals', 'triggers', 'next_due', 'extras',
+        'bounds', 'cooldowns', 'windows', 'highs', 'high_ats', 'lows', 'low_ats', 'minutes', 'unscheduled',
+    )
+
+    def __init__(self, records):
+        order = {rule: n for n, rule in enumerate(RULES)}
+        records.sort(key=lambda r: (order[r.rule], r.trigger))
+        self.chat_ids = [sys.intern(r.chat_id) for r in records]
+        self.baselines = array('d', (r.baseline for r in records))
+        self.thresholds = array('d', (r.threshold for r in records))
+        self.intervals = array('d', (r.interval_minutes for r in records))
+        self.triggers = array('d', (r.trigger for r in records))
+        self.next_due = array('q', (r.next_due for r in records))
+        self.extras = {i: r.extra for i, r in enumerate(records) if r.extra}
+        # Row where each rule kind starts, plus the end
+        self.bounds = [bisect.bisect_left([order[r.rule] for r in records], n) for n in range(len(RULES))] + [len(records)]
+        self.cooldowns = {i: r.cooldown for i, r in enumerate(records) if r.cooldown}
+        stateful = records[self.bounds[2]:]
+        self.windows = array('d', (r.window for r in stateful))
+        self.highs = array('d', (r.high for r in stateful))
+        self.high_ats = array('q', (r.high_at for r in stateful))
+        self.lows = array('d', (r.low for r in stateful))
+        self.low_ats = array('q', (r.low_at for r in stateful))
+        self.minutes = set(self.intervals)
+        self.unscheduled = {i for i, r in enumerate(records) if not r.scheduled}
+
+    def take(self, rows):
+        """
+        A block of just these rows (ascending), copied column by column
+        without building AlertRecords. Rows stay grouped and sorted.
+        """
+        block = _Block.__new__(_Block)
+        block.chat_ids = [self.chat_ids[i] for i in rows]
+        for name in ('baselines', 'thresholds', 'intervals', 'triggers', 'next_due'):
+            column = getattr(self, name)
+            setattr(block, name, array(column.typecode, [column[i] for i in rows]))
+        block.extras = {n: self.extras[i] for n, i in enumerate(rows) if i in self.extras}
+        block.cooldowns = {n: self.cooldowns[i] for n, i in enumerate(rows) if i in self.cooldowns}
+        block.bounds = [bisect.bisect_left(rows, start) for start in self.bounds[:-1]] + [len(rows)]
+        stateful = [i - self.bounds[2] for i in rows[block.bounds[2]:]]
+        for name in ('windows', 'highs', 'high_ats', 'lows', 'low_ats'):
+            column = getattr(self, name)
+            setattr(block, name, array(column.typecode, [column[j] for j in stateful]))
+        block.minutes = set(block.intervals)
+        block.unscheduled = {n for n, i in enumerate(rows) if i in self.unscheduled}
+        return block
+
+    def __len__(self):
+        return len(self.chat_ids)
+
+    def records(self, symbol, rows):
+        """
+        AlertRecords for rows, ascending within each rule kind as evaluate
+        returns them.
+        """
+        chat_ids, baselines, thresholds, intervals, next_due = (
+            self.chat_ids, self.baselines, self.thresholds, self.intervals, self.next_due)
+        extras, cooldowns, bounds, stateful = self.extras, self.cooldowns, self.bounds, self.bounds[2]
+        unscheduled = self.unscheduled
+        result = []
+        for i in rows:
+            interval = intervals[i]
+            record = AlertRecord(
+                chat_ids[i], symbol, baselines[i], thresholds[i],
+                int(interval) if interval.is_integer() else interval, next_due[i],
+                extras.get(i) if extras else None,
+                RULES[bisect.bisect_right(bounds, i) - 1], cooldowns.get(i, 0) if cooldowns else 0,
+                scheduled=i not in unscheduled,
+            )
+            if i >= stateful:
+                j = i - stateful
+                record.window = self.windows[j]
+                record.high, record.high_at = self.highs[j], self.high_ats[j]
+                record.low, record.low_at = self.lows[j], self.low_ats[j]
+            result.append(record)
+        return result
+
+    def evaluate(self, price, now_ts):
+        """
+        Run every rule against one price in a single pass. Drop and rise
+        rows are split with one bisect each; trail and move rows update their
+        O(1) rolling state. Returns row lists (fired, held, changed), where
+        changed are held rows whose state moved and needs saving.
+        """
+        drop_end, rise_end, trail_end, end = self.bounds[1:]
+        cut = bisect.bisect_left(self.triggers, price, 0, drop_end)
+        fired, held = list(range(cut, drop_end)), list(range(cut))
+        cut = bisect.bisect_right(self.triggers, price, drop_end, rise_end)
+        fired.extend(range(drop_end, cut))
+        held.extend(range(cut, rise_end))
+        changed = []
+        highs, lows, thresholds = self.highs, self.lows, self.thresholds
+        for i in range(rise_end, trail_end):
+            j = i - rise_end
+            moved = price > highs[j]
+            if moved:
+                highs[j], self.high_ats[j] = price, int(now_ts)
+            if price <= highs[j] * (1 - thresholds[i] / 100):
+                fired.append(i)
+            else:
+                (changed if moved else held).append(i)
+        for i in range(trail_end, end):
+            j = i - rise_end
+            span = self.windows[j] * 60
+            moved = False
+            # An extreme older than the window restarts from the current price
+            if price > highs[j] or now_ts - self.high_ats[j] > span:
+                highs[j], self.high_ats[j], moved = price, int(now_ts), True
+            if price < lows[j] or now_ts - self.low_ats[j] > span:
+                lows[j], self.low_ats[j], moved = price, int(now_ts), True
+            pct = thresholds[i] / 100
+            if price >= lows[j] * (1 + pct) or price <= highs[j] * (1 - pct):
+                fired.append(i)
+            else:
+                (changed if moved else held).append(i)
+        return fired, held, changed
+
+
+class AlertStore:
+    """
+    Active alerts grouped by symbol into column blocks, built from a table
+    snapshot (or a page of query results) and evaluated a symbol at a time:
+    one bisect over the sorted triggers splits a price into the alerts it
+    fires and the ones it doesn't. AlertRecords are only materialized for
+    the rows a check returns; the checker settles held alerts on the
+    columns (evaluate_due).
+    """
+
+    def __init__(self, blocks=None):
+        self._blocks = blocks or {}
+
+    @classmethod
+    def load(cls, items):
+        by_symbol = {}
+        for item in items:
+            if item.get('alert_sent'):
+                continue
+            record = AlertRecord.from_item(item)
+            by_symbol.setdefault(record.symbol, []).append(record)
+        return cls({symbol: _Block(records) for symbol, records in by_symbol.items()})
+
+    @classmethod
+    def from_table(cls, tbl):
+        """
+        Snapshot every un-triggered alert in the table.
+        """
+        from boto3.dynamodb.conditions import Attr
+        from src.storage import iter_pages
+        return cls.load(iter_pages(tbl.scan, FilterExpression=Attr('alert_sent').eq(False)))
+
+    def __len__(self):
+        return sum(len(block) for block in self._blocks.values())
+
+    def symbols(self):
+        return list(self._blocks)
+
+    def count(self, symbol):
+        block = self._blocks.get(symbol)
+        return len(block) if block else 0
+
+    def earliest_due(self, symbol):
+        block = self._blocks.get(symbol)
+        return min(block.next_due) if block else None
+
+    def alerts(self, symbol):
+        block = self._blocks.get(symbol)
+        return block.records(symbol, range(len(block))) if block else []
+
+    def due(self, now_ts):
+        """
+        A store holding only the alerts whose next check has come.
+        """
+        blocks = {}
+        for symbol, block in self._blocks.items():
+            if max(block.next_due) <= now_ts:
+                blocks[symbol] = block
+                continue
+            rows = [i for i, due in enumerate(block.next_due) if due <= now_ts]
+            if len(rows) == len(block):
+                blocks[symbol] = block
+            elif rows:
+                blocks[symbol] = block.take(rows)
+        return AlertStore(blocks)
+
+    def evaluate(self, symbol, price, now_ts):
+        """
+        Evaluate all of a symbol's rules at price: (fired, held, changed)
+        AlertRecords, where changed are held alerts whose rolling state
+        (trailing peak, window extremes) moved. Records reflect the state
+        after this price.
+        """
+        block = self._blocks.get(symbol)
+        if block is None:
+            return [], [], []
+        return tuple(block.records(symbol, rows) for rows in block.evaluate(price, now_ts))
+
+    def evaluate_due(self, symbol, price, now_ts, reschedule):
+        """
+        evaluate() for the checker, which only writes a held alert back when
+        its next check moves, or when it has no due fields yet. The former
+        depends on nothing but the interval, so reschedule(minutes) is asked
+        once per distinct interval and held
+        alerts are settled on the columns: (chat_id, baseline, minutes) for
+        those to reschedule and a count of the rest. Returns (fired,
+        rescheduled, changed, skipped); only fired and changed alerts become
+        AlertRecords.
+        """
+        block = self._blocks.get(symbol)
+        if block is None:
+            return [], [], [], 0
+        fired, held, changed = block.evaluate(price, now_ts)
+        moving = {m for m in block.minutes if reschedule(int(m) if m.is_integer() else m)}
+        skipped = len(held)
+        if len(moving) < len(block.minutes):
+            intervals, unscheduled = block.intervals, block.unscheduled
+            held = [i for i in held if intervals[i] in moving or i in unscheduled]
+        skipped -= len(held)
+        chat_ids, baselines, intervals = block.chat_ids, block.baselines, block.intervals
+        rescheduled = [(chat_ids[i], baselines[i], intervals[i]) for i in held]
+        return block.records(symbol, fired), rescheduled, block.records(symbol, changed), skipped
+
+    def check(self, symbol, price, now_ts=0):
+        """
+        Split a symbol's alerts at price: (fired, held).
+        """
+        fired, held, changed = self.evaluate(symbol, price, now_ts)
+        return fired, held + changed
@@ -1,88 +1,293 @@
-
-
 import json
+import math
 import os
-from decimal import Decimal
 from datetime import datetime, timezone
 
-import urllib3
-import boto3
-from boto3.dynamodb.conditions import Attr
+from src.history import update_history, read_daily_series, valid_symbol
+from src.key_pool import pool_from_env
+from src.metrics import instrument
+from src.quote_cache import QuoteCache
+from src.rate_limit import INTERACTIVE, UpstreamDeferred, UpstreamScheduler
+from src.upstream import RESPONSE_CACHE_DIR, RESPONSE_CACHE_TTL, ResponseCache, make_pool
 
 # Configuration
-API_URL = f"https://api.telegram.org/bot{os.environ['BOT_TOKEN']}"
-HTTP = urllib3.PoolManager()
-DYNAMODB = boto3.resource('dynamodb')
+ALPHA_VANTAGE_URL = os.environ.get('ALPHA_VANTAGE_URL', 'https://www.alphavantage.co/query')
+TELEGRAM_API_URL = os.environ.get('TELEGRAM_API_URL', 'https://api.telegram.org')
+FANOUT_WORKERS = int(os.environ.get('QUOTE_FANOUT_WORKERS', '8'))
+FANOUT_TIMEOUT = float(os.environ.get('QUOTE_FANOUT_TIMEOUT', '8'))
+# REALTIME_BULK_QUOTES needs a premium key, so batching equities is opt-in
+BULK_QUOTES = os.environ.get('AV_BULK_QUOTES', '0') == '1'
+BULK_QUOTE_SIZE = int(os.environ.get('AV_BULK_QUOTE_SIZE', '100'))
+# One kept-alive connection per fan-out worker and host, gzip bodies
+HTTP = make_pool(FANOUT_WORKERS, read_timeout=FANOUT_TIMEOUT)
+# Tables are built on first use (see get_table) to keep cold starts light
+_TABLES = {}
+AV_REQUESTS_PER_MINUTE = float(os.environ.get('AV_REQUESTS_PER_MINUTE', '75'))
+# All Alpha Vantage requests share one per-key budget and backoff policy;
+# with ALPHA_VANTAGE_KEYS set they are spread over a pool of keys
+SCHEDULER = UpstreamScheduler(
+    HTTP,
+    requests_per_minute=AV_REQUESTS_PER_MINUTE,
+    interactive_reserve=int(os.environ.get('AV_INTERACTIVE_RESERVE', '5')),
+    max_retries=int(os.environ.get('AV_MAX_RETRIES', '3')),
+    timeout=FANOUT_TIMEOUT,
+    cache=ResponseCache(RESPONSE_CACHE_DIR, RESPONSE_CACHE_TTL) if RESPONSE_CACHE_DIR else None,
+    keys=pool_from_env(os.environ.get('ALPHA_VANTAGE_KEY'), AV_REQUESTS_PER_MINUTE, lambda: get_table('DDB_TABLE')),
+)
+# Module scope so warm Lambda containers keep serving cached quotes
+QUOTE_CACHE = QuoteCache(
+    ttl=float(os.environ.get('QUOTE_CACHE_TTL', '60')),
+    stale_ttl=float(os.environ.get('QUOTE_CACHE_STALE_TTL', '0')),
+    maxsize=int(os.environ.get('QUOTE_CACHE_SIZE', '1024')),
+)
 
 def get_table(name):
     """
-    Return a DynamoDB Table resource for the given environment variable key.
+    Return a DynamoDB table for the given environment variable key.
+    The table wraps the low-level client, created lazily and cached.
     """
-    return DYNAMODB.Table(os.environ[name])
+    table = _TABLES.get(name)
+    if table is None:
+        from src.ddb import ClientTable
+        table = _TABLES[name] = ClientTable(os.environ[name])
+    return table
 
+def api_url():
+    """
+    Telegram Bot API base URL, read from BOT_TOKEN when first needed.
+    """
+    return f"{TELEGRAM_API_URL}/bot{os.environ['BOT_TOKEN']}"
+
+@instrument('telegram.send')
 def send_message(chat_id, text):
     """
-    Send a Telegram message via the Bot API.
+    Send a Telegram message via the Bot API and return its decoded reply.
     """
-    HTTP.request(
+    resp = HTTP.request(
         'POST',
-        f"{API_URL}/sendMessage",
+        f"{api_url()}/sendMessage",
         body=json.dumps({'chat_id': chat_id, 'text': text}).encode('utf-8'),
         headers={'Content-Type': 'application/json'}
     )
+    try:
+        return json.loads(resp.data.decode())
+    except ValueError:
+        return {'ok': False, 'error_code': resp.status}
 
-def get_quote_data(symbol, alpha_key):
+@instrument('quote.get')
+def get_quote_data(symbol, alpha_key, priority=INTERACTIVE):
     """
     Fetch price, open, high, low, volume, and adjusted close for a symbol.
+    Results are served from QUOTE_CACHE while fresh.
+    """
+    return QUOTE_CACHE.get_or_fetch(f"quote:{symbol}", lambda: _fetch_quote_data(symbol, alpha_key, priority))
+
+def _fetch_quote_data(symbol, alpha_key, priority=INTERACTIVE):
+    """
+    Fetch a full quote for a symbol from Alpha Vantage, bypassing the cache.
     """
     if '-' in symbol:
         from_sym, to_sym = symbol.split('-')
         url = (
-            f"https://www.alphavantage.co/query"
+            f"{ALPHA_VANTAGE_URL}"
             f"?function=CURRENCY_EXCHANGE_RATE"
             f"&from_currency={from_sym}"
             f"&to_currency={to_sym}"
             f"&apikey={alpha_key}"
         )
-        resp = HTTP.request('GET', url)
-        data = json.loads(resp.data.decode())
+        data = SCHEDULER.request(url, alpha_key, priority)
         rate = data.get('Realtime Currency Exchange Rate', {}).get('5. Exchange Rate')
         return {'price': float(rate) if rate else None}
-    url = (
-        f"https://www.alphavantage.co/query"
-        f"?function=GLOBAL_QUOTE"
-        f"&symbol={symbol}"
-        f"&apikey={alpha_key}"
-    )
-    resp = HTTP.request('GET', url)
-    quote = json.loads(resp.data.decode()).get('Global Quote', {})
+    quote = SCHEDULER.request(_global_quote_url(symbol, alpha_key), alpha_key, priority).get('Global Quote', {})
     return {
         'price': float(quote.get('05. price', 0)),
         'open':   _to_float(quote.get('02. open')),
         'high':   _to_float(quote.get('03. high')),
         'low':    _to_float(quote.get('04. low')),
         'volume': quote.get('06. volume'),
-        'adj':    get_adjusted_close(symbol, alpha_key)
+        'adj':    get_adjusted_close(symbol, alpha_key, priority)
     }
 
-def get_adjusted_close(symbol, alpha_key):
+@instrument('quote.fanout')
+def fetch_quotes(symbols, alpha_key, max_workers=None, timeout=None, priority=INTERACTIVE, adjusted=True):
     """
-    Fetch the latest daily adjusted close for a stock symbol.
+    Bulk quote API: quotes for many symbols as symbol -> quote, each
+    distinct symbol fetched at most once. Fresh cached quotes are served
+    first. With AV_BULK_QUOTES on, remaining equities go through the
+    provider's bulk endpoint in chunks. FX/crypto pairs, which have no
+    batch endpoint, and anything the bulk call missed are fetched in
+    parallel. adjusted=False skips the adjusted-close call per equity when
+    only prices are needed.
+
+    Symbols that fail or run past their timeout map to {'price': None};
+    symbols deferred for lack of budget also carry 'deferred': True.
+    """
+    unique = list(dict.fromkeys(symbols))
+    quotes = {}
+    for sym in unique:
+        cached = _cached_quote(sym, adjusted)
+        if cached is not None:
+            quotes[sym] = cached
+    equities = [s for s in unique if s not in quotes and '-' not in s]
+    if BULK_QUOTES and equities:
+        quotes.update(_bulk_quotes(equities, alpha_key, priority, adjusted, max_workers, timeout))
+    rest = [s for s in unique if s not in quotes]
+    if adjusted:
+        fetch = lambda sym: get_quote_data(sym, alpha_key, priority=priority)
+    else:
+        fetch = lambda sym: {'price': get_price(sym, alpha_key, priority=priority)}
+    for sym, data in _fan_out(fetch, rest, max_workers, timeout).items():
+        if isinstance(data, UpstreamDeferred):
+            quotes[sym] = {'price': None, 'deferred': True}
+        elif isinstance(data, dict):
+            quotes[sym] = data
+        else:
+            quotes[sym] = {'price': None}
+    return {sym: quotes[sym] for sym in unique}
+
+def upstream_requests():
+    """
+    Provider requests sent so far by this process (retries included; cache
+    hits are not requests). Sample it before and after to count a job's.
+    """
+    return SCHEDULER.requests
+
+def _cached_quote(symbol, adjusted):
+    """
+    A fresh cached quote good enough for the caller, without fetching.
+    """
+    quote = QUOTE_CACHE.peek(f"quote:{symbol}")
+    if quote is not None or adjusted:
+        return quote
+    price = QUOTE_CACHE.peek(f"price:{symbol}")
+    return {'price': price} if price is not None else None
+
+def _fan_out(fn, symbols, max_workers=None, timeout=None):
+    """
+    Call fn(symbol) concurrently for each symbol. Returns symbol -> result,
+    the exception it raised, or None if it ran past its timeout.
+    """
+    from concurrent.futures import ThreadPoolExecutor, wait
+    if not symbols:
+        return {}
+    workers = max(1, min(max_workers or FANOUT_WORKERS, len(symbols)))
+    timeout = timeout if timeout is not None else FANOUT_TIMEOUT
+    pool = ThreadPoolExecutor(max_workers=workers)
+    futures = {sym: pool.submit(fn, sym) for sym in symbols}
+    # Each worker handles ceil(n / workers) symbols back to back
+    wait(futures.values(), timeout=timeout * math.ceil(len(symbols) / workers))
+    pool.shutdown(wait=False, cancel_futures=True)
+    results = {}
+    for sym, fut in futures.items():
+        if not fut.done() or fut.cancelled():
+            results[sym] = None
+        else:
+            results[sym] = fut.exception() or fut.result()
+    return results
+
+def _bulk_quotes(symbols, alpha_key, priority=INTERACTIVE, adjusted=True, max_workers=None, timeout=None):
+    """
+    Quote equities through REALTIME_BULK_QUOTES, BULK_QUOTE_SIZE per call,
+    caching each result. Symbols the provider did not return are left out
+    for the caller to fetch one by one.
+    """
+    chunks = [symbols[i:i + BULK_QUOTE_SIZE] for i in range(0, len(symbols), BULK_QUOTE_SIZE)]
+    quotes = {}
+    for chunk in chunks:
+        url = (
+            f"{ALPHA_VANTAGE_URL}"
+            f"?function=REALTIME_BULK_QUOTES"
+            f"&symbol={','.join(chunk)}"
+            f"&apikey={alpha_key}"
+        )
+        try:
+            rows = SCHEDULER.request(url, alpha_key, priority).get('data') or []
+        except Exception:
+            continue  # fall back to per-symbol fetches
+        wanted = set(chunk)
+        for row in rows:
+            sym = str(row.get('symbol', '')).upper()
+            price = _to_float(row.get('close'))
+            if sym in wanted and price is not None:
+                quotes[sym] = {
+                    'price': price,
+                    'open': _to_float(row.get('open')),
+                    'high': _to_float(row.get('high')),
+                    'low': _to_float(row.get('low')),
+                    'volume': row.get('volume'),
+                }
+                QUOTE_CACHE.set(f"price:{sym}", price)
+    if adjusted and quotes:
+        adj = _fan_out(lambda sym: get_adjusted_close(sym, alpha_key, priority), list(quotes), max_workers, timeout)
+        for sym, quote in quotes.items():
+            quote['adj'] = adj[sym] if isinstance(adj[sym], float) else None
+            QUOTE_CACHE.set(f"quote:{sym}", quote)
+    return quotes
+
+@instrument('quote.price')
+def get_price(symbol, alpha_key, priority=INTERACTIVE):
+    """
+    Fetch only the latest price for a symbol (at most one upstream call).
+    A fresh cached full quote is reused when available.
+    """
+    quote = QUOTE_CACHE.peek(f"quote:{symbol}")
+    if quote and quote.get('price') is not None:
+        return quote['price']
+    return QUOTE_CACHE.get_or_fetch(f"price:{symbol}", lambda: _fetch_price(symbol, alpha_key, priority))
+
+def _fetch_price(symbol, alpha_key, priority=INTERACTIVE):
+    """
+    Fetch the latest price for a symbol from Alpha Vantage, bypassing the cache.
     """
     if '-' in symbol:
-        return None
-    url = (
-        f"https://www.alphavantage.co/query"
-        f"?function=TIME_SERIES_DAILY_ADJUSTED"
+        return _fetch_quote_data(symbol, alpha_key, priority).get('price')
+    quote = SCHEDULER.request(_global_quote_url(symbol, alpha_key), alpha_key, priority).get('Global Quote', {})
+    return _to_float(quote.get('05. price'))
+
+def _global_quote_url(symbol, alpha_key):
+    """
+    Build the GLOBAL_QUOTE URL for a stock symbol.
+    """
+    return (
+        f"{ALPHA_VANTAGE_URL}"
+        f"?function=GLOBAL_QUOTE"
         f"&symbol={symbol}"
         f"&apikey={alpha_key}"
     )
-    resp = HTTP.request('GET', url)
-    ts = json.loads(resp.data.decode()).get('Time Series (Daily)', {})
-    if not ts:
+
+def get_adjusted_close(symbol, alpha_key, priority=INTERACTIVE):
+    """
+    Fetch the latest daily adjusted close for a stock symbol.
+    """
+    if '-' in symbol or not valid_symbol(symbol):
         return None
-    dates = sorted(ts.keys())
-    return float(ts[dates[-1]]['5. adjusted close'])
+    return QUOTE_CACHE.get_or_fetch(f"adj:{symbol}", lambda: _fetch_adjusted_close(symbol, alpha_key, priority))
+
+def _fetch_adjusted_close(symbol, alpha_key, priority=INTERACTIVE):
+    """
+    Latest daily adjusted close from the local price history, bypassing the cache.
+    """
+    last = get_history(symbol, alpha_key, priority).last()
+    return last.adj if last else None
+
+@instrument('quote.history')
+def get_history(symbol, alpha_key, priority=INTERACTIVE, since=None):
+    """
+    Local daily history for a symbol, topped up from Alpha Vantage with only
+    the bars it is missing. since is the oldest bar a range query needs;
+    the full series is only downloaded for bars older than what's stored.
+    """
+    def fetch_series(outputsize, newer_than=None):
+        url = (
+            f"{ALPHA_VANTAGE_URL}"
+            f"?function=TIME_SERIES_DAILY_ADJUSTED"
+            f"&symbol={symbol}"
+            f"&outputsize={outputsize}"
+            f"&apikey={alpha_key}"
+        )
+        # Parsed as it streams, stopping at the first bar already stored
+        return SCHEDULER.request(url, alpha_key, priority, parse=lambda chunks: read_daily_series(chunks, newer_than))
+    return update_history(symbol, fetch_series, since=since)
 
 def _to_float(val):
     """
@@ -117,28 +322,33 @@ def compute_cagr(baselines, current_total, created_iso):
     """
     Compute the annualized CAGR based on baselines and current total.
     """
+    from decimal import Decimal
     baseline_sum = sum(baselines)
     if baseline_sum <= 0:
         return 0.0
     # Convert current_total (float) to Decimal for safe arithmetic
     current_dec = Decimal(str(current_total))
-    total_return = current_dec / baseline_sum - Decimal('1')
+    total_return = current_dec / Decimal(str(baseline_sum)) - Decimal('1')
     if created_iso:
         created_dt = datetime.fromisoformat(created_iso)
         delta = datetime.now(timezone.utc) - created_dt
         years = delta.days / 365.25 if delta.days > 0 else 0
         if years > 0:
-            return ((1 + total_return) ** (1 / years) - 1) * 100
-    return total_return * 100
+            # Decimal does not support fractional float exponents
+            return ((1 + float(total_return)) ** (1 / years) - 1) * 100
+    return float(total_return) * 100
 
-def avg_equal_return(baselines, symbols, alpha_key):
+def avg_equal_return(baselines, symbols, alpha_key, quotes=None):
     """
     Compute the equal-weight average return across symbols.
+    Pass already-fetched quotes to avoid refetching them.
     """
+    if quotes is None:
+        quotes = fetch_quotes(symbols, alpha_key)
     rets = []
     for base, sym in zip(baselines, symbols):
-        data = get_quote_data(sym, alpha_key)
-        price = data.get('price') or 0
+        price = quotes.get(sym, {}).get('price') or 0
+        base = float(base)
         if base > 0:
             rets.append((price / base - 1) * 100)
     return sum(rets) / len(rets) if rets else 0.0
\ No newline at end of file
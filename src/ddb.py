@@ -0,0 +1,141 @@
+from functools import lru_cache
+
+from src.metrics import instrument
+
+
+@lru_cache(maxsize=None)
+def dynamodb_client():
+    """
+    Build the low-level DynamoDB client on first use and reuse it for the
+    life of the container. boto3 is imported here, not at module load, so
+    commands that never touch DynamoDB don't pay for it on cold start.
+    """
+    import boto3
+    return boto3.client('dynamodb')
+
+
+@lru_cache(maxsize=None)
+def _codecs():
+    from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+    return TypeSerializer(), TypeDeserializer()
+
+
+def serialize(item):
+    serializer = _codecs()[0]
+    return {k: serializer.serialize(v) for k, v in item.items()}
+
+
+def deserialize(item):
+    deserializer = _codecs()[1]
+    return {k: deserializer.deserialize(v) for k, v in item.items()}
+
+
+class ClientTable:
+    """
+    Drop-in for the parts of the boto3 Table resource the bot uses, built
+    on the low-level client, which is cheaper to construct than the
+    resource layer. Items go in and come out as plain Python values, and
+    conditions are boto3 Key/Attr objects, exactly as with Table.
+    """
+
+    def __init__(self, name, client=None):
+        self.name = name
+        self._client = client
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = dynamodb_client()
+        return self._client
+
+    def _with_conditions(self, params, **conditions):
+        """
+        Render Key/Attr conditions into expression strings and placeholders.
+        """
+        from boto3.dynamodb.conditions import ConditionExpressionBuilder
+        builder = ConditionExpressionBuilder()
+        names = dict(params.pop('ExpressionAttributeNames', {}))
+        values = dict(params.pop('ExpressionAttributeValues', {}))
+        for param, condition in conditions.items():
+            if condition is None:
+                continue
+            built = builder.build_expression(condition, is_key_condition=(param == 'KeyConditionExpression'))
+            params[param] = built.condition_expression
+            names.update(built.attribute_name_placeholders)
+            values.update(built.attribute_value_placeholders)
+        if names:
+            params['ExpressionAttributeNames'] = names
+        if values:
+            params['ExpressionAttributeValues'] = serialize(values)
+        return params
+
+    @instrument('ddb.get_item')
+    def get_item(self, Key):
+        resp = self.client.get_item(TableName=self.name, Key=serialize(Key))
+        return {'Item': deserialize(resp['Item'])} if 'Item' in resp else {}
+
+    @instrument('ddb.put_item')
+    def put_item(self, Item, ConditionExpression=None):
+        params = {'TableName': self.name, 'Item': serialize(Item)}
+        return self.client.put_item(**self._with_conditions(params, ConditionExpression=ConditionExpression))
+
+    @instrument('ddb.delete_item')
+    def delete_item(self, Key, ConditionExpression=None):
+        params = {'TableName': self.name, 'Key': serialize(Key)}
+        return self.client.delete_item(**self._with_conditions(params, ConditionExpression=ConditionExpression))
+
+    @instrument('ddb.update_item')
+    def update_item(self, Key, UpdateExpression, ExpressionAttributeValues=None, ConditionExpression=None):
+        params = {'TableName': self.name, 'Key': serialize(Key), 'UpdateExpression': UpdateExpression}
+        if ExpressionAttributeValues:
+            params['ExpressionAttributeValues'] = ExpressionAttributeValues
+        return self.client.update_item(**self._with_conditions(params, ConditionExpression=ConditionExpression))
+
+    def _read(self, operation, params, ExclusiveStartKey, Limit):
+        if ExclusiveStartKey:
+            params['ExclusiveStartKey'] = serialize(ExclusiveStartKey)
+        if Limit:
+            params['Limit'] = Limit
+        resp = operation(**params)
+        out = {'Items': [deserialize(it) for it in resp.get('Items', [])], 'Count': resp.get('Count', 0)}
+        if 'LastEvaluatedKey' in resp:
+            out['LastEvaluatedKey'] = deserialize(resp['LastEvaluatedKey'])
+        return out
+
+    @instrument('ddb.query')
+    def query(self, KeyConditionExpression, IndexName=None, FilterExpression=None,
+              ExclusiveStartKey=None, Limit=None):
+        params = {'TableName': self.name}
+        if IndexName:
+            params['IndexName'] = IndexName
+        params = self._with_conditions(
+            params, KeyConditionExpression=KeyConditionExpression, FilterExpression=FilterExpression)
+        return self._read(self.client.query, params, ExclusiveStartKey, Limit)
+
+    @instrument('ddb.scan')
+    def scan(self, FilterExpression=None, ExclusiveStartKey=None, Limit=None):
+        params = self._with_conditions({'TableName': self.name}, FilterExpression=FilterExpression)
+        return self._read(self.client.scan, params, ExclusiveStartKey, Limit)
+
+    def batch_writer(self, overwrite_by_pkeys=None):
+        # boto3's BatchWriter handles chunking and retries; this table acts
+        # as its client so items are serialized on the way through
+        from boto3.dynamodb.table import BatchWriter
+        return BatchWriter(self.name, self, overwrite_by_pkeys=overwrite_by_pkeys)
+
+    @instrument('ddb.batch_write_item')
+    def batch_write_item(self, RequestItems):
+        requests = []
+        for req in RequestItems.get(self.name, []):
+            if 'PutRequest' in req:
+                requests.append({'PutRequest': {'Item': serialize(req['PutRequest']['Item'])}})
+            else:
+                requests.append({'DeleteRequest': {'Key': serialize(req['DeleteRequest']['Key'])}})
+        resp = self.client.batch_write_item(RequestItems={self.name: requests})
+        unprocessed = []
+        for req in resp.get('UnprocessedItems', {}).get(self.name, []):
+            if 'PutRequest' in req:
+                unprocessed.append({'PutRequest': {'Item': deserialize(req['PutRequest']['Item'])}})
+            else:
+                unprocessed.append({'DeleteRequest': {'Key': deserialize(req['DeleteRequest']['Key'])}})
+        return {'UnprocessedItems': {self.name: unprocessed} if unprocessed else {}}
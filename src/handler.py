@@ -1,21 +1,61 @@
 import json
 import os
+import time
+import uuid
 from datetime import datetime, timezone
 
 from src.bot_helpers import (
     get_table,
     send_message,
     get_quote_data,
+    fetch_quotes,
+    upstream_requests,
     format_price_line,
-    compute_cagr,
+    get_history,
 )
+from src import market_hours, metrics
+from src.market_hours import get_calendar
+from src.rate_limit import SCHEDULED, UpstreamThrottled
+from src.storage import (
+    query_chat,
+    due_fields,
+    due_shard,
+    iter_due_alerts,
+    needs_reschedule,
+    batch_delete,
+    alert_update,
+    AlertWriteBuffer,
+)
+from src.sharding import (
+    CHECKER_WORKERS,
+    SHARD_WORKER_FUNCTION,
+    plan_shards,
+    acquire_lease,
+    release_lease,
+    map_shards,
+    dispatch_shards,
+)
+from src.outbound import OutboundQueue
+from src.alert_store import AlertStore
+from src.history import period_return, index_cagr, valid_symbol
+from src.rules import parse_rule, initial_state, rule_of, describe, alert_text
+from src.valuations import (
+    index_key,
+    valuate,
+    to_attribute,
+    from_attribute,
+    is_stale,
+    write_valuation,
+    put_index,
+    delete_index,
+    revalue_indexes,
+)
+from src.updates import get_queue, enqueue_update, mark_seen, forget
 
 ALPHA_VANTAGE_KEY = os.environ['ALPHA_VANTAGE_KEY']
 
 
 # --- Handler function definitions ---
-from decimal import Decimal
-
 def handle_start(body):
     chat_id = str(body.get('message', {}).get('chat', {}).get('id', ''))
     send_message(chat_id,
@@ -25,46 +65,69 @@ def handle_start(body):
     return {'statusCode': 200}
 
 def handle_set(body):
+    from decimal import Decimal
     chat_id = str(body.get('message', {}).get('chat', {}).get('id', ''))
     text = body.get('message', {}).get('text', '').strip()
     parts = text.split()
-    if len(parts) != 4:
-        send_message(chat_id, "Ayo, use: !set <SYMBOL> <DROP%> <MINUTES> fam 👀\nExample: !set AAPL 5 60")
+    if len(parts) < 4:
+        send_message(chat_id,
+            "Ayo, use: !set <SYMBOL> [drop|rise|trail|move] <PERCENT> <MINUTES> [window=MIN] [cooldown=MIN] fam 👀\n"
+            "Example: !set AAPL 5 60 or !set TSLA trail 8 15 cooldown=240"
+        )
         return {'statusCode': 200}
     try:
         symbol = parts[1].upper()
-        threshold_percent = Decimal(str(float(parts[2])))
-        interval_minutes = Decimal(str(int(parts[3])))
+        rule = parse_rule(parts[2:])
     except:
         send_message(chat_id, "Bro, gimme real numbers for percent and minutes.")
         return {'statusCode': 200}
-    data = get_quote_data(symbol, ALPHA_VANTAGE_KEY)
+    try:
+        data = get_quote_data(symbol, ALPHA_VANTAGE_KEY)
+    except UpstreamThrottled:
+        send_message(chat_id, "Market data plug is rate-limiting us rn. Try again in a minute. ⏳")
+        return {'statusCode': 200}
     initial_price = data.get('price')
     if initial_price is None:
         send_message(chat_id, f"Bruh, couldn't fetch price for {symbol}. Try again.")
         return {'statusCode': 200}
     tbl = get_table('DDB_TABLE')
-    tbl.put_item(Item={
+    now = datetime.now(timezone.utc)
+    item = {
         'chat_id': chat_id,
         'symbol': symbol,
-        'threshold_percent': threshold_percent,
-        'interval_minutes': interval_minutes,
+        **rule,
         'alert_sent': False,
         'baseline_price': Decimal(str(initial_price)),
-        'last_check': datetime.now(timezone.utc).isoformat()
-    })
-    send_message(chat_id, f'💯 Bet! Alert set for {symbol}: {threshold_percent}% drop in {interval_minutes} min.')
+        'last_check': now.isoformat(),
+        **initial_state(rule_of(rule), initial_price, now.timestamp()),
+        **due_fields(symbol, rule['interval_minutes'], now),
+    }
+    tbl.put_item(Item=item)
+    send_message(chat_id, f'💯 Bet! Alert set for {symbol}: {describe(item)}.')
     return {'statusCode': 200}
 
 def handle_price(body):
     chat_id = str(body.get('message', {}).get('chat', {}).get('id', ''))
     text = body.get('message', {}).get('text', '').strip()
     parts = text.split()
-    if len(parts) != 2:
-        send_message(chat_id, "Fam, use: !price <SYMBOL>\nExample: !price BTC-USD")
+    if len(parts) < 2:
+        send_message(chat_id, "Fam, use: !price <SYMBOL> [SYMBOL2 ...]\nExample: !price AAPL BTC-USD")
+        return {'statusCode': 200}
+    if len(parts) > 2:
+        # Many symbols: one bulk fetch, one reply
+        quotes = fetch_quotes([s.upper() for s in parts[1:]], ALPHA_VANTAGE_KEY)
+        lines = [
+            format_price_line(sym, data) if data.get('price') is not None else f"⚪ • {sym}: price unavailable"
+            for sym, data in quotes.items()
+        ]
+        send_message(chat_id, "\n".join(lines))
         return {'statusCode': 200}
     symbol = parts[1].upper()
-    data = get_quote_data(symbol, ALPHA_VANTAGE_KEY)
+    try:
+        data = get_quote_data(symbol, ALPHA_VANTAGE_KEY)
+    except UpstreamThrottled:
+        send_message(chat_id, "Market data plug is rate-limiting us rn. Try again in a minute. ⏳")
+        return {'statusCode': 200}
     if not data or data.get('price') is None:
         send_message(chat_id, f"Bruh, couldn't fetch price for '{symbol}'.")
         return {'statusCode': 200}
@@ -73,17 +136,15 @@ def handle_price(body):
     return {'statusCode': 200}
 
 def handle_list(body):
-    from boto3.dynamodb.conditions import Attr
     chat_id = str(body.get('message', {}).get('chat', {}).get('id', ''))
     tbl = get_table('DDB_TABLE')
-    resp = tbl.scan(FilterExpression=Attr('chat_id').eq(chat_id))
-    items = resp.get('Items', [])
+    items = list(query_chat(tbl, chat_id))
     if not items:
         send_message(chat_id, "No alerts yet, chief. Set one and let's get this bread!")
     else:
         msg = "👀 Here's your alert squad:\n"
         for it in items:
-            msg += f'• {it["symbol"]} – {it["threshold_percent"]}% drop in {it["interval_minutes"]} min\n'
+            msg += f'• {it["symbol"]} – {describe(it)}\n'
         send_message(chat_id, msg)
     return {'statusCode': 200}
 
@@ -101,16 +162,16 @@ def handle_delete(body):
     return {'statusCode': 200}
 
 def handle_reset(body):
-    from boto3.dynamodb.conditions import Attr
     chat_id = str(body.get('message', {}).get('chat', {}).get('id', ''))
     tbl = get_table('DDB_TABLE')
-    resp = tbl.scan(FilterExpression=Attr('chat_id').eq(chat_id))
-    for it in resp.get('Items', []):
-        tbl.delete_item(Key={'chat_id': chat_id, 'symbol': it['symbol']})
+    # Materialize first so deletes don't disturb pagination
+    keys = [{'chat_id': chat_id, 'symbol': it['symbol']} for it in query_chat(tbl, chat_id)]
+    batch_delete(tbl, keys)
     send_message(chat_id, "All alerts nuked, we good. 🚮")
     return {'statusCode': 200}
 
 def handle_createindex(body):
+    from decimal import Decimal
     chat_id = str(body.get('message', {}).get('chat', {}).get('id', ''))
     text = body.get('message', {}).get('text', '').strip()
     parts = text.split()
@@ -121,22 +182,73 @@ def handle_createindex(body):
     symbols = [s.upper() for s in parts[2:]]
     idx_tbl = get_table('INDEX_TABLE')
     created_at = datetime.now(timezone.utc).isoformat()
+    quotes = fetch_quotes(symbols, ALPHA_VANTAGE_KEY)
     baseline_prices = []
     for sym in symbols:
-        data = get_quote_data(sym, ALPHA_VANTAGE_KEY)
-        price = data.get('price')
+        price = quotes[sym].get('price')
         baseline_prices.append(Decimal(str(price)) if price is not None else Decimal('0'))
-    idx_tbl.put_item(Item={
+    item = {
         'chat_id': chat_id,
         'index_name': name,
         'symbols': symbols,
         'baseline_price': sum(baseline_prices),
         'baseline_prices': baseline_prices,
         'created_at': created_at,
-    })
+    }
+    # Materialized at creation; price_checker keeps it current
+    prices = {sym: quotes[sym].get('price') for sym in symbols}
+    item['valuation'] = to_attribute(valuate(item, prices))
+    put_index(idx_tbl, item)
     send_message(chat_id, f'🔥 Squad mix "{name}" locked in: {", ".join(symbols)}')
     return {'statusCode': 200}
 
+def _format_valuation(name, item, valuation, adj_cagr=None):
+    """
+    Render a materialized index valuation: one line per symbol, then totals.
+    """
+    lines = []
+    for sym in item['symbols']:
+        price = valuation['prices'].get(sym)
+        if price is None:
+            lines.append(f"⚪ • {sym}: price unavailable")
+            continue
+        ret = valuation['returns'].get(sym)
+        color = '🟢' if ret and ret > 0 else '🔴' if ret and ret < 0 else '⚪'
+        line = f"{color} • {sym}: ${price:.2f}"
+        if ret is not None:
+            line += f" ({ret:+.2f}%)"
+        lines.append(line)
+    msg = f"💹 Squad mix: {name}\n" + "\n".join(lines)
+    msg += f"\n💰 Value: ${valuation['total']:.2f}"
+    msg += f"\n💼 Portfolio Return (CAGR): {valuation['cagr']:.2f}%\n"
+    msg += f"📊 Avg Symbol Return: {valuation['avg_return']:.2f}%\n"
+    if adj_cagr is not None:
+        msg += f"📈 Adjusted CAGR (splits & dividends): {adj_cagr:.2f}%\n"
+    if valuation.get('as_of'):
+        msg += f"🕒 As of {valuation['as_of'][:10]} {valuation['as_of'][11:16]} UTC\n"
+    return msg
+
+def _current_valuations(idx_tbl, items):
+    """
+    The stored valuation of each valued index item. Those older than
+    VALUATION_MAX_AGE are requoted in one bulk fetch and written back, so
+    indexes whose symbols no alert watches still move; a symbol that fails
+    to quote keeps its stored price.
+    """
+    valuations = [from_attribute(it['valuation']) for it in items]
+    stale = [n for n, valuation in enumerate(valuations) if is_stale(valuation)]
+    if not stale:
+        return valuations
+    quotes = fetch_quotes([sym for n in stale for sym in items[n]['symbols']], ALPHA_VANTAGE_KEY, adjusted=False)
+    for n in stale:
+        item = items[n]
+        prices = dict(valuations[n]['prices'])
+        prices.update((sym, quotes[sym]['price']) for sym in item['symbols'] if quotes[sym].get('price') is not None)
+        valuations[n] = valuate(item, prices)
+        # Losing to a concurrent revalue is fine: theirs is as fresh
+        write_valuation(idx_tbl, index_key(item), item['valuation'], valuations[n])
+    return valuations
+
 def handle_index(body):
     chat_id = str(body.get('message', {}).get('chat', {}).get('id', ''))
     text = body.get('message', {}).get('text', '').strip()
@@ -151,31 +263,19 @@ def handle_index(body):
     if not item:
         send_message(chat_id, f"Sheesh, squad mix \"{name}\" not found.")
         return {'statusCode': 200}
-    symbols = item['symbols']
-    baselines = [Decimal(str(bp)) for bp in item.get('baseline_prices', [])]
-    created_iso = item.get('created_at')
-    lines = []
-    total_current = 0.0
-    for sym, base in zip(symbols, baselines):
-        data = get_quote_data(sym, ALPHA_VANTAGE_KEY)
-        lines.append(format_price_line(sym, data))
-        total_current += data.get('price') or 0.0
-    # Convert total_current to Decimal for compute_cagr
-    current_total_dec = Decimal(str(total_current))
-    cagr = compute_cagr(baselines, current_total_dec, created_iso)
-    # Compute average symbol return to avoid mixing Decimal and float
-    ind_returns = []
-    for sym, base in zip(symbols, baselines):
-        data = get_quote_data(sym, ALPHA_VANTAGE_KEY)
-        price = data.get('price') or 0.0
-        base_f = float(base)
-        if base_f > 0:
-            ind_returns.append((price / base_f - 1) * 100)
-    avg_ret = sum(ind_returns) / len(ind_returns) if ind_returns else 0.0
-    msg = f"💹 Squad mix: {name}\n" + "\n".join(lines)
-    msg += f"\n💼 Portfolio Return (CAGR): {cagr:.2f}%\n"
-    msg += f"📊 Avg Symbol Return: {avg_ret:.2f}%\n"
-    send_message(chat_id, msg)
+    if item.get('valuation'):
+        # Kept current by price_checker, and requoted here once too old
+        valuation = _current_valuations(idx_tbl, [item])[0]
+    else:
+        # Created before valuations were materialized: value it once now,
+        # and give it the symbol refs price_checker finds it by
+        quotes = fetch_quotes(item['symbols'], ALPHA_VANTAGE_KEY, adjusted=False)
+        valuation = valuate(item, {sym: q.get('price') for sym, q in quotes.items()})
+        item['valuation'] = to_attribute(valuation)
+        put_index(idx_tbl, item)
+    # Local history only; None until every symbol's bars reach created_at
+    adj_cagr = index_cagr(item['symbols'], item.get('created_at'))
+    send_message(chat_id, _format_valuation(name, item, valuation, adj_cagr))
     return {'statusCode': 200}
 
 def handle_deleteindex(body):
@@ -187,32 +287,68 @@ def handle_deleteindex(body):
         return {'statusCode': 200}
     name = parts[1]
     idx_tbl = get_table('INDEX_TABLE')
-    idx_tbl.delete_item(Key={'chat_id': chat_id, 'index_name': name})
+    delete_index(idx_tbl, chat_id, name)
     send_message(chat_id, f'Dropped squad mix "{name}". Outta here! 🗑️')
     return {'statusCode': 200}
 
 def handle_indexes(body):
-    from boto3.dynamodb.conditions import Attr
     chat_id = str(body.get('message', {}).get('chat', {}).get('id', ''))
     idx_tbl = get_table('INDEX_TABLE')
-    resp = idx_tbl.scan(FilterExpression=Attr('chat_id').eq(chat_id))
-    items = resp.get('Items', [])
+    items = list(query_chat(idx_tbl, chat_id))
     if not items:
         send_message(chat_id, "No squad mixes saved, fam. Create one with !createindex.")
     else:
         msg = "📚 Your squad mixes:\n"
+        valued = [it for it in items if it.get('valuation')]
+        valuations = dict(zip(map(index_key, valued), _current_valuations(idx_tbl, valued)))
         for it in items:
-            msg += f'• {it["index_name"]}: {", ".join(it["symbols"])}\n'
+            msg += f'• {it["index_name"]}: {", ".join(it["symbols"])}'
+            if it.get('valuation'):
+                valuation = valuations[index_key(it)]
+                msg += f" — ${valuation['total']:.2f} ({valuation['avg_return']:+.2f}%)"
+            msg += "\n"
         send_message(chat_id, msg)
     return {'statusCode': 200}
 
+def handle_returns(body):
+    chat_id = str(body.get('message', {}).get('chat', {}).get('id', ''))
+    text = body.get('message', {}).get('text', '').strip()
+    parts = text.split()
+    if len(parts) != 3 or not parts[2].isdigit() or int(parts[2]) < 1:
+        send_message(chat_id, "Fam, use: !returns <SYMBOL> <DAYS>\nExample: !returns AAPL 30")
+        return {'statusCode': 200}
+    symbol, days = parts[1].upper(), int(parts[2])
+    if '-' in symbol or not valid_symbol(symbol):
+        send_message(chat_id, f"No daily history for '{symbol}', stocks only.")
+        return {'statusCode': 200}
+    try:
+        # Served from the local store; upstream only for bars it doesn't have yet
+        history = get_history(symbol, ALPHA_VANTAGE_KEY, since=time.time() - days * 86400)
+        result = period_return(history, days)
+    except UpstreamThrottled:
+        send_message(chat_id, "Market data plug is rate-limiting us rn. Try again in a minute. ⏳")
+        return {'statusCode': 200}
+    if result is None:
+        send_message(chat_id, f"Bruh, not enough history for '{symbol}' over {days} days.")
+        return {'statusCode': 200}
+    start, end = result['from'], result['to']
+    color = '🟢' if result['return'] > 0 else '🔴' if result['return'] < 0 else '⚪'
+    send_message(chat_id,
+        f"{color} • {symbol} {days}d: {result['return']:+.2f}%\n"
+        f"${start.adj:.2f} ({datetime.fromtimestamp(start.timestamp, timezone.utc):%Y-%m-%d}) → "
+        f"${end.adj:.2f} ({datetime.fromtimestamp(end.timestamp, timezone.utc):%Y-%m-%d})\n"
+        f"H:{result['high']:.2f}, L:{result['low']:.2f}"
+    )
+    return {'statusCode': 200}
+
 def handle_commands(body):
     chat_id = str(body.get('message', {}).get('chat', {}).get('id', ''))
     send_message(chat_id,
         "Here's the plug on commands:\n"
         "• !start\n"
-        "• !set <SYMBOL> <DROP%> <MINUTES>\n"
-        "• !price <SYMBOL>\n"
+        "• !set <SYMBOL> [drop|rise|trail|move] <PERCENT> <MINUTES> [window=MIN] [cooldown=MIN]\n"
+        "• !price <SYMBOL> [SYMBOL2 ...]\n"
+        "• !returns <SYMBOL> <DAYS>\n"
         "• !list\n"
         "• !delete <SYMBOL>\n"
         "• !reset\n"
@@ -229,6 +365,7 @@ COMMANDS = {
     '!start': handle_start,
     '!set': handle_set,
     '!price': handle_price,
+    '!returns': handle_returns,
     '!list': handle_list,
     '!delete': handle_delete,
     '!reset': handle_reset,
@@ -239,52 +376,277 @@ COMMANDS = {
     '!commands': handle_commands
 }
 
+def _command_of(body):
+    text = body.get('message',{}).get('text','').strip()
+    return text.split()[0] if text else ''
+
 def lambda_handler(event, context):
+    """
+    Telegram webhook. With a command queue configured (fast-ack mode) the
+    update is deduped on update_id, queued for command_worker and
+    acknowledged at once; otherwise the command runs inline.
+    """
     body = json.loads(event.get('body','{}'))
-    chat_id = str(body.get('message',{}).get('chat',{}).get('id',''))
-    text = body.get('message',{}).get('text','').strip()
-    cmd = text.split()[0] if text else ''
+    cmd = _command_of(body)
     handler = COMMANDS.get(cmd)
-    if handler:
-        return handler(body)
+    if not handler:
+        return {'statusCode':200}
+    queue = get_queue()
+    with metrics.invocation(Function='webhook', Command=cmd):
+        if queue is None:
+            return handler(body)
+        queued = enqueue_update(get_table('DDB_TABLE'), queue, body, time.time())
+        metrics.count('webhook.queued' if queued else 'webhook.duplicates')
     return {'statusCode':200}
 
+def command_worker(event, context):
+    """
+    Worker Lambda: run one command queued by the webhook, at most once per
+    update_id even if the queue delivers it twice.
+    """
+    body = event.get('update', {})
+    cmd = _command_of(body)
+    handler = COMMANDS.get(cmd)
+    if not handler:
+        return {'statusCode':200}
+    with metrics.invocation(Function='command_worker', Command=cmd):
+        update_id = body.get('update_id')
+        tbl = get_table('DDB_TABLE')
+        if update_id is not None and not mark_seen(tbl, 'run', update_id, time.time()):
+            metrics.count('worker.duplicates')
+            return {'statusCode':200}
+        try:
+            return handler(body)
+        except Exception:
+            # Let Lambda's retry of this event run the command again
+            if update_id is not None:
+                forget(tbl, 'run', update_id)
+            raise
+
+def _due_alerts(items, now):
+    """
+    Load un-alerted items into a compact store and keep those whose check
+    interval has elapsed.
+    """
+    return AlertStore.load(items).due(now.timestamp())
+
+def _evaluate_alerts(due):
+    """
+    Quote each due symbol once, in one bulk fetch, and run all of its rules
+    against that price in one pass. Equities whose market hasn't traded
+    since their alerts came due are left out of the fetch.
+    Returns the messages to send and the items to write, without touching
+    DynamoDB or Telegram, so it can run in a separate worker process.
+    """
+    from decimal import Decimal
+    started = time.perf_counter()
+    symbols = due.symbols()
+    result = {
+        'messages': [], 'writes': [], 'prices': {},
+        'alerts_due': len(due), 'symbols': len(symbols),
+        'upstream_calls': 0, 'alerts_triggered': 0, 'alerts_deferred': 0,
+        'alerts_errored': 0, 'writes_skipped': 0, 'symbols_idle': 0, 'alerts_idle': 0,
+    }
+    calendar = get_calendar()
+    now_ts = market_hours.now().timestamp()
+    active = [s for s in symbols if calendar.moved_since(s, due.earliest_due(s), now_ts)]
+    result['symbols_idle'] = len(symbols) - len(active)
+    # Left due: the first run after the next open picks them up
+    result['alerts_idle'] = len(due) - sum(due.count(s) for s in active)
+    requests = upstream_requests()
+    quotes = fetch_quotes(active, ALPHA_VANTAGE_KEY, priority=SCHEDULED, adjusted=False)
+    result['upstream_calls'] = upstream_requests() - requests
+    for symbol in active:
+        if quotes[symbol].get('deferred'):
+            # Out of budget: leave these alerts due so the next run picks them up
+            result['alerts_deferred'] += due.count(symbol)
+            continue
+        current_price = quotes[symbol]['price']
+        if current_price is None:
+            result['alerts_errored'] += due.count(symbol)
+            continue
+        result['prices'][symbol] = current_price
+        checked = market_hours.now()
+        checked_iso = checked.isoformat()
+        planned = {}  # interval -> due fields, shared by the symbol's alerts
+
+        def plan(minutes):
+            if minutes not in planned:
+                planned[minutes] = due_fields(symbol, minutes, checked)
+            return planned[minutes]
+
+        def reschedule(minutes):
+            return needs_reschedule(minutes, plan(minutes)['next_due'], checked.timestamp())
+        fired, held, changed, skipped = due.evaluate_due(symbol, current_price, checked.timestamp(), reschedule)
+        for alert in fired:
+            result['messages'].append((alert.chat_id, symbol, alert_text(symbol, alert, current_price)))
+            read_baseline = alert.baseline
+            if alert.cooldown:
+                # Re-armed from this price, next checked once the cooldown is over
+                alert.rearm(current_price, checked.timestamp())
+                fields = {'last_check': checked_iso, 'baseline_price': Decimal(repr(alert.baseline)),
+                          **alert.state_fields(), **plan(alert.cooldown)}
+                result['writes'].append(alert_update(alert.chat_id, symbol, read_baseline, fields))
+            else:
+                # Dropping the index keys takes the alert out of the sparse GSI
+                fields = {'last_check': checked_iso, 'alert_sent': True}
+                result['writes'].append(alert_update(alert.chat_id, symbol, read_baseline, fields, ('due_shard', 'next_due')))
+        result['alerts_triggered'] += len(fired)
+        # Held alerts whose next check wouldn't move are left as they are,
+        # unless they still need due fields
+        result['writes_skipped'] += skipped
+        for chat_id, baseline, minutes in held:
+            result['writes'].append(alert_update(chat_id, symbol, baseline, {'last_check': checked_iso, **plan(minutes)}))
+        for alert in changed:
+            # Rolling state moved, so it's saved even when the due time stays put
+            fields = plan(alert.interval_minutes)
+            if alert.scheduled and not needs_reschedule(alert.interval_minutes, fields['next_due'], checked.timestamp()):
+                fields = {'due_shard': due_shard(symbol), 'next_due': alert.next_due}
+            fields = {'last_check': checked_iso, **alert.state_fields(), **fields}
+            result['writes'].append(alert_update(alert.chat_id, symbol, alert.baseline, fields))
+    result['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    return result
+
+def _apply_results(tbl, result):
+    """
+    Apply a shard's state changes as conditional updates, claiming fired
+    alerts first: only those whose write landed are announced, through the
+    outbound queue, so one the stream fired meanwhile isn't sent twice.
+    """
+    writes = AlertWriteBuffer(tbl)
+    outbox = OutboundQueue(send_message)
+    messages = result.pop('messages')
+    try:
+        for write in result.pop('writes'):
+            writes.update(*write)
+        writes.flush({(chat_id, symbol) for chat_id, symbol, _ in messages})
+        for chat_id, symbol, text in messages:
+            if (chat_id, symbol) in writes.landed:
+                outbox.enqueue(chat_id, text)
+        delivery = outbox.flush()
+        result['messages_sent'] = delivery['sent']
+        result['messages_failed'] = delivery['failed']
+        result['messages_coalesced'] = delivery['coalesced']
+    finally:
+        writes.flush()
+        result['writes'] = len(writes.landed)
+        result['writes_stale'] = writes.stale
+    return result
+
+def _record_summary(summary):
+    """
+    Report a run summary's counters as metrics for this invocation.
+    """
+    for name, value in summary.items():
+        if isinstance(value, int):
+            metrics.count(f"checker.{name}", value)
+    if 'valuations' in summary:
+        metrics.count('valuations.revalued', summary['valuations']['revalued'])
+
+def _summarize(shard_results, upstream_calls=None):
+    """
+    Roll per-shard results up into one run summary, keeping per-shard timing.
+    upstream_calls, if given, replaces the per-shard request counts.
+    """
+    counters = ['alerts_scanned', 'alerts_due', 'symbols', 'upstream_calls', 'alerts_triggered',
+                'alerts_deferred', 'alerts_errored', 'writes', 'writes_skipped', 'writes_stale', 'symbols_idle', 'alerts_idle',
+                'messages_sent', 'messages_failed', 'messages_coalesced']
+    summary = {name: sum(r[name] for r in shard_results) for name in counters}
+    if upstream_calls is not None:
+        summary['upstream_calls'] = upstream_calls
+    # Scanned but not yet due (only the scan fallback reads those)
+    summary['alerts_skipped'] = summary['alerts_scanned'] - summary['alerts_due']
+    summary['upstream_calls_saved'] = summary['alerts_due'] - summary['upstream_calls']
+    summary['shards'] = [
+        {'worker': r['worker'], 'partitions': r['partitions'], 'alerts_due': r['alerts_due'], 'elapsed_ms': r['elapsed_ms']}
+        for r in shard_results
+    ]
+    return summary
+
+def _revalue(results):
+    """
+    Revalue the indexes holding symbols the alert checks quoted, from those
+    prices; they are taken out of the results so they stay out of the summary.
+    """
+    prices = {}
+    for result in results:
+        prices.update(result.pop('prices'))
+    return revalue_indexes(get_table('INDEX_TABLE'), prices)
+
+def run_price_checker(tbl, workers=1, executor='thread', run_id=None):
+    """
+    Run the whole check pipeline in this process against tbl, which may be
+    a MemoryTable for local runs. Due partitions are split across `workers`;
+    each worker's partitions are leased, read, and evaluated in parallel on
+    a thread (or process) pool, then results are applied here. See
+    map_shards for what a process pool does to the upstream budget.
+    """
+    run_id = run_id or uuid.uuid4().hex
+    now = market_hours.now()
+    requests = upstream_requests()
+    jobs = []
+    for worker, shards in enumerate(plan_shards(workers)):
+        leased = [s for s in shards if acquire_lease(tbl, f"due-shard#{s}", run_id, now.timestamp())]
+        scanned = list(iter_due_alerts(tbl, now, shards=leased))
+        jobs.append((worker, leased, len(scanned), _due_alerts(scanned, now)))
+    try:
+        evaluated = map_shards(_evaluate_alerts, [due for _, _, _, due in jobs], executor)
+        results = []
+        for (worker, leased, scanned, _), result in zip(jobs, evaluated):
+            result.update(worker=worker, partitions=leased, alerts_scanned=scanned)
+            results.append(_apply_results(tbl, result))
+    finally:
+        for _, leased, _, _ in jobs:
+            for s in leased:
+                release_lease(tbl, f"due-shard#{s}", run_id)
+    # Worker threads share this process's scheduler, so their own samples
+    # overlap; worker processes each count on their own
+    upstream_calls = upstream_requests() - requests if executor != 'process' else None
+    valuations = _revalue(results)
+    summary = _summarize(results, upstream_calls)
+    summary['valuations'] = valuations
+    return summary
+
+def shard_worker(event, context):
+    """
+    Worker Lambda: check the due partitions a price_checker run assigned to it.
+    """
+    tbl = get_table('DDB_TABLE')
+    run_id = event.get('run_id') or uuid.uuid4().hex
+    now = market_hours.now()
+    with metrics.invocation(Function='shard_worker'):
+        leased = [s for s in event.get('shards', []) if acquire_lease(tbl, f"due-shard#{s}", run_id, now.timestamp())]
+        try:
+            scanned = list(iter_due_alerts(tbl, now, shards=leased))
+            result = _evaluate_alerts(_due_alerts(scanned, now))
+            result.update(worker=event.get('worker', 0), partitions=leased, alerts_scanned=len(scanned))
+            results = [_apply_results(tbl, result)]
+            valuations = _revalue(results)
+            summary = _summarize(results)
+            summary['valuations'] = valuations
+        finally:
+            for s in leased:
+                release_lease(tbl, f"due-shard#{s}", run_id)
+        _record_summary(summary)
+    print(json.dumps({'shard_worker': summary}))
+    return {'statusCode': 200, 'body': json.dumps(summary)}
+
 def price_checker(event, context):
     """
     Scheduled function to scan alerts and send notifications when threshold is met.
+    Due alerts are grouped by symbol so each distinct symbol is quoted once per run.
+    With CHECKER_WORKERS > 1 the run is sharded by symbol hash, either across
+    worker Lambdas (SHARD_WORKER_FUNCTION) or across local processes.
     """
     tbl = get_table('DDB_TABLE')
-    response = tbl.scan(FilterExpression=Attr('alert_sent').eq(False))
-    for item in response.get('Items', []):
-        chat_id = item['chat_id']
-        symbol = item['symbol']
-        last = item.get('last_check')
-        if last:
-            last_dt = datetime.fromisoformat(last)
-            if (datetime.now(timezone.utc) - last_dt).total_seconds() < float(item.get('interval_minutes', 0)) * 60:
-                continue
-        baseline = float(item.get('baseline_price', 0))
-        threshold = float(item.get('threshold_percent', 0))
-        current_price = get_price(symbol)
-        if current_price is None:
-            tbl.update_item(
-                Key={'chat_id': chat_id, 'symbol': symbol},
-                UpdateExpression="SET last_check = :lc",
-                ExpressionAttributeValues={':lc': datetime.now(timezone.utc).isoformat()}
-            )
-            continue
-        alert_sent = False
-        # Detect drop beyond threshold
-        if current_price <= baseline * (1 - threshold / 100):
-            send_message(chat_id, f"🚨 {symbol} has dropped {threshold}% from ${baseline:.2f} to ${current_price:.2f}")
-            alert_sent = True
-        update_expr = "SET last_check = :lc"
-        expr_attr_vals = {':lc': datetime.now(timezone.utc).isoformat()}
-        if alert_sent:
-            update_expr += ", alert_sent = :val"
-            expr_attr_vals[':val'] = True
-        tbl.update_item(
-            Key={'chat_id': chat_id, 'symbol': symbol},
-            UpdateExpression=update_expr,
-            ExpressionAttributeValues=expr_attr_vals
-        )
+    plan = plan_shards(CHECKER_WORKERS)
+    with metrics.invocation(Function='price_checker'):
+        if SHARD_WORKER_FUNCTION and len(plan) > 1:
+            run_id = uuid.uuid4().hex
+            dispatch_shards(plan, SHARD_WORKER_FUNCTION, run_id)
+            summary = {'run_id': run_id, 'dispatched_workers': len(plan)}
+        else:
+            summary = run_price_checker(tbl, CHECKER_WORKERS)
+        _record_summary(summary)
+    print(json.dumps({'price_checker': summary}))
+    return {'statusCode': 200, 'body': json.dumps(summary)}
@@ -0,0 +1,311 @@
+import bisect
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timezone
+
+from src.upstream import MissingKey, stream_items
+
+# Lambda can only write under /tmp; a warm container keeps the files
+HISTORY_DIR = os.environ.get('HISTORY_DIR', '/tmp/price-history')
+# How long after a refresh a symbol's history is trusted without asking upstream
+HISTORY_REFRESH_SECONDS = int(os.environ.get('HISTORY_REFRESH_SECONDS', '3600'))
+# outputsize=compact returns the last 100 daily bars; older gaps need a full download
+COMPACT_BARS = 100
+# Ticker symbols as they name history files; anything else (e.g. a path) is refused
+SYMBOL_PATTERN = re.compile(r'[A-Z0-9][A-Z0-9.\-]{0,19}')
+
+# timestamp (epoch seconds, bar date at 00:00 UTC), open, high, low, close, adjusted close, volume
+RECORD = struct.Struct('<qdddddq')
+
+Bar = namedtuple('Bar', 'timestamp open high low close adj volume')
+
+
+class _Timestamps:
+    """
+    Sequence view of the timestamp column of a mapped file, for bisect.
+    """
+
+    def __init__(self, buf):
+        self.buf = buf
+
+    def __len__(self):
+        return len(self.buf) // RECORD.size
+
+    def __getitem__(self, i):
+        return struct.unpack_from('<q', self.buf, i * RECORD.size)[0]
+
+
+class PriceHistory:
+    """
+    Daily bars for one symbol in an append-only file of fixed-width records,
+    read through mmap so a range query touches only the records it returns.
+    """
+
+    def __init__(self, symbol, directory=None):
+        if not valid_symbol(symbol):
+            raise ValueError(f"not a ticker symbol: {symbol!r}")
+        self.symbol = symbol
+        self.path = os.path.join(directory or HISTORY_DIR, f"{symbol}.bin")
+        # Present once the full series has been stored
+        self.full_path = os.path.join(directory or HISTORY_DIR, f"{symbol}.full")
+
+    def __len__(self):
+        try:
+            return os.path.getsize(self.path) // RECORD.size
+        except FileNotFoundError:
+            return 0
+
+    def _read(self, pick):
+        """
+        Map the file read-only and return pick(buffer), or pick(b'') if empty.
+        """
+        try:
+            with open(self.path, 'rb') as fh:
+                if os.fstat(fh.fileno()).st_size < RECORD.size:
+                    return pick(b'')
+                with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                    return pick(buf)
+        except FileNotFoundError:
+            return pick(b'')
+
+    def first(self):
+        def pick(buf):
+            return Bar(*RECORD.unpack_from(buf, 0)) if len(buf) >= RECORD.size else None
+        return self._read(pick)
+
+    def last(self):
+        def pick(buf):
+            n = len(buf) // RECORD.size
+            return Bar(*RECORD.unpack_from(buf, (n - 1) * RECORD.size)) if n else None
+        return self._read(pick)
+
+    def range(self, start_ts=None, end_ts=None):
+        """
+        Bars with start_ts <= timestamp <= end_ts, oldest first.
+        """
+        def pick(buf):
+            stamps = _Timestamps(buf)
+            lo = 0 if start_ts is None else bisect.bisect_left(stamps, start_ts)
+            hi = len(stamps) if end_ts is None else bisect.bisect_right(stamps, end_ts)
+            return [Bar(*RECORD.unpack_from(buf, i * RECORD.size)) for i in range(lo, hi)]
+        return self._read(pick)
+
+    def at_or_before(self, ts):
+        """
+        The last bar on or before ts, or None if history starts later.
+        """
+        def pick(buf):
+            stamps = _Timestamps(buf)
+            i = bisect.bisect_right(stamps, ts) - 1
+            return Bar(*RECORD.unpack_from(buf, i * RECORD.size)) if i >= 0 else None
+        return self._read(pick)
+
+    def append(self, bars):
+        """
+        Append bars newer than the last stored one; returns how many were written.
+        The file is locked so concurrent workers can't interleave records.
+        """
+        import fcntl
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, 'ab') as fh:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+            try:
+                size = os.fstat(fh.fileno()).st_size
+                # Cut a torn trailing record so new records stay aligned
+                fh.truncate(size - size % RECORD.size)
+                last = self.last()
+                fresh = sorted(b for b in bars if last is None or b.timestamp > last.timestamp)
+                fh.write(b''.join(RECORD.pack(*bar) for bar in fresh))
+                return len(fresh)
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+    def backfill(self, bars):
+        """
+        Store a full series: bars older than the first stored one are put in
+        front, newer ones appended. The merged file replaces the old one
+        whole, so readers see either version.
+        """
+        import fcntl
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, 'ab') as fh:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+            try:
+                stored = self.range()
+                first = stored[0].timestamp if stored else None
+                last = stored[-1].timestamp if stored else None
+                older = sorted(b for b in bars if first is not None and b.timestamp < first)
+                newer = sorted(b for b in bars if last is None or b.timestamp > last)
+                tmp = f"{self.path}.{os.getpid()}.tmp"
+                with open(tmp, 'wb') as out:
+                    out.write(b''.join(RECORD.pack(*bar) for bar in older + stored + newer))
+                os.replace(tmp, self.path)
+                return len(older) + len(newer)
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+    def complete(self):
+        """
+        Whether the full series has been stored, so no older bars exist upstream.
+        """
+        return os.path.exists(self.full_path)
+
+    def mark_complete(self):
+        with open(self.full_path, 'ab'):
+            pass
+
+    def checked_at(self):
+        try:
+            return os.path.getmtime(self.path)
+        except FileNotFoundError:
+            return None
+
+    def touch(self, now=None):
+        """
+        Mark the history as refreshed at `now`, even if no new bars came in.
+        """
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, 'ab'):
+            pass
+        os.utime(self.path, None if now is None else (now, now))
+
+
+def valid_symbol(symbol):
+    return bool(SYMBOL_PATTERN.fullmatch(symbol))
+
+
+def day_timestamp(date_str):
+    return int(datetime.strptime(date_str, '%Y-%m-%d').replace(tzinfo=timezone.utc).timestamp())
+
+
+def parse_daily_series(payload):
+    """
+    Bars from a TIME_SERIES_DAILY_ADJUSTED payload, oldest first. Rows
+    without an adjusted close are skipped; missing OHLC fields fall back to it.
+    """
+    bars = []
+    for date_str, row in (payload.get('Time Series (Daily)') or {}).items():
+        try:
+            adj = float(row['5. adjusted close'])
+            close = float(row.get('4. close', adj))
+            bars.append(Bar(
+                day_timestamp(date_str),
+                float(row.get('1. open', close)), float(row.get('2. high', close)), float(row.get('3. low', close)),
+                close, adj, int(float(row.get('6. volume', 0))),
+            ))
+        except (KeyError, ValueError):
+            continue
+    return sorted(bars)
+
+
+def read_daily_series(chunks, newer_than=None):
+    """
+    Decode a TIME_SERIES_DAILY_ADJUSTED body from streamed chunks, keeping
+    only bars after newer_than. The provider lists dates newest first, so
+    reading stops at the first bar already stored. Bodies without a series
+    (throttle notes, errors) come back whole.
+    """
+    rows = {}
+    try:
+        for date_str, row in stream_items(chunks, 'Time Series (Daily)'):
+            if newer_than is not None and day_timestamp(date_str) <= newer_than:
+                break
+            rows[date_str] = row
+    except MissingKey as err:
+        return err.document
+    return {'Time Series (Daily)': rows}
+
+
+_LOCKS = {}
+_LOCKS_GUARD = threading.Lock()
+
+
+def update_history(symbol, fetch_series, now=None, directory=None, since=None):
+    """
+    Bring a symbol's history up to date and return it. fetch_series(outputsize,
+    newer_than) returns the provider payload, which only needs the bars after
+    newer_than. since is the oldest bar the caller needs (a range query's
+    start); without it only recent bars matter.
+
+    The full series is downloaded only when the stored bars don't reach back
+    to since and the compact series wouldn't either, or when the stored bars
+    end too long ago for the compact series to close the gap. Otherwise the
+    compact series is requested, and nothing at all while the last refresh
+    is younger than HISTORY_REFRESH_SECONDS.
+    """
+    now = time.time() if now is None else now
+    history = PriceHistory(symbol, directory)
+    with _LOCKS_GUARD:
+        lock = _LOCKS.setdefault(history.path, threading.Lock())
+    with lock:
+        first, last = history.first(), history.last()
+        # ~100 trading days span about 140 calendar days
+        compact_from = now - COMPACT_BARS * 7 / 5 * 86400
+        backfill = (since is not None and since < compact_from and not history.complete()
+                    and (first is None or first.timestamp > since))
+        checked = history.checked_at()
+        if last is not None and not backfill and checked is not None and now - checked < HISTORY_REFRESH_SECONDS:
+            return history
+        if backfill:
+            history.backfill(parse_daily_series(fetch_series('full', None)))
+            history.mark_complete()
+        else:
+            gap = last is not None and last.timestamp < compact_from
+            payload = fetch_series('full' if gap else 'compact', last.timestamp if last else None)
+            history.append(parse_daily_series(payload))
+        history.touch(now)
+    return history
+
+
+def period_return(history, days, now=None):
+    """
+    Close-to-close return in percent over the last `days` calendar days from
+    local bars (adjusted closes, so splits and dividends don't distort it),
+    plus the high and low seen. None if history doesn't reach back that far.
+    """
+    last = history.last()
+    if last is None:
+        return None
+    start = history.at_or_before((last.timestamp if now is None else now) - days * 86400)
+    if start is None or start.adj <= 0:
+        return None
+    bars = history.range(start.timestamp, last.timestamp)
+    return {
+        'from': start, 'to': last,
+        'return': (last.adj / start.adj - 1) * 100,
+        'high': max(b.high for b in bars), 'low': min(b.low for b in bars),
+    }
+
+
+def index_cagr(symbols, created_iso, now=None, directory=None):
+    """
+    Annualized return of an index (one share of each symbol) since
+    created_iso, from adjusted closes in the local history only. None unless
+    every symbol's history reaches back to the creation date.
+    """
+    if not created_iso:
+        return None
+    created = datetime.fromisoformat(created_iso)
+    start_total = end_total = 0.0
+    for sym in symbols:
+        if not valid_symbol(sym):
+            return None
+        history = PriceHistory(sym, directory)
+        start, last = history.at_or_before(created.timestamp()), history.last()
+        if start is None or last is None:
+            return None
+        start_total += start.adj
+        end_total += last.adj
+    if start_total <= 0:
+        return None
+    total_return = end_total / start_total - 1
+    delta = (now or datetime.now(timezone.utc)) - created
+    years = delta.days / 365.25 if delta.days > 0 else 0
+    if years > 0:
+        return ((1 + total_return) ** (1 / years) - 1) * 100
+    return total_return * 100
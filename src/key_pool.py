@@ -0,0 +1,217 @@
+import hashlib
+import os
+import re
+import threading
+import time
+from functools import lru_cache
+from urllib.parse import parse_qsl, urlsplit
+
+from src.metrics import count
+
+# Extra Alpha Vantage keys (comma-separated), pooled with ALPHA_VANTAGE_KEY
+ALPHA_VANTAGE_KEYS = os.environ.get('ALPHA_VANTAGE_KEYS', '')
+# Seconds a key that hit its quota is left out of the rotation
+KEY_EJECT_SECONDS = float(os.environ.get('AV_KEY_EJECT_SECONDS', '60'))
+# Requests claimed from the shared counter at once; unused ones lapse with the window
+QUOTA_LEASE = int(os.environ.get('AV_QUOTA_LEASE', '5'))
+# Set to 0 to count each container's usage on its own instead of in DynamoDB
+SHARED_QUOTA = os.environ.get('AV_SHARED_QUOTA', '1') == '1'
+# Provider quotas are per minute, counted in wall-clock windows every invocation agrees on
+QUOTA_WINDOW_SECONDS = 60
+# Usage counters live in the alerts table under a chat_id Telegram never uses.
+QUOTA_CHAT_ID = '#quota'
+
+_APIKEY = re.compile(r'([?&]apikey=)[^&]*')
+
+
+def key_id(api_key):
+    """
+    Short stable name for a key, so stored counters and logs never hold the key itself.
+    """
+    return hashlib.sha1(api_key.encode()).hexdigest()[:12]
+
+
+def route_of(url):
+    """
+    What a request is about, for picking its key: the symbol, the currency
+    pair, or failing those the whole query.
+    """
+    params = dict(parse_qsl(urlsplit(url).query))
+    if params.get('symbol'):
+        return params['symbol']
+    if params.get('from_currency'):
+        return f"{params['from_currency']}-{params.get('to_currency', '')}"
+    return urlsplit(url).query
+
+
+def with_key(url, api_key):
+    """
+    url with its apikey parameter set to api_key.
+    """
+    if _APIKEY.search(url):
+        return _APIKEY.sub(lambda m: m.group(1) + api_key, url, count=1)
+    return f"{url}{'&' if '?' in url else '?'}apikey={api_key}"
+
+
+class LocalQuotaStore:
+    """
+    In-memory usage counters: enough for one process, and for tests.
+    """
+
+    def __init__(self):
+        self.used = {}
+        self._lock = threading.Lock()
+
+    def claim(self, api_key, window, n, limit):
+        with self._lock:
+            used = self.used.get((api_key, window), 0)
+            if used + n > limit:
+                return False
+            self.used[(api_key, window)] = used + n
+            return True
+
+    def exhaust(self, api_key, window, limit):
+        with self._lock:
+            self.used[(api_key, window)] = limit
+
+
+class TableQuotaStore:
+    """
+    Usage counters shared by every invocation, one item per key and window
+    in the alerts table. A claim is a single conditional ADD, so concurrent
+    invocations can never hand out more than the limit between them.
+    Items expire through the table's `expires_at` TTL.
+    """
+
+    def __init__(self, get_table):
+        self.get_table = get_table
+
+    def _key(self, api_key, window):
+        return {'chat_id': QUOTA_CHAT_ID, 'symbol': f"{key_id(api_key)}#{window}"}
+
+    def claim(self, api_key, window, n, limit):
+        from boto3.dynamodb.conditions import Attr
+        from botocore.exceptions import ClientError
+        try:
+            self.get_table().update_item(
+                Key=self._key(api_key, window),
+                UpdateExpression='ADD request_count :n SET expires_at = :expires',
+                ExpressionAttributeValues={':n': n, ':expires': (window + 2) * QUOTA_WINDOW_SECONDS},
+                ConditionExpression=Attr('request_count').not_exists() | Attr('request_count').lte(limit - n),
+            )
+            return True
+        except ClientError as err:
+            if err.response.get('Error', {}).get('Code') == 'ConditionalCheckFailedException':
+                return False
+            raise
+
+    def exhaust(self, api_key, window, limit):
+        self.get_table().update_item(
+            Key=self._key(api_key, window),
+            UpdateExpression='SET request_count = :limit, expires_at = :expires',
+            ExpressionAttributeValues={':limit': limit, ':expires': (window + 2) * QUOTA_WINDOW_SECONDS},
+        )
+
+
+class KeyPool:
+    """
+    Provider API keys sharing the request load.
+
+    Each route (symbol) ranks the keys by rendezvous hash, so a symbol sticks
+    to one key while that key is healthy, and adding or ejecting a key only
+    moves that key's share of symbols. Quota is leased from the store a few
+    requests at a time; a key whose window is used up is skipped until the
+    next window, and one the provider throttled is ejected for
+    `eject_seconds` and marked used up for everyone.
+    """
+
+    def __init__(self, keys, requests_per_minute, store=None, lease=QUOTA_LEASE,
+                 eject_seconds=KEY_EJECT_SECONDS, clock=time.time):
+        self.keys = list(dict.fromkeys(keys))
+        self.limit = int(requests_per_minute * QUOTA_WINDOW_SECONDS / 60)
+        self.store = store or LocalQuotaStore()
+        self.lease = max(1, lease)
+        self.eject_seconds = eject_seconds
+        self.clock = clock
+        self.leases = {}     # key -> (window, requests left in the lease)
+        self.exhausted = {}  # key -> window the store refused
+        self.ejected = {}    # key -> until
+        self._lock = threading.Lock()
+        self.ranking = lru_cache(maxsize=4096)(self._ranking)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _ranking(self, route):
+        def weight(key):
+            return hashlib.blake2b(f"{key}|{route}".encode(), digest_size=8).digest()
+        return tuple(sorted(self.keys, key=weight, reverse=True))
+
+    def _window(self):
+        return int(self.clock() // QUOTA_WINDOW_SECONDS)
+
+    def candidates(self, route):
+        """
+        Keys for route in preference order, ejected ones left out.
+        """
+        now = self.clock()
+        return [key for key in self.ranking(route) if self.ejected.get(key, 0) <= now]
+
+    def claim(self, api_key):
+        """
+        Spend one request of api_key's quota in the current window, leasing
+        more from the store when the local lease runs out. False if the
+        window is used up.
+        """
+        window = self._window()
+        with self._lock:
+            if self.exhausted.get(api_key) == window:
+                return False
+            held, left = self.leases.get(api_key, (window, 0))
+            if held == window and left > 0:
+                self.leases[api_key] = (window, left - 1)
+                return True
+        for n in sorted({self.lease, 1}, reverse=True):
+            if self.store.claim(api_key, window, n, self.limit):
+                count('upstream.quota_leases')
+                with self._lock:
+                    held, left = self.leases.get(api_key, (window, 0))
+                    self.leases[api_key] = (window, (left if held == window else 0) + n - 1)
+                return True
+        with self._lock:
+            self.exhausted[api_key] = window
+        return False
+
+    def quota_wait(self, api_key):
+        """
+        Seconds until api_key can be claimed again: 0 unless its window is used up.
+        """
+        window = self._window()
+        if self.exhausted.get(api_key) != window:
+            return 0.0
+        return (window + 1) * QUOTA_WINDOW_SECONDS - self.clock()
+
+    def eject(self, api_key):
+        """
+        Take a throttled key out of the rotation and mark its window used up
+        in the store, so other invocations skip it too.
+        """
+        window = self._window()
+        with self._lock:
+            self.ejected[api_key] = self.clock() + self.eject_seconds
+            self.leases.pop(api_key, None)
+            self.exhausted[api_key] = window
+        self.store.exhaust(api_key, window, self.limit)
+        count('upstream.key_ejected')
+
+
+def pool_from_env(primary_key, requests_per_minute, get_table):
+    """
+    KeyPool over ALPHA_VANTAGE_KEY plus ALPHA_VANTAGE_KEYS, or None with a
+    single key (requests then go out with the caller's key as before).
+    """
+    keys = [k.strip() for k in [primary_key or ''] + ALPHA_VANTAGE_KEYS.split(',') if k.strip()]
+    if len(set(keys)) < 2:
+        return None
+    store = TableQuotaStore(get_table) if SHARED_QUOTA else LocalQuotaStore()
+    return KeyPool(keys, requests_per_minute, store=store)
@@ -0,0 +1,198 @@
+import os
+from datetime import date, datetime, timedelta, timezone
+from functools import lru_cache
+
+# Set to 0 to check every symbol around the clock, as before market hours existed
+MARKET_HOURS = os.environ.get('MARKET_HOURS', '1') == '1'
+# Extra closed days (YYYY-MM-DD, comma-separated) on top of the table below
+MARKET_EXTRA_HOLIDAYS = os.environ.get('MARKET_EXTRA_HOLIDAYS', '')
+
+# US equity regular session, exchange local time (America/New_York)
+SESSION_OPEN = (9, 30)
+SESSION_CLOSE = (16, 0)
+EARLY_CLOSE = (13, 0)
+
+# NYSE/Nasdaq full-day closures
+HOLIDAYS = {
+    '2024-01-01', '2024-01-15', '2024-02-19', '2024-03-29', '2024-05-27', '2024-06-19',
+    '2024-07-04', '2024-09-02', '2024-11-28', '2024-12-25',
+    '2025-01-01', '2025-01-09', '2025-01-20', '2025-02-17', '2025-04-18', '2025-05-26',
+    '2025-06-19', '2025-07-04', '2025-09-01', '2025-11-27', '2025-12-25',
+    '2026-01-01', '2026-01-19', '2026-02-16', '2026-04-03', '2026-05-25', '2026-06-19',
+    '2026-07-03', '2026-09-07', '2026-11-26', '2026-12-25',
+    '2027-01-01', '2027-01-18', '2027-02-15', '2027-03-26', '2027-05-31', '2027-06-18',
+    '2027-07-05', '2027-09-06', '2027-11-25', '2027-12-24',
+}
+# Sessions that end at 1pm
+EARLY_CLOSES = {
+    '2024-07-03', '2024-11-29', '2024-12-24',
+    '2025-07-03', '2025-11-28', '2025-12-24',
+    '2026-11-27', '2026-12-24',
+    '2027-11-26',
+}
+
+
+def trades_continuously(symbol):
+    """
+    Crypto and FX pairs (BTC-USD, EUR-USD) trade around the clock. So do
+    listings on exchanges the table doesn't cover (e.g. TSCO.LON), so they
+    are never skipped.
+    """
+    return '-' in symbol or '.' in symbol
+
+
+def _eastern_offset(day):
+    """
+    UTC offset of New York on a day, after 2am: EDT from the second Sunday
+    of March to the first Sunday of November, EST otherwise.
+    """
+    march = date(day.year, 3, 8)
+    dst_start = march + timedelta(days=(6 - march.weekday()) % 7)
+    november = date(day.year, 11, 1)
+    dst_end = november + timedelta(days=(6 - november.weekday()) % 7)
+    return timedelta(hours=-4 if dst_start <= day < dst_end else -5)
+
+
+class MarketCalendar:
+    """
+    Trading sessions for US equities from the local hours and holiday
+    tables, in epoch seconds. Pairs and unknown exchanges are always open.
+    """
+
+    def __init__(self, holidays=HOLIDAYS, early_closes=EARLY_CLOSES, enabled=True):
+        self.holidays = set(holidays)
+        self.early_closes = set(early_closes)
+        self.enabled = enabled
+        self.session = lru_cache(maxsize=64)(self._session)
+
+    def _session(self, day):
+        """
+        (open_ts, close_ts) of the session on a local date, or None if closed.
+        """
+        if day.weekday() >= 5 or day.isoformat() in self.holidays:
+            return None
+        offset = _eastern_offset(day)
+        close = EARLY_CLOSE if day.isoformat() in self.early_closes else SESSION_CLOSE
+
+        def at(hour, minute):
+            local = datetime(day.year, day.month, day.day, hour, minute, tzinfo=timezone.utc)
+            return int((local - offset).timestamp())
+        return at(*SESSION_OPEN), at(*close)
+
+    def _local_day(self, ts):
+        utc = datetime.fromtimestamp(ts, timezone.utc)
+        # The offset only changes at 2am local, long before the session opens
+        return (utc + _eastern_offset(utc.date())).date()
+
+    def always_open(self, symbol):
+        return not self.enabled or trades_continuously(symbol)
+
+    def is_open(self, symbol, ts):
+        if self.always_open(symbol):
+            return True
+        session = self.session(self._local_day(ts))
+        return session is not None and session[0] <= ts < session[1]
+
+    def last_close(self, ts):
+        """
+        The most recent session close at or before ts.
+        """
+        day = self._local_day(ts)
+        for _ in range(15):
+            session = self.session(day)
+            if session and session[1] <= ts:
+                return session[1]
+            day -= timedelta(days=1)
+        return None
+
+    def next_open(self, ts):
+        """
+        ts if a session is running then, else the next session's open.
+        """
+        day = self._local_day(ts)
+        for _ in range(15):
+            session = self.session(day)
+            if session and ts < session[1]:
+                return max(ts, session[0])
+            day += timedelta(days=1)
+        return ts
+
+    def moved_since(self, symbol, since_ts, now_ts):
+        """
+        Whether symbol can have traded between since_ts and now_ts: its
+        market is open now, or a session closed in between.
+        """
+        if self.is_open(symbol, now_ts):
+            return True
+        close = self.last_close(now_ts)
+        return close is not None and close >= since_ts
+
+    def next_check(self, symbol, interval_minutes, now_ts):
+        """
+        When an alert checked at now_ts is next worth checking: one interval
+        out, pulled in to the session close so the closing price is seen once,
+        or pushed to the next open while the market is shut.
+        """
+        due = now_ts + float(interval_minutes) * 60
+        if self.always_open(symbol) or self.is_open(symbol, due):
+            return int(due)
+        session = self.session(self._local_day(now_ts))
+        if session and session[0] <= now_ts < session[1] <= due:
+            return session[1]
+        return int(self.next_open(due))
+
+
+class SystemClock:
+    def now(self):
+        return datetime.now(timezone.utc)
+
+
+class FixedClock:
+    """
+    A clock that only moves when told to, for offline tests and replays.
+    """
+
+    def __init__(self, when):
+        self.when = when
+
+    def now(self):
+        return self.when
+
+    def advance(self, **delta):
+        self.when += timedelta(**delta)
+        return self.when
+
+
+_clock = SystemClock()
+_calendar = None
+
+
+def now():
+    """
+    Current UTC time from the scheduler's clock.
+    """
+    return _clock.now()
+
+
+def set_clock(clock):
+    """
+    Swap the scheduler's clock, e.g. for a FixedClock; None restores the system clock.
+    """
+    global _clock
+    _clock = clock or SystemClock()
+
+
+def get_calendar():
+    global _calendar
+    if _calendar is None:
+        extra = {d.strip() for d in MARKET_EXTRA_HOLIDAYS.split(',') if d.strip()}
+        _calendar = MarketCalendar(HOLIDAYS | extra, enabled=MARKET_HOURS)
+    return _calendar
+
+
+def set_calendar(calendar):
+    """
+    Swap the calendar; None rebuilds the default from the tables and env.
+    """
+    global _calendar
+    _calendar = calendar
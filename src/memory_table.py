@@ -0,0 +1,196 @@
+import copy
+import json
+import math
+import re
+import threading
+
+from boto3.dynamodb.table import BatchWriter
+from botocore.exceptions import ClientError
+
+_COMPARISONS = {
+    '=': lambda a, b: a == b,
+    '<>': lambda a, b: a != b,
+    '<': lambda a, b: a < b,
+    '<=': lambda a, b: a <= b,
+    '>': lambda a, b: a > b,
+    '>=': lambda a, b: a >= b,
+}
+
+
+def evaluate(condition, item):
+    """
+    Evaluate a boto3 Key/Attr condition against a plain item dict.
+    """
+    expr = condition.get_expression()
+    op, values = expr['operator'], expr['values']
+    if op == 'AND':
+        return all(evaluate(c, item) for c in values)
+    if op == 'OR':
+        return any(evaluate(c, item) for c in values)
+    if op == 'NOT':
+        return not evaluate(values[0], item)
+    name = values[0].name
+    if op == 'attribute_exists':
+        return name in item
+    if op == 'attribute_not_exists':
+        return name not in item
+    if name not in item:
+        return False
+    if op == 'BETWEEN':
+        return values[1] <= item[name] <= values[2]
+    if op == 'begins_with':
+        return str(item[name]).startswith(values[1])
+    if op == 'IN':
+        return item[name] in values[1]
+    return _COMPARISONS[op](item[name], values[1])
+
+
+def _item_kb(item):
+    return len(json.dumps(item, default=str)) / 1024 if item else 0
+
+
+def conditional_check_failed(operation):
+    """
+    The ClientError boto3 raises when a ConditionExpression does not hold.
+    """
+    return ClientError(
+        {'Error': {'Code': 'ConditionalCheckFailedException', 'Message': 'The conditional request failed'}},
+        operation,
+    )
+
+
+class MemoryTable:
+    """
+    In-memory stand-in for a DynamoDB Table resource, used to run the bot
+    locally. Supports the calls the bot makes: get/put/delete/update_item,
+    paginated query (including sparse GSIs) and scan, and batch_writer.
+    Items are deep-copied in and out, like a real round trip.
+
+    `consumed` approximates on-demand capacity units: eventually consistent
+    reads cost 0.5 RCU per 4 KB read, writes 1 WCU per KB written to the
+    table and to each index the item is (or was) in.
+    """
+
+    def __init__(self, name='alerts', key=('chat_id', 'symbol'), indexes=None, page_size=100):
+        self.name = name
+        self.key = key
+        self.indexes = indexes or {}
+        self.page_size = page_size
+        self.items = {}
+        self.consumed = {'read': 0.0, 'write': 0.0}
+        self._lock = threading.Lock()
+
+    def _charge_read(self, items):
+        self.consumed['read'] += 0.5 * max(1, math.ceil(sum(_item_kb(it) for it in items) / 4))
+
+    def _charge_write(self, old, new):
+        units = max(1, math.ceil(max(_item_kb(old), _item_kb(new))))
+        in_indexes = sum(
+            1 for hash_key, sort_key in self.indexes.values()
+            if any(it and hash_key in it and sort_key in it for it in (old, new))
+        )
+        self.consumed['write'] += units * (1 + in_indexes)
+
+    def _key_of(self, item):
+        return tuple(item[k] for k in self.key)
+
+    def get_item(self, Key):
+        with self._lock:
+            item = self.items.get(self._key_of(Key))
+            self._charge_read([item])
+        return {'Item': copy.deepcopy(item)} if item is not None else {}
+
+    def put_item(self, Item, ConditionExpression=None):
+        key = self._key_of(Item)
+        with self._lock:
+            self._charge_write(self.items.get(key), Item)
+            if ConditionExpression is not None and not evaluate(ConditionExpression, self.items.get(key, {})):
+                raise conditional_check_failed('PutItem')
+            self.items[key] = copy.deepcopy(Item)
+        return {}
+
+    def delete_item(self, Key, ConditionExpression=None):
+        key = self._key_of(Key)
+        with self._lock:
+            self._charge_write(self.items.get(key), None)
+            if ConditionExpression is not None and not evaluate(ConditionExpression, self.items.get(key, {})):
+                raise conditional_check_failed('DeleteItem')
+            self.items.pop(key, None)
+        return {}
+
+    def update_item(self, Key, UpdateExpression, ExpressionAttributeValues=None, ConditionExpression=None):
+        """
+        Apply a "SET a = :x, b = :y REMOVE c ADD n :one" style update expression.
+        """
+        values = ExpressionAttributeValues or {}
+        key = self._key_of(Key)
+        with self._lock:
+            if ConditionExpression is not None and not evaluate(ConditionExpression, self.items.get(key, {})):
+                raise conditional_check_failed('UpdateItem')
+            item = self.items.setdefault(key, dict(Key))
+            clauses = re.split(r'\b(SET|REMOVE|ADD)\b', UpdateExpression)
+            for action, body in zip(clauses[1::2], clauses[2::2]):
+                for part in filter(None, (p.strip() for p in body.split(','))):
+                    if action == 'SET':
+                        attr, placeholder = (p.strip() for p in part.split('='))
+                        item[attr] = copy.deepcopy(values[placeholder])
+                    elif action == 'ADD':
+                        attr, placeholder = part.split()
+                        item[attr] = item.get(attr, 0) + values[placeholder]
+                    else:
+                        item.pop(part, None)
+            self._charge_write(item, item)
+        return {}
+
+    def _page(self, items, sort_key, ExclusiveStartKey, Limit):
+        items.sort(key=lambda it: (it.get(sort_key, 0) if sort_key else 0, self._key_of(it)))
+        start = 0
+        if ExclusiveStartKey:
+            marker = self._key_of(ExclusiveStartKey)
+            start = next(i for i, it in enumerate(items) if self._key_of(it) == marker) + 1
+        limit = min(Limit or self.page_size, self.page_size)
+        page = items[start:start + limit]
+        resp = {'Items': copy.deepcopy(page), 'Count': len(page), 'ScannedCount': len(page)}
+        if start + limit < len(items):
+            resp['LastEvaluatedKey'] = {k: page[-1][k] for k in self.key}
+        return resp
+
+    def query(self, KeyConditionExpression, IndexName=None, FilterExpression=None,
+              ExclusiveStartKey=None, Limit=None):
+        with self._lock:
+            if IndexName is not None:
+                hash_key, sort_key = self.indexes[IndexName]
+                # Sparse index: items without the index keys are not in it
+                candidates = [it for it in self.items.values() if hash_key in it and sort_key in it]
+            else:
+                sort_key = self.key[1] if len(self.key) > 1 else None
+                candidates = list(self.items.values())
+            matched = [it for it in candidates if evaluate(KeyConditionExpression, it)]
+            resp = self._page(matched, sort_key, ExclusiveStartKey, Limit)
+            self._charge_read(resp['Items'])
+        if FilterExpression is not None:
+            resp['Items'] = [it for it in resp['Items'] if evaluate(FilterExpression, it)]
+            resp['Count'] = len(resp['Items'])
+        return resp
+
+    def scan(self, FilterExpression=None, ExclusiveStartKey=None, Limit=None):
+        with self._lock:
+            candidates = list(self.items.values())
+            resp = self._page(candidates, None, ExclusiveStartKey, Limit)
+            self._charge_read(resp['Items'])
+        if FilterExpression is not None:
+            resp['Items'] = [it for it in resp['Items'] if evaluate(FilterExpression, it)]
+            resp['Count'] = len(resp['Items'])
+        return resp
+
+    def batch_writer(self, overwrite_by_pkeys=None):
+        # boto3's own BatchWriter, with this table standing in for the client
+        return BatchWriter(self.name, self, overwrite_by_pkeys=overwrite_by_pkeys)
+
+    def batch_write_item(self, RequestItems):
+        for req in RequestItems.get(self.name, []):
+            if 'PutRequest' in req:
+                self.put_item(req['PutRequest']['Item'])
+            else:
+                self.delete_item(req['DeleteRequest']['Key'])
+        return {'UnprocessedItems': {}}
@@ -0,0 +1,195 @@
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+# CloudWatch namespace for the embedded-metric-format lines; empty disables them
+NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'TelegramAlertBot')
+# Invocations slower than this get a sampling-profiler report; 0 leaves it off
+PROFILE_SLOW_MS = float(os.environ.get('PROFILE_SLOW_MS', '0'))
+PROFILE_INTERVAL_MS = float(os.environ.get('PROFILE_INTERVAL_MS', '5'))
+PROFILE_TOP = int(os.environ.get('PROFILE_TOP', '15'))
+
+
+class Recorder:
+    """
+    Timings and counters for the current invocation. Lambda runs one
+    invocation per container at a time, so a single shared recorder is
+    enough; the lock covers fan-out worker threads reporting into it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.timers = {}    # name -> [total_ms, calls]
+            self.counters = Counter()
+
+    def observe(self, name, elapsed_ms):
+        with self._lock:
+            timer = self.timers.setdefault(name, [0.0, 0])
+            timer[0] += elapsed_ms
+            timer[1] += 1
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] += n
+
+    def snapshot(self):
+        """
+        Flatten into metric name -> value: `<timer>.ms`, `<timer>.calls`
+        and one entry per counter.
+        """
+        with self._lock:
+            values = dict(self.counters)
+            for name, (total_ms, calls) in self.timers.items():
+                values[f"{name}.ms"] = round(total_ms, 2)
+                values[f"{name}.calls"] = calls
+        return values
+
+
+RECORDER = Recorder()
+
+
+def count(name, n=1):
+    RECORDER.count(name, n)
+
+
+@contextmanager
+def timed(name):
+    """
+    Add the wall time of the block to timer `name`; failures are counted
+    under `<name>.errors` as well.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        RECORDER.count(f"{name}.errors")
+        raise
+    finally:
+        RECORDER.observe(name, (time.perf_counter() - started) * 1000)
+
+
+def instrument(name):
+    """
+    Decorator form of timed().
+    """
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with timed(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def emf_record(dimensions, values, timestamp_ms=None):
+    """
+    Build one CloudWatch embedded-metric-format record. Timers are reported
+    in milliseconds, everything else as a count.
+    """
+    metrics = [
+        {'Name': name, 'Unit': 'Milliseconds' if name.endswith('.ms') else 'Count'}
+        for name in sorted(values)
+    ]
+    return {
+        '_aws': {
+            'Timestamp': int(time.time() * 1000) if timestamp_ms is None else timestamp_ms,
+            'CloudWatchMetrics': [{
+                'Namespace': NAMESPACE,
+                'Dimensions': [sorted(dimensions)],
+                'Metrics': metrics,
+            }],
+        },
+        **dimensions,
+        **values,
+    }
+
+
+class SamplingProfiler:
+    """
+    Samples every thread's stack on a timer and tallies functions by self
+    time (the frame running when sampled) and total time (anywhere on the
+    stack). Cheap enough to leave on for all invocations and only report
+    the slow ones.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.samples = 0
+        self.self_counts = Counter()
+        self.total_counts = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != own:
+                    self._sample(frame)
+
+    def _sample(self, frame):
+        self.samples += 1
+        self.self_counts[_describe(frame)] += 1
+        seen = set()
+        while frame is not None:
+            name = _describe(frame)
+            if name not in seen:
+                seen.add(name)
+                self.total_counts[name] += 1
+            frame = frame.f_back
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self
+
+    def top(self, n=PROFILE_TOP):
+        return [
+            {'function': name, 'self': hits, 'total': self.total_counts[name]}
+            for name, hits in self.self_counts.most_common(n)
+        ]
+
+
+def _describe(frame):
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_firstlineno}:{code.co_name}"
+
+
+@contextmanager
+def invocation(**dimensions):
+    """
+    Scope one Lambda invocation: reset the recorder, optionally profile,
+    then print one EMF line with the duration and everything recorded.
+    """
+    RECORDER.reset()
+    profiler = SamplingProfiler(PROFILE_INTERVAL_MS / 1000).start() if PROFILE_SLOW_MS > 0 else None
+    started = time.perf_counter()
+    try:
+        yield RECORDER
+    except Exception:
+        RECORDER.count('Errors')
+        raise
+    finally:
+        elapsed_ms = round((time.perf_counter() - started) * 1000, 2)
+        if profiler is not None:
+            profiler.stop()
+            if elapsed_ms >= PROFILE_SLOW_MS:
+                print(json.dumps({'slow_invocation': {
+                    **dimensions, 'duration_ms': elapsed_ms,
+                    'samples': profiler.samples, 'hot_functions': profiler.top(),
+                }}))
+        if NAMESPACE:
+            print(json.dumps(emf_record(dimensions, {'Duration.ms': elapsed_ms, **RECORDER.snapshot()})))
@@ -0,0 +1,105 @@
+import os
+import threading
+import time
+
+from src.rate_limit import TokenBucket
+
+# Telegram allows about 30 messages/s per bot and 1 message/s per chat.
+GLOBAL_RATE = float(os.environ.get('TELEGRAM_GLOBAL_RATE', '30'))
+CHAT_RATE = float(os.environ.get('TELEGRAM_CHAT_RATE', '1'))
+SEND_WORKERS = int(os.environ.get('TELEGRAM_SEND_WORKERS', '8'))
+MAX_MESSAGE_LENGTH = 4096
+
+
+def coalesce(texts, limit=MAX_MESSAGE_LENGTH):
+    """
+    Join a chat's texts into as few messages as fit Telegram's length limit.
+    """
+    messages = []
+    current = ''
+    for text in texts:
+        candidate = f"{current}\n{text}" if current else text
+        if current and len(candidate) > limit:
+            messages.append(current)
+            current = text
+        else:
+            current = candidate
+    if current:
+        messages.append(current)
+    return messages
+
+
+class OutboundQueue:
+    """
+    Delivery queue for Telegram messages. Messages for the same chat are
+    coalesced, chats are sent concurrently, every send waits on a global and
+    a per-chat token bucket, and 429 replies are retried after Telegram's
+    `retry_after`. `send(chat_id, text)` must return the decoded Bot API reply.
+    """
+
+    def __init__(self, send, global_rate=None, chat_rate=None, max_workers=None,
+                 max_retries=3, clock=time.monotonic, sleep=time.sleep):
+        self.send = send
+        self.chat_rate = CHAT_RATE if chat_rate is None else chat_rate
+        self.max_workers = SEND_WORKERS if max_workers is None else max_workers
+        self.max_retries = max_retries
+        self.clock = clock
+        self.sleep = sleep
+        global_rate = GLOBAL_RATE if global_rate is None else global_rate
+        self.global_bucket = TokenBucket(global_rate, global_rate, clock)
+        self.chat_buckets = {}
+        self.pending = {}
+        self.metrics = {'enqueued': 0, 'coalesced': 0, 'sent': 0, 'failed': 0, 'retried': 0}
+        self._lock = threading.Lock()
+
+    def enqueue(self, chat_id, text):
+        self.pending.setdefault(chat_id, []).append(text)
+        self.metrics['enqueued'] += 1
+
+    def _take(self, bucket):
+        while True:
+            with self._lock:
+                if bucket.try_take():
+                    return
+                delay = bucket.wait_time()
+            self.sleep(delay)
+
+    def _deliver(self, chat_id, text):
+        for attempt in range(self.max_retries + 1):
+            self._take(self.global_bucket)
+            self._take(self.chat_buckets[chat_id])
+            try:
+                reply = self.send(chat_id, text) or {}
+            except Exception:
+                reply = {'ok': False}
+            if reply.get('ok'):
+                return True
+            retry_after = reply.get('parameters', {}).get('retry_after')
+            if reply.get('error_code') != 429 or attempt == self.max_retries:
+                return False
+            with self._lock:
+                self.metrics['retried'] += 1
+            self.sleep(float(retry_after or 1))
+        return False
+
+    def _deliver_chat(self, chat_id, messages):
+        results = [self._deliver(chat_id, text) for text in messages]
+        with self._lock:
+            self.metrics['sent'] += sum(results)
+            self.metrics['failed'] += len(results) - sum(results)
+
+    def flush(self):
+        """
+        Deliver everything queued and return the delivery metrics.
+        """
+        batches = {}
+        for chat_id, texts in self.pending.items():
+            batches[chat_id] = coalesce(texts)
+            self.metrics['coalesced'] += len(texts) - len(batches[chat_id])
+            self.chat_buckets.setdefault(chat_id, TokenBucket(self.chat_rate, 1, self.clock))
+        self.pending = {}
+        if batches:
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, len(batches)))) as pool:
+                list(pool.map(lambda entry: self._deliver_chat(*entry), batches.items()))
+        return dict(self.metrics)
@@ -0,0 +1,135 @@
+import threading
+import time
+from collections import OrderedDict
+
+from src.metrics import count
+
+
+class MemoryBackend:
+    """
+    Bounded in-process LRU store for cache entries.
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def set(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def delete(self, key):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class QuoteCache:
+    """
+    TTL cache for upstream quotes with an optional stale-while-revalidate window.
+
+    Entries younger than `ttl` seconds are served as hits. Entries older than
+    `ttl` but younger than `ttl + stale_ttl` are served immediately while a
+    background refresh replaces them. Anything older is a miss and is fetched
+    synchronously. Entries are stored as (value, stored_at) tuples in a
+    pluggable backend exposing get/set/delete/clear and len().
+    """
+
+    def __init__(self, ttl=60, stale_ttl=0, maxsize=1024, backend=None, clock=time.time):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.backend = backend if backend is not None else MemoryBackend(maxsize)
+        self.clock = clock
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._refreshing = {}
+
+    def peek(self, key):
+        """
+        Return a fresh cached value without fetching or touching counters.
+        """
+        with self._lock:
+            entry = self.backend.get(key)
+        if entry is not None and self.clock() - entry[1] < self.ttl:
+            return entry[0]
+        return None
+
+    def set(self, key, value):
+        with self._lock:
+            self.backend.set(key, (value, self.clock()))
+
+    def get_or_fetch(self, key, fetch):
+        """
+        Return the cached value for key, calling fetch() on a miss.
+        Values of None are never cached so failed lookups are retried.
+        """
+        with self._lock:
+            entry = self.backend.get(key)
+        if entry is not None:
+            value, stored_at = entry
+            age = self.clock() - stored_at
+            if age < self.ttl:
+                self.hits += 1
+                count('cache.hits')
+                return value
+            if age < self.ttl + self.stale_ttl:
+                self.stale_hits += 1
+                count('cache.stale_hits')
+                self.refresh(key, fetch)
+                return value
+        self.misses += 1
+        count('cache.misses')
+        value = fetch()
+        if value is not None:
+            self.set(key, value)
+        return value
+
+    def refresh(self, key, fetch):
+        """
+        Refetch key on a background thread unless a refresh is already running.
+        """
+        with self._lock:
+            if key in self._refreshing:
+                return self._refreshing[key]
+            thread = threading.Thread(target=self._refresh, args=(key, fetch), daemon=True)
+            self._refreshing[key] = thread
+        thread.start()
+        return thread
+
+    def _refresh(self, key, fetch):
+        try:
+            value = fetch()
+            if value is not None:
+                self.set(key, value)
+        except Exception:
+            pass  # keep serving the stale value; the next miss retries
+        finally:
+            with self._lock:
+                self._refreshing.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self.backend.clear()
+        self.hits = self.stale_hits = self.misses = 0
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'stale_hits': self.stale_hits,
+            'misses': self.misses,
+            'size': len(self.backend),
+        }
@@ -0,0 +1,260 @@
+import json
+import random
+import threading
+import time
+
+from src.key_pool import route_of, with_key
+from src.metrics import count, timed
+from src.upstream import read_streamed
+
+# Priority lanes: interactive commands may dip into the reserved budget,
+# scheduled checks may not and are deferred to the next run instead.
+INTERACTIVE = 0
+SCHEDULED = 1
+
+
+class UpstreamThrottled(Exception):
+    """
+    Raised when the provider keeps throttling a request after all retries,
+    or an interactive request would wait longer than allowed for budget.
+    """
+
+
+class UpstreamDeferred(Exception):
+    """
+    Raised when low-priority work has no budget left in this run.
+    """
+
+
+class TokenBucket:
+    """
+    Classic token bucket: `rate` tokens per second up to `capacity`.
+    """
+
+    def __init__(self, rate, capacity, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = capacity
+        self.updated = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self, n=1, reserve=0):
+        """
+        Take n tokens if at least `reserve` tokens would remain afterwards.
+        """
+        self._refill()
+        if self.tokens - n >= reserve:
+            self.tokens -= n
+            return True
+        return False
+
+    def refund(self, n=1):
+        """
+        Return tokens taken for a request that was never sent.
+        """
+        self.tokens = min(self.capacity, self.tokens + n)
+
+    def wait_time(self, n=1):
+        """
+        Seconds until n tokens are available.
+        """
+        self._refill()
+        missing = n - self.tokens
+        return max(0.0, missing / self.rate) if self.rate > 0 else float('inf')
+
+
+def _is_error(data):
+    """
+    Provider error payloads (bad symbol, premium endpoint) aren't worth caching.
+    """
+    return isinstance(data, dict) and ('Error Message' in data or 'Information' in data)
+
+
+def is_throttled(status, data):
+    """
+    Detect Alpha Vantage throttling: HTTP 429, or a 200 carrying a "Note"
+    (call frequency) or rate-limit "Information" message instead of data.
+    """
+    if status == 429:
+        return True
+    if not isinstance(data, dict):
+        return False
+    if 'Note' in data:
+        return True
+    info = str(data.get('Information', '')).lower()
+    return 'rate limit' in info or 'call frequency' in info
+
+
+class UpstreamScheduler:
+    """
+    Central gate for provider GET requests.
+
+    Keeps one token bucket per API key, lets interactive requests wait (up to
+    `max_wait` seconds) for budget while scheduled requests must leave
+    `interactive_reserve` tokens untouched or be deferred, and retries
+    throttle responses with full-jitter exponential backoff. With a
+    ResponseCache, fresh cached bodies are served without spending budget.
+    With a KeyPool, each request goes out with the first key in its
+    symbol's ranking that has budget left, whatever key the URL names, and
+    a throttled key is ejected so the retry moves on to the next one.
+    """
+
+    def __init__(self, http, requests_per_minute=75, burst=None, interactive_reserve=0,
+                 max_retries=3, base_delay=1.0, max_delay=16.0, max_wait=10.0, timeout=None,
+                 clock=time.monotonic, sleep=time.sleep, rand=random.random, cache=None, keys=None):
+        self.http = http
+        self.cache = cache
+        self.keys = keys
+        self.rate = requests_per_minute / 60.0
+        self.burst = burst if burst is not None else requests_per_minute
+        self.interactive_reserve = interactive_reserve
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_wait = max_wait
+        self.timeout = timeout
+        self.clock = clock
+        self.sleep = sleep
+        self.rand = rand
+        self.buckets = {}
+        self.requests = 0
+        self.throttled = 0
+        self.deferred = 0
+        self._lock = threading.Lock()
+
+    def _bucket(self, api_key):
+        bucket = self.buckets.get(api_key)
+        if bucket is None:
+            bucket = self.buckets[api_key] = TokenBucket(self.rate, self.burst, self.clock)
+        return bucket
+
+    def _acquire(self, api_key, priority):
+        with self._lock:
+            bucket = self._bucket(api_key)
+            if priority != INTERACTIVE:
+                if bucket.try_take(reserve=self.interactive_reserve):
+                    return
+                self.deferred += 1
+                count('upstream.deferred')
+                raise UpstreamDeferred(f"no upstream budget left for key ...{api_key[-4:]}")
+        waited = 0.0
+        while True:
+            with self._lock:
+                if bucket.try_take():
+                    return
+                delay = bucket.wait_time()
+            if waited + delay > self.max_wait:
+                raise UpstreamThrottled(f"upstream budget exhausted for key ...{api_key[-4:]}")
+            self.sleep(delay)
+            waited += delay
+
+    def _acquire_pooled(self, route, priority):
+        """
+        Take budget from the first key in route's ranking with both a local
+        token and shared quota left, and return it. Interactive requests
+        wait (up to max_wait) for the soonest key; scheduled ones are
+        deferred when no key has budget to spare.
+        """
+        reserve = self.interactive_reserve if priority != INTERACTIVE else 0
+        waited = 0.0
+        while True:
+            candidates = self.keys.candidates(route)
+            delays = []
+            for key in candidates:
+                with self._lock:
+                    bucket = self._bucket(key)
+                    if not bucket.try_take(reserve=reserve):
+                        delays.append(bucket.wait_time(1 + reserve))
+                        continue
+                if self.keys.claim(key):
+                    return key
+                with self._lock:
+                    bucket.refund()
+                delays.append(self.keys.quota_wait(key))
+            if priority != INTERACTIVE:
+                self.deferred += 1
+                count('upstream.deferred')
+                raise UpstreamDeferred(f"no upstream budget left on any of {len(self.keys)} keys")
+            delay = min(delays, default=float('inf'))
+            if not candidates or waited + delay > self.max_wait:
+                raise UpstreamThrottled(f"upstream budget exhausted on all {len(self.keys)} keys")
+            self.sleep(delay)
+            waited += delay
+
+    def backoff(self, attempt):
+        """
+        Full-jitter exponential backoff delay for the given retry attempt.
+        """
+        return self.rand() * min(self.max_delay, self.base_delay * (2 ** attempt))
+
+    def request(self, url, api_key, priority=INTERACTIVE, parse=None):
+        """
+        GET url within api_key's budget and return the decoded JSON body.
+        parse(chunks), if given, decodes the body while it streams instead;
+        such partial reads bypass the response cache. With a key pool,
+        api_key only names the key the URL was built with.
+        """
+        cache = self.cache if parse is None else None
+        if cache is not None:
+            body = cache.fresh(url)
+            if body is not None:
+                count('upstream.disk_hits')
+                return json.loads(body.decode())
+        route = route_of(url) if self.keys is not None else None
+        for attempt in range(self.max_retries + 1):
+            if self.keys is not None:
+                api_key = self._acquire_pooled(route, priority)
+                url = with_key(url, api_key)
+            else:
+                self._acquire(api_key, priority)
+            headers = cache.validators(url) if cache is not None else {}
+            with self._lock:
+                self.requests += 1
+            with timed('upstream.alpha_vantage'):
+                if parse is not None:
+                    resp = self.http.request('GET', url, timeout=self.timeout, preload_content=False)
+                    try:
+                        if resp.status == 200:
+                            data = read_streamed(resp, parse)
+                        else:
+                            data = json.loads(resp.data.decode())
+                            resp.release_conn()
+                    except ValueError:
+                        data = None
+                else:
+                    resp = self.http.request('GET', url, timeout=self.timeout, **({'headers': headers} if headers else {}))
+                    body = resp.data
+                    if resp.status == 304 and cache is not None:
+                        count('upstream.revalidated')
+                        body = cache.revalidated(url) or b''
+                    try:
+                        data = json.loads(body.decode())
+                    except ValueError:
+                        data = None
+            if not is_throttled(resp.status, data):
+                if cache is not None and data is not None and resp.status in (200, 304) and not _is_error(data):
+                    cache.store(url, body, resp.headers)
+                return data if data is not None else {}
+            self.throttled += 1
+            count('upstream.throttled')
+            if self.keys is not None:
+                # Retry straight away on the next key; with none left, give up now
+                self.keys.eject(api_key)
+                if not self.keys.candidates(route):
+                    break
+                continue
+            if attempt < self.max_retries:
+                self.sleep(self.backoff(attempt))
+        if priority != INTERACTIVE:
+            self.deferred += 1
+            count('upstream.deferred')
+            raise UpstreamDeferred(f"provider throttled {url.split('?')[0]} after {self.max_retries} retries")
+        raise UpstreamThrottled(f"provider throttled {url.split('?')[0]} after {self.max_retries} retries")
+
+    def stats(self):
+        return {'requests': self.requests, 'throttled': self.throttled, 'deferred': self.deferred}
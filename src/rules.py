@@ -0,0 +1,101 @@
+import os
+
+# Alert rule kinds. Items without a `rule` attribute are drop alerts.
+DROP = 'drop'
+RISE = 'rise'
+TRAIL = 'trail'
+MOVE = 'move'
+RULES = (DROP, RISE, TRAIL, MOVE)
+# Window for move rules when !set doesn't name one
+MOVE_WINDOW_MINUTES = int(os.environ.get('MOVE_WINDOW_MINUTES', '60'))
+
+
+def rule_of(item):
+    return item.get('rule') or DROP
+
+
+def is_one_shot_drop(item):
+    """
+    Plain drop alerts without a cooldown: the only kind a fixed trigger
+    price fully describes (what stream mode indexes).
+    """
+    return rule_of(item) == DROP and not item.get('cooldown_minutes')
+
+
+def parse_rule(args):
+    """
+    Parse what follows `!set SYMBOL`: [RULE] PERCENT MINUTES [window=MIN] [cooldown=MIN].
+    Returns the rule's item attributes; raises ValueError on bad input.
+    Drop alerts are stored exactly as before rules existed.
+    """
+    from decimal import Decimal
+    args = list(args)
+    rule = args.pop(0).lower() if args and args[0].lower() in RULES else DROP
+    options = dict(arg.lower().split('=', 1) for arg in args if '=' in arg)
+    positional = [arg for arg in args if '=' not in arg]
+    if len(positional) != 2 or set(options) - {'window', 'cooldown'}:
+        raise ValueError("expected [RULE] PERCENT MINUTES [window=MIN] [cooldown=MIN]")
+    threshold = float(positional[0])
+    if threshold <= 0:
+        raise ValueError("percent must be positive")
+    fields = {
+        'threshold_percent': Decimal(str(threshold)),
+        'interval_minutes': Decimal(str(int(positional[1]))),
+    }
+    if rule != DROP:
+        fields['rule'] = rule
+    if rule == MOVE:
+        fields['window_minutes'] = Decimal(str(int(options.get('window', MOVE_WINDOW_MINUTES))))
+    elif 'window' in options:
+        raise ValueError("window only applies to move rules")
+    if int(options.get('cooldown', 0)) > 0:
+        fields['cooldown_minutes'] = Decimal(str(int(options['cooldown'])))
+    return fields
+
+
+def initial_state(rule, price, now_ts):
+    """
+    Rolling state a new rule starts from at the price it was set at.
+    """
+    from decimal import Decimal
+    price = Decimal(str(price))
+    if rule == TRAIL:
+        return {'peak_price': price}
+    if rule == MOVE:
+        return {'window_high': price, 'window_high_at': int(now_ts), 'window_low': price, 'window_low_at': int(now_ts)}
+    return {}
+
+
+def describe(item):
+    """
+    Human-readable rule, e.g. "5.0% drop in 60 min".
+    """
+    rule, pct, minutes = rule_of(item), item['threshold_percent'], item['interval_minutes']
+    if rule == TRAIL:
+        text = f"{pct}% trailing stop, checked every {minutes} min"
+    elif rule == MOVE:
+        text = f"{pct}% move within {item.get('window_minutes')} min, checked every {minutes} min"
+    else:
+        text = f"{pct}% {rule} in {minutes} min"
+    if item.get('cooldown_minutes'):
+        text += f", re-arms after {item['cooldown_minutes']} min"
+    return text
+
+
+def alert_text(symbol, alert, price):
+    """
+    Message for a fired AlertRecord.
+    """
+    if alert.rule == RISE:
+        text = f"🚀 {symbol} has risen {alert.threshold}% from ${alert.baseline:.2f} to ${price:.2f}"
+    elif alert.rule == TRAIL:
+        text = f"🚨 {symbol} hit its {alert.threshold}% trailing stop at ${price:.2f}, off a ${alert.high:.2f} high"
+    elif alert.rule == MOVE:
+        # Whichever window extreme the price moved further from
+        move = max(price / alert.low - 1, price / alert.high - 1, key=abs)
+        text = f"⚡ {symbol} moved {move * 100:+.2f}% within {alert.window:g} min to ${price:.2f}"
+    else:
+        text = f"🚨 {symbol} has dropped {alert.threshold}% from ${alert.baseline:.2f} to ${price:.2f}"
+    if alert.cooldown:
+        text += f" (re-arms in {alert.cooldown:g} min)"
+    return text
@@ -0,0 +1,104 @@
+import json
+import os
+
+from src.storage import DUE_SHARDS
+
+# Number of parallel price-checker workers; each owns a slice of due shards.
+# Anything below 1 means a single, unsharded run.
+CHECKER_WORKERS = max(1, int(os.environ.get('CHECKER_WORKERS', '1')))
+# Lambda that runs one worker; when unset, workers run in-process.
+SHARD_WORKER_FUNCTION = os.environ.get('SHARD_WORKER_FUNCTION', '')
+# Longest a run may hold a shard before an overlapping run can take it over.
+LEASE_SECONDS = int(os.environ.get('CHECKER_LEASE_SECONDS', '120'))
+# Leases live in the alerts table under a chat_id Telegram never uses.
+LEASE_CHAT_ID = '#lease'
+
+
+def plan_shards(workers, due_shards=None):
+    """
+    Split the due-index partitions (already keyed by symbol hash) across
+    workers, so every alert for a symbol lands on the same worker. Fewer
+    than one worker is treated as one.
+    """
+    due_shards = DUE_SHARDS if due_shards is None else due_shards
+    workers = max(1, workers)
+    plan = [[s for s in range(due_shards) if s % workers == w] for w in range(workers)]
+    return [shards for shards in plan if shards]
+
+
+def _is_condition_failure(err):
+    return err.response.get('Error', {}).get('Code') == 'ConditionalCheckFailedException'
+
+
+def acquire_lease(tbl, name, owner, now_ts, seconds=None):
+    """
+    Take a named lease unless another owner holds an unexpired one.
+    """
+    from boto3.dynamodb.conditions import Attr
+    from botocore.exceptions import ClientError
+    seconds = LEASE_SECONDS if seconds is None else seconds
+    try:
+        tbl.put_item(
+            Item={
+                'chat_id': LEASE_CHAT_ID,
+                'symbol': name,
+                'owner': owner,
+                'lease_expires': int(now_ts) + seconds,
+            },
+            ConditionExpression=(
+                Attr('chat_id').not_exists()
+                | Attr('lease_expires').lt(int(now_ts))
+                | Attr('owner').eq(owner)
+            ),
+        )
+        return True
+    except ClientError as err:
+        if _is_condition_failure(err):
+            return False
+        raise
+
+
+def release_lease(tbl, name, owner):
+    """
+    Drop a lease we still own; a lease taken over after expiry is left alone.
+    """
+    from boto3.dynamodb.conditions import Attr
+    from botocore.exceptions import ClientError
+    try:
+        tbl.delete_item(
+            Key={'chat_id': LEASE_CHAT_ID, 'symbol': name},
+            ConditionExpression=Attr('owner').eq(owner),
+        )
+    except ClientError as err:
+        if not _is_condition_failure(err):
+            raise
+
+
+def map_shards(fn, jobs, executor='thread'):
+    """
+    Run fn over jobs in parallel on a thread (or process) pool, in order.
+    Threads share the module-level upstream scheduler, so every worker draws
+    on the same per-key budget. Each process builds its own scheduler, so
+    the per-key budget is multiplied by the worker count, and metrics
+    counted in a child process are lost.
+    """
+    if len(jobs) <= 1:
+        return [fn(job) for job in jobs]
+    from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+    pool_cls = ProcessPoolExecutor if executor == 'process' else ThreadPoolExecutor
+    with pool_cls(max_workers=len(jobs)) as pool:
+        return list(pool.map(fn, jobs))
+
+
+def dispatch_shards(plan, function_name, run_id):
+    """
+    Fan a run out to one asynchronous worker Lambda invocation per shard slice.
+    """
+    import boto3
+    client = boto3.client('lambda')
+    for worker, shards in enumerate(plan):
+        client.invoke(
+            FunctionName=function_name,
+            InvocationType='Event',
+            Payload=json.dumps({'run_id': run_id, 'worker': worker, 'shards': shards}).encode('utf-8'),
+        )
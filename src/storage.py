@@ -0,0 +1,227 @@
+import os
+import zlib
+
+# Sparse GSI over active alerts: only un-triggered alerts carry the key
+# attributes, partitioned by due_shard and sorted by next_due (epoch seconds).
+ACTIVE_ALERTS_INDEX = os.environ.get('ACTIVE_ALERTS_INDEX', 'active-alerts-by-due')
+# Spreads the index over several partitions; safe to raise, never lower.
+DUE_SHARDS = int(os.environ.get('DUE_SHARDS', '8'))
+# How often price_checker runs; alerts with shorter intervals stay due anyway.
+CHECKER_PERIOD_SECONDS = int(os.environ.get('CHECKER_PERIOD_SECONDS', '60'))
+# Concurrent conditional updates when a run writes back alert state
+WRITE_WORKERS = int(os.environ.get('ALERT_WRITE_WORKERS', '8'))
+
+
+def iter_pages(operation, **kwargs):
+    """
+    Yield every item from a Query or Scan, following LastEvaluatedKey.
+    """
+    while True:
+        resp = operation(**kwargs)
+        yield from resp.get('Items', [])
+        last_key = resp.get('LastEvaluatedKey')
+        if not last_key:
+            return
+        kwargs['ExclusiveStartKey'] = last_key
+
+
+def query_chat(tbl, chat_id):
+    """
+    Yield all items in a table partitioned by chat_id for one chat.
+    """
+    from boto3.dynamodb.conditions import Key
+    return iter_pages(tbl.query, KeyConditionExpression=Key('chat_id').eq(chat_id))
+
+
+def due_shard(symbol):
+    """
+    Stable index partition for a symbol, so one symbol's alerts share a shard.
+    """
+    return zlib.crc32(symbol.encode('utf-8')) % DUE_SHARDS
+
+
+def due_fields(symbol, interval_minutes, now):
+    """
+    Index attributes that schedule an alert's next check: one interval from
+    now, adjusted by the market calendar so equities aren't due while their
+    market is shut.
+    """
+    from src.market_hours import get_calendar
+    return {
+        'due_shard': due_shard(symbol),
+        'next_due': get_calendar().next_check(symbol, interval_minutes, now.timestamp()),
+    }
+
+
+def iter_due_alerts(tbl, now, shards=None):
+    """
+    Yield active alerts whose next_due has passed.
+    Reads the sparse due-time GSI, or scans for un-alerted items when
+    ACTIVE_ALERTS_INDEX is empty (e.g. while backfilling due fields). Either
+    way only alerts in `shards` are returned, so workers never overlap.
+    """
+    from boto3.dynamodb.conditions import Attr, Key
+    if not ACTIVE_ALERTS_INDEX:
+        wanted = None if shards is None else set(shards)
+        for item in iter_pages(tbl.scan, FilterExpression=Attr('alert_sent').eq(False)):
+            if wanted is None or due_shard(item['symbol']) in wanted:
+                yield item
+        return
+    cutoff = int(now.timestamp())
+    for shard in (shards if shards is not None else range(DUE_SHARDS)):
+        yield from iter_pages(
+            tbl.query,
+            IndexName=ACTIVE_ALERTS_INDEX,
+            KeyConditionExpression=Key('due_shard').eq(shard) & Key('next_due').lte(cutoff),
+        )
+
+
+def backfill_due_fields(tbl, now):
+    """
+    Give every active alert created before the due index its due fields,
+    scheduled one interval after its last check (or now, if it was never
+    checked) so alerts that aren't due yet keep their place. The write is
+    skipped if the alert fired, was deleted or got due fields meanwhile.
+    """
+    from datetime import datetime
+    from boto3.dynamodb.conditions import Attr
+    from botocore.exceptions import ClientError
+    legacy = Attr('alert_sent').eq(False) & (Attr('next_due').not_exists() | Attr('due_shard').not_exists())
+    written = 0
+    for item in iter_pages(tbl.scan, FilterExpression=legacy):
+        last_check = item.get('last_check')
+        if last_check:
+            fields = due_fields(item['symbol'], float(item.get('interval_minutes', 0)), datetime.fromisoformat(last_check))
+        else:
+            fields = {'due_shard': due_shard(item['symbol']), 'next_due': int(now.timestamp())}
+        try:
+            tbl.update_item(
+                Key={'chat_id': item['chat_id'], 'symbol': item['symbol']},
+                UpdateExpression='SET due_shard = :shard, next_due = :due',
+                ExpressionAttributeValues={':shard': fields['due_shard'], ':due': fields['next_due']},
+                ConditionExpression=Attr('chat_id').exists() & legacy,
+            )
+            written += 1
+        except ClientError as err:
+            if err.response.get('Error', {}).get('Code') != 'ConditionalCheckFailedException':
+                raise
+    return written
+
+
+def needs_reschedule(interval_minutes, next_due=None, now_ts=None):
+    """
+    Whether advancing next_due changes anything: an alert whose interval is
+    no longer than the checker period is due again at the next run either way,
+    unless the calendar planned its next check (next_due) further out.
+    """
+    if next_due is not None and next_due - now_ts > CHECKER_PERIOD_SECONDS:
+        return True
+    return float(interval_minutes) * 60 > CHECKER_PERIOD_SECONDS
+
+
+def batch_delete(tbl, keys):
+    """
+    Delete many items with BatchWriteItem; batch_writer sends chunks of 25
+    and resubmits any UnprocessedItems.
+    """
+    count = 0
+    with tbl.batch_writer() as batch:
+        for key in keys:
+            batch.delete_item(Key=key)
+            count += 1
+    return count
+
+
+def alert_update(chat_id, symbol, baseline, fields, remove=()):
+    """
+    One alert write as (key, expected baseline, attributes to set, attributes
+    to remove): plain values, so shard workers can hand it back to the parent.
+    baseline is the one the alert was read with.
+    """
+    from decimal import Decimal
+    return {'chat_id': chat_id, 'symbol': symbol}, Decimal(repr(float(baseline))), fields, tuple(remove)
+
+
+class AlertWriteBuffer:
+    """
+    Coalesces one scheduler run's alert state changes and applies them as
+    conditional partial updates, WRITE_WORKERS at a time. An update only
+    lands if the alert still exists unsent with the baseline it was read
+    with, so an alert deleted or re-set during the run is left as the user
+    made it, and one the stream fired meanwhile isn't announced twice.
+    """
+
+    def __init__(self, tbl, workers=None):
+        self.tbl = tbl
+        self.workers = workers or WRITE_WORKERS
+        self.pending = {}
+        self.landed = set()
+        self.stale = 0
+
+    def update(self, key, baseline, fields, remove=()):
+        self.pending[(key['chat_id'], key['symbol'])] = (key, baseline, fields, remove)
+
+    def __len__(self):
+        return len(self.pending)
+
+    def _write(self, key, baseline, fields, remove):
+        from boto3.dynamodb.conditions import Attr
+        from botocore.exceptions import ClientError
+        placeholders = {f":v{n}": value for n, value in enumerate(fields.values())}
+        expression = 'SET ' + ', '.join(f"{attr} = :v{n}" for n, attr in enumerate(fields))
+        if remove:
+            expression += ' REMOVE ' + ', '.join(remove)
+        try:
+            self.tbl.update_item(
+                Key=key,
+                UpdateExpression=expression,
+                ExpressionAttributeValues=placeholders,
+                ConditionExpression=(Attr('chat_id').exists() & Attr('alert_sent').eq(False)
+                                     & Attr('baseline_price').eq(baseline)),
+            )
+            return True
+        except ClientError as err:
+            if err.response.get('Error', {}).get('Code') == 'ConditionalCheckFailedException':
+                return False
+            raise
+
+    def flush(self, keys=None):
+        """
+        Apply the pending updates (only those for the (chat_id, symbol)
+        keys given, if any) and return how many landed. Landed keys are
+        added to `landed`; the ones skipped as stale are counted in `stale`.
+        """
+        if keys is None:
+            pending = list(self.pending.values())
+            self.pending.clear()
+        else:
+            pending = [self.pending.pop(key) for key in keys if key in self.pending]
+        if not pending:
+            return 0
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=max(1, min(self.workers, len(pending)))) as pool:
+            results = list(pool.map(lambda write: self._write(*write), pending))
+        self.landed.update((key['chat_id'], key['symbol']) for (key, *_), ok in zip(pending, results) if ok)
+        landed = sum(results)
+        self.stale += len(pending) - landed
+        return landed
+
+
+def main(argv=None):
+    import argparse
+    import json
+    from datetime import datetime, timezone
+    parser = argparse.ArgumentParser(description="Maintain alert due fields.")
+    parser.add_argument('--backfill-due', action='store_true',
+                        help="schedule active alerts created before the due index existed")
+    args = parser.parse_args(argv)
+    if not args.backfill_due:
+        parser.print_help()
+        return
+    from src.bot_helpers import get_table
+    written = backfill_due_fields(get_table('DDB_TABLE'), datetime.now(timezone.utc))
+    print(json.dumps({'backfilled_alerts': written}))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,296 @@
+import bisect
+import json
+import os
+import threading
+
+from src.rules import is_one_shot_drop
+
+# Stream of the alerts table to follow; when unset it is looked up on the table
+ALERTS_STREAM_ARN = os.environ.get('ALERTS_STREAM_ARN', '')
+# Seconds between polls of the stream's shards
+STREAM_POLL_SECONDS = float(os.environ.get('STREAM_POLL_SECONDS', '1'))
+
+
+def trigger_price(item):
+    """
+    Price at or below which a drop alert fires.
+    """
+    baseline = float(item.get('baseline_price', 0))
+    threshold = float(item.get('threshold_percent', 0))
+    return baseline * (1 - threshold / 100)
+
+
+class ThresholdIndex:
+    """
+    Active alerts per symbol, kept sorted by trigger price so a tick only
+    touches the alerts it actually crosses: for a drop alert those are the
+    entries with trigger >= price, i.e. one bisect plus the crossed suffix.
+    """
+
+    def __init__(self):
+        self._triggers = {}  # symbol -> sorted [(trigger, chat_id)]
+        self._items = {}     # (chat_id, symbol) -> alert item
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def add(self, item):
+        """
+        Insert or replace an alert; triggered alerts are ignored, and so are
+        rules other than one-shot drops, which the price checker evaluates.
+        """
+        if item.get('alert_sent') or not is_one_shot_drop(item):
+            self.remove(item['chat_id'], item['symbol'])
+            return
+        key = (item['chat_id'], item['symbol'])
+        with self._lock:
+            self._discard(key)
+            bisect.insort(self._triggers.setdefault(item['symbol'], []), (trigger_price(item), item['chat_id']))
+            self._items[key] = item
+
+    def remove(self, chat_id, symbol):
+        with self._lock:
+            self._discard((chat_id, symbol))
+
+    def _discard(self, key):
+        item = self._items.pop(key, None)
+        if item is None:
+            return
+        entries = self._triggers[key[1]]
+        entries.pop(bisect.bisect_left(entries, (trigger_price(item), key[0])))
+        if not entries:
+            del self._triggers[key[1]]
+
+    def crossed(self, symbol, price):
+        """
+        Remove and return every alert for symbol whose trigger price >= price.
+        """
+        with self._lock:
+            entries = self._triggers.get(symbol)
+            if not entries:
+                return []
+            cut = bisect.bisect_left(entries, (price,))
+            fired = entries[cut:]
+            del entries[cut:]
+            if not entries:
+                del self._triggers[symbol]
+            return [self._items.pop((chat_id, symbol)) for _, chat_id in fired]
+
+    def load(self, items):
+        for item in items:
+            self.add(item)
+        return self
+
+
+def apply_stream_record(index, record):
+    """
+    Apply one DynamoDB Streams record from the alerts table to an index,
+    keeping a long-running process in sync with writes made by other Lambdas.
+    """
+    from src.ddb import deserialize
+    change = record.get('dynamodb', {})
+    if record.get('eventName') == 'REMOVE':
+        keys = deserialize(change.get('Keys', {}))
+        index.remove(keys['chat_id'], keys['symbol'])
+        return
+    image = deserialize(change.get('NewImage', {}))
+    if image.get('chat_id', '').startswith('#'):
+        return  # leases and other bookkeeping rows
+    index.add(image)
+
+
+class StreamFollower:
+    """
+    Follows the alerts table's DynamoDB Stream (NEW_IMAGE view) in a
+    background thread and applies every record to an index, so a
+    long-running process sees the !set, !delete and !reset the webhook
+    Lambdas write. A shard split off another is read only once its parent
+    is drained, so changes to one alert apply in order.
+    """
+
+    def __init__(self, index, stream_arn, client=None, poll_seconds=None):
+        self.index = index
+        self.stream_arn = stream_arn
+        self._client = client
+        self.poll_seconds = STREAM_POLL_SECONDS if poll_seconds is None else poll_seconds
+        self.iterators = {}  # shard id -> next iterator
+        self.seen = set()
+        self.applied = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            import boto3
+            self._client = boto3.client('dynamodbstreams')
+        return self._client
+
+    def _shards(self):
+        params = {'StreamArn': self.stream_arn}
+        while True:
+            desc = self.client.describe_stream(**params)['StreamDescription']
+            yield from desc.get('Shards', [])
+            if not desc.get('LastEvaluatedShardId'):
+                return
+            params['ExclusiveStartShardId'] = desc['LastEvaluatedShardId']
+
+    def _discover(self, position):
+        for shard in self._shards():
+            shard_id = shard['ShardId']
+            if shard_id in self.seen or shard.get('ParentShardId') in self.iterators:
+                continue
+            self.seen.add(shard_id)
+            if position == 'LATEST' and 'EndingSequenceNumber' in shard.get('SequenceNumberRange', {}):
+                continue  # closed before we started following
+            self.iterators[shard_id] = self.client.get_shard_iterator(
+                StreamArn=self.stream_arn, ShardId=shard_id, ShardIteratorType=position,
+            )['ShardIterator']
+
+    def prime(self):
+        """
+        Start at the tip of every open shard. Call before taking the
+        snapshot, so no write made between the two is missed; records
+        already in the snapshot apply again harmlessly.
+        """
+        self._discover('LATEST')
+
+    def poll_once(self):
+        """
+        Apply every record available now and return how many there were.
+        """
+        self._discover('TRIM_HORIZON')
+        applied = 0
+        for shard_id, iterator in list(self.iterators.items()):
+            resp = self.client.get_records(ShardIterator=iterator)
+            for record in resp.get('Records', []):
+                apply_stream_record(self.index, record)
+                applied += 1
+            if resp.get('NextShardIterator'):
+                self.iterators[shard_id] = resp['NextShardIterator']
+            else:
+                del self.iterators[shard_id]  # closed and drained; its children are next
+        self.applied += applied
+        return applied
+
+    def start(self):
+        def follow():
+            while not self._stop.wait(self.poll_seconds):
+                try:
+                    self.poll_once()
+                except Exception as err:
+                    print(json.dumps({'stream_follower_error': repr(err)}))
+        self._thread = threading.Thread(target=follow, name='stream-follower', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+
+def stream_arn_of(tbl):
+    """
+    ALERTS_STREAM_ARN, or the stream enabled on the alerts table, or None.
+    """
+    if ALERTS_STREAM_ARN:
+        return ALERTS_STREAM_ARN
+    return tbl.client.describe_table(TableName=tbl.name)['Table'].get('LatestStreamArn')
+
+
+def parse_tick(message):
+    """
+    Parse one feed message into (symbol, price). Accepts JSON objects with
+    symbol/price keys (as sent by websocket-style feeds) or "SYMBOL,PRICE" lines.
+    """
+    message = message.strip()
+    if not message:
+        return None
+    if message.startswith('{'):
+        data = json.loads(message)
+        return data['symbol'].upper(), float(data['price'])
+    symbol, price = message.split(',')[:2]
+    return symbol.strip().upper(), float(price)
+
+
+def replay_file(path):
+    """
+    Yield (symbol, price) ticks from a replay file, one message per line.
+    """
+    with open(path) as fh:
+        for line in fh:
+            tick = parse_tick(line)
+            if tick:
+                yield tick
+
+
+def run_stream(ticks, index, tbl, notify):
+    """
+    Check each tick against the index and fire crossed alerts immediately.
+    An alert is marked sent before it is announced, and only if it still
+    exists unsent with the baseline it was indexed with, so one deleted,
+    re-set or already fired elsewhere stays silent.
+    Returns the number of ticks processed and alerts fired.
+    """
+    from boto3.dynamodb.conditions import Attr
+    from botocore.exceptions import ClientError
+    processed = fired = 0
+    for symbol, price in ticks:
+        processed += 1
+        for item in index.crossed(symbol, price):
+            try:
+                tbl.update_item(
+                    Key={'chat_id': item['chat_id'], 'symbol': symbol},
+                    UpdateExpression="SET alert_sent = :val REMOVE due_shard, next_due",
+                    ExpressionAttributeValues={':val': True},
+                    ConditionExpression=(Attr('chat_id').exists() & Attr('alert_sent').eq(False)
+                                         & Attr('baseline_price').eq(item['baseline_price'])),
+                )
+            except ClientError as err:
+                if err.response.get('Error', {}).get('Code') == 'ConditionalCheckFailedException':
+                    continue
+                raise
+            baseline = float(item.get('baseline_price', 0))
+            threshold = float(item.get('threshold_percent', 0))
+            notify(item['chat_id'], f"🚨 {symbol} has dropped {threshold}% from ${baseline:.2f} to ${price:.2f}")
+            fired += 1
+    return {'ticks': processed, 'alerts_fired': fired}
+
+
+def load_active_alerts(tbl, index=None):
+    """
+    Snapshot every un-triggered alert into index (a fresh one by default).
+    """
+    from boto3.dynamodb.conditions import Attr
+    from src.storage import iter_pages
+    return (index if index is not None else ThresholdIndex()).load(iter_pages(tbl.scan, FilterExpression=Attr('alert_sent').eq(False)))
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="Check alerts against a stream of price ticks.")
+    parser.add_argument('--replay', required=True, help="file of JSON or SYMBOL,PRICE ticks, one per line")
+    args = parser.parse_args(argv)
+    from src.bot_helpers import get_table, send_message
+    tbl = get_table('DDB_TABLE')
+    index = ThresholdIndex()
+    stream_arn = stream_arn_of(tbl)
+    follower = StreamFollower(index, stream_arn) if stream_arn else None
+    if follower is None:
+        print(json.dumps({'stream_follower_error': "no stream on the alerts table; later !set/!delete/!reset won't be seen"}))
+    else:
+        follower.prime()
+    load_active_alerts(tbl, index)
+    if follower is not None:
+        follower.start()
+    try:
+        print(json.dumps({'stream': run_stream(replay_file(args.replay), index, tbl, send_message)}))
+    finally:
+        if follower is not None:
+            follower.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+import json
+import os
+from collections import deque
+
+# Worker Lambda that runs queued commands; when unset the webhook runs them inline.
+COMMAND_WORKER_FUNCTION = os.environ.get('COMMAND_WORKER_FUNCTION', '')
+# How long a seen update_id is remembered. Telegram stops redelivering an
+# update well within a day. The alerts table should have DynamoDB TTL
+# enabled on `expires_at` so old markers are dropped automatically.
+UPDATE_DEDUPE_TTL = int(os.environ.get('UPDATE_DEDUPE_TTL_SECONDS', '86400'))
+# Dedupe markers live in the alerts table under a chat_id Telegram never uses.
+UPDATE_CHAT_ID = '#update'
+
+
+def mark_seen(tbl, stage, update_id, now_ts, ttl=None):
+    """
+    Record that update_id reached `stage` ('ack' in the webhook, 'run' in
+    the worker). Returns False if it already had, i.e. this is a redelivery.
+    Markers past their expiry count as unseen even before TTL removes them.
+    """
+    from boto3.dynamodb.conditions import Attr
+    from botocore.exceptions import ClientError
+    ttl = UPDATE_DEDUPE_TTL if ttl is None else ttl
+    try:
+        tbl.put_item(
+            Item={
+                'chat_id': UPDATE_CHAT_ID,
+                'symbol': f"{stage}#{update_id}",
+                'expires_at': int(now_ts) + ttl,
+            },
+            ConditionExpression=Attr('chat_id').not_exists() | Attr('expires_at').lt(int(now_ts)),
+        )
+        return True
+    except ClientError as err:
+        if err.response.get('Error', {}).get('Code') == 'ConditionalCheckFailedException':
+            return False
+        raise
+
+
+def forget(tbl, stage, update_id):
+    """
+    Drop a marker so a redelivery of update_id is processed again.
+    """
+    tbl.delete_item(Key={'chat_id': UPDATE_CHAT_ID, 'symbol': f"{stage}#{update_id}"})
+
+
+class LambdaQueue:
+    """
+    Queue commands as asynchronous invocations of the command worker
+    Lambda; Lambda's own event queue holds and retries them.
+    """
+
+    def __init__(self, function_name, client=None):
+        self.function_name = function_name
+        self._client = client
+
+    @property
+    def client(self):
+        if self._client is None:
+            import boto3
+            self._client = boto3.client('lambda')
+        return self._client
+
+    def send(self, update):
+        self.client.invoke(
+            FunctionName=self.function_name,
+            InvocationType='Event',
+            Payload=json.dumps({'update': update}).encode('utf-8'),
+        )
+
+
+class InProcessQueue:
+    """
+    Local stand-in for LambdaQueue: updates wait in memory until drain()
+    hands them to the worker, so fast-ack can run without AWS.
+    """
+
+    def __init__(self, worker):
+        self.worker = worker
+        self.pending = deque()
+
+    def send(self, update):
+        self.pending.append(update)
+
+    def drain(self):
+        ran = 0
+        while self.pending:
+            self.worker({'update': self.pending.popleft()}, None)
+            ran += 1
+        return ran
+
+
+_UNSET = object()
+_queue = _UNSET
+
+
+def get_queue():
+    """
+    The queue the webhook hands commands to, or None to run them inline.
+    """
+    global _queue
+    if _queue is _UNSET:
+        _queue = LambdaQueue(COMMAND_WORKER_FUNCTION) if COMMAND_WORKER_FUNCTION else None
+    return _queue
+
+
+def set_queue(queue):
+    """
+    Swap the command queue, e.g. for an InProcessQueue; None disables fast-ack.
+    """
+    global _queue
+    _queue = queue
+
+
+def enqueue_update(tbl, queue, update, now_ts):
+    """
+    Queue an update unless its update_id was already acknowledged. Returns
+    whether it was queued. If queuing fails the marker is dropped again so
+    Telegram's retry gets through.
+    """
+    update_id = update.get('update_id')
+    if update_id is not None and not mark_seen(tbl, 'ack', update_id, now_ts):
+        return False
+    try:
+        queue.send(update)
+    except Exception:
+        if update_id is not None:
+            forget(tbl, 'ack', update_id)
+        raise
+    return True
@@ -0,0 +1,218 @@
+import codecs
+import hashlib
+import json
+import os
+import tempfile
+import time
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+import urllib3
+
+# Response bodies persist here across warm invocations and worker processes; empty disables
+RESPONSE_CACHE_DIR = os.environ.get('RESPONSE_CACHE_DIR', '/tmp/av-responses')
+# Seconds a cached body is served without asking upstream; defaults to the quote cache TTL
+RESPONSE_CACHE_TTL = float(os.environ.get('RESPONSE_CACHE_TTL', os.environ.get('QUOTE_CACHE_TTL', '60')))
+# Hosts the pool keeps connections for (Alpha Vantage, Telegram, spare)
+HTTP_POOLS = int(os.environ.get('HTTP_POOLS', '4'))
+HTTP_CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT', '3'))
+# Bytes read per streamed chunk, and how much of an abandoned body is drained
+# to keep its connection instead of closing it
+CHUNK_SIZE = 16 * 1024
+DRAIN_LIMIT = 64 * 1024
+# Query parameters that identify the caller, not the resource
+_SECRET_PARAMS = {'apikey'}
+
+
+def make_pool(maxsize, read_timeout=None):
+    """
+    Connection pool for upstream calls: at most `maxsize` kept-alive
+    connections per host (extra requests wait for one rather than opening
+    throwaway sockets), compressed bodies, and quick connect retries.
+    """
+    return urllib3.PoolManager(
+        num_pools=HTTP_POOLS,
+        maxsize=maxsize,
+        block=True,
+        headers={'Accept-Encoding': 'gzip, deflate', 'Connection': 'keep-alive'},
+        retries=urllib3.Retry(total=2, connect=2, read=0, status=0, backoff_factor=0.1, raise_on_status=False),
+        timeout=urllib3.Timeout(connect=HTTP_CONNECT_TIMEOUT, read=read_timeout),
+    )
+
+
+def normalize_url(url):
+    """
+    Cache identity of a URL: API keys stripped and parameters sorted.
+    """
+    parts = urlsplit(url)
+    query = sorted((k, v) for k, v in parse_qsl(parts.query) if k.lower() not in _SECRET_PARAMS)
+    return f"{parts.scheme}://{parts.netloc}{parts.path}?{urlencode(query)}"
+
+
+class ResponseCache:
+    """
+    On-disk cache of upstream response bodies, one file per normalized URL.
+    Each file is a JSON header line (stored_at and any ETag/Last-Modified
+    validators) followed by the raw body. Expired entries with validators
+    are revalidated with a conditional request instead of refetched.
+    """
+
+    def __init__(self, directory, ttl, clock=time.time):
+        self.directory = directory
+        self.ttl = ttl
+        self.clock = clock
+
+    def _path(self, url):
+        return os.path.join(self.directory, hashlib.sha1(normalize_url(url).encode()).hexdigest())
+
+    def _load(self, url):
+        try:
+            with open(self._path(url), 'rb') as fh:
+                header = json.loads(fh.readline())
+                return header, fh.read()
+        except (OSError, ValueError):
+            return None, None
+
+    def fresh(self, url):
+        """
+        The cached body if it is younger than ttl, else None.
+        """
+        header, body = self._load(url)
+        if header is not None and self.clock() - header['stored_at'] < self.ttl:
+            return body
+        return None
+
+    def validators(self, url):
+        """
+        Conditional request headers for an expired entry, if it has any.
+        """
+        header, _ = self._load(url)
+        headers = {}
+        if header and header.get('etag'):
+            headers['If-None-Match'] = header['etag']
+        if header and header.get('last_modified'):
+            headers['If-Modified-Since'] = header['last_modified']
+        return headers
+
+    def revalidated(self, url):
+        """
+        Upstream answered 304: restart the entry's ttl and return its body.
+        """
+        header, body = self._load(url)
+        if header is None:
+            return None
+        self.store(url, body, {'ETag': header.get('etag'), 'Last-Modified': header.get('last_modified')})
+        return body
+
+    def store(self, url, body, headers=None):
+        headers = headers or {}
+        header = {
+            'stored_at': self.clock(),
+            'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified'),
+        }
+        os.makedirs(self.directory, exist_ok=True)
+        # Write then rename, so concurrent readers never see half a file
+        fd, tmp = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(fd, 'wb') as fh:
+            fh.write(json.dumps(header).encode() + b'\n' + body)
+        os.replace(tmp, self._path(url))
+
+
+class MissingKey(Exception):
+    """
+    Raised by stream_items when the document has no such key; carries the
+    whole parsed document (e.g. a throttle note or error message).
+    """
+
+    def __init__(self, document):
+        super().__init__('key not found')
+        self.document = document
+
+
+def stream_items(chunks, key):
+    """
+    Yield (name, value) pairs of the object under top-level `key` of a JSON
+    document arriving as byte chunks, decoding one value at a time, so a
+    caller can stop reading as soon as it has what it needs. Values must be
+    objects, arrays or strings (complete only once closed).
+    """
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder('utf-8')()
+    chunks = iter(chunks)
+    state = {'buf': ''}
+
+    def more():
+        chunk = next(chunks, None)
+        if chunk is None:
+            state['buf'] += text.decode(b'', final=True)
+            return False
+        state['buf'] += text.decode(chunk)
+        return True
+
+    def skip_ws(pos):
+        while True:
+            buf = state['buf']
+            while pos < len(buf) and buf[pos] in ' \t\r\n':
+                pos += 1
+            if pos < len(buf) or not more():
+                return pos
+
+    def decode_at(pos):
+        while True:
+            try:
+                return decoder.raw_decode(state['buf'], pos)
+            except ValueError:
+                if not more():
+                    raise
+
+    marker = json.dumps(key)
+    pos = -1
+    while pos < 0:
+        found = state['buf'].find(marker)
+        if found >= 0:
+            pos = skip_ws(found + len(marker))
+        elif not more():
+            raise MissingKey(json.loads(state['buf']) if state['buf'].strip() else None)
+    for expected in ':{':
+        if state['buf'][pos:pos + 1] != expected:
+            raise ValueError(f"malformed JSON after {marker}")
+        pos = skip_ws(pos + 1)
+    while True:
+        pos = skip_ws(pos)
+        head = state['buf'][pos:pos + 1]
+        if head in ('}', ''):
+            return
+        if head == ',':
+            pos += 1
+            continue
+        name, pos = decode_at(pos)
+        pos = skip_ws(pos)
+        if state['buf'][pos:pos + 1] != ':':
+            raise ValueError("malformed JSON object")
+        value, pos = decode_at(skip_ws(pos + 1))
+        yield name, value
+        if pos > CHUNK_SIZE:
+            # Drop what has been consumed now and then, not on every item
+            state['buf'], pos = state['buf'][pos:], 0
+
+
+def read_streamed(resp, parse):
+    """
+    Run parse over a streaming response's decompressed chunks. If parse
+    stops early, a short remainder is drained so the connection can be
+    reused; a long one closes the connection instead.
+    """
+    chunks = resp.stream(CHUNK_SIZE, decode_content=True)
+    try:
+        return parse(chunks)
+    finally:
+        drained = 0
+        try:
+            for chunk in chunks:
+                drained += len(chunk)
+                if drained > DRAIN_LIMIT:
+                    resp.close()
+                    break
+        except Exception:
+            resp.close()
+        resp.release_conn()
@@ -0,0 +1,294 @@
+import json
+import os
+from datetime import datetime, timezone
+
+from src.bot_helpers import compute_cagr
+
+# Bookkeeping rows in INDEX_TABLE mapping a symbol to the indexes holding it:
+# chat_id '#symbol#<SYMBOL>', index_name '<chat_id>#<index_name>'
+SYMBOL_REF_PREFIX = '#symbol#'
+# Age in seconds past which a stored valuation is requoted when it is read,
+# so indexes whose symbols no alert watches still move.
+VALUATION_MAX_AGE = int(os.environ.get('INDEX_VALUATION_MAX_AGE', '900'))
+
+
+def index_key(item):
+    return (item['chat_id'], item['index_name'])
+
+
+def valuate(item, prices, now=None):
+    """
+    Value an index at the given symbol prices. Symbols without a price are
+    left out of the total and returns.
+    """
+    symbols = item['symbols']
+    baselines = [float(bp) for bp in item.get('baseline_prices', [])]
+    known = {sym: prices[sym] for sym in symbols if prices.get(sym) is not None}
+    total = sum(known.values())
+    returns = {
+        sym: (known[sym] / base - 1) * 100
+        for sym, base in zip(symbols, baselines) if sym in known and base > 0
+    }
+    return {
+        'total': total,
+        'prices': known,
+        'returns': returns,
+        'cagr': compute_cagr(baselines, total, item.get('created_at')),
+        'avg_return': sum(returns.values()) / len(returns) if returns else 0.0,
+        'as_of': (now or datetime.now(timezone.utc)).isoformat(),
+    }
+
+
+def to_attribute(valuation):
+    """
+    DynamoDB form of a valuation: every float becomes a Decimal.
+    """
+    from decimal import Decimal
+    def dec(x):
+        return Decimal(str(round(x, 6)))
+    return {
+        'total': dec(valuation['total']),
+        'prices': {sym: dec(p) for sym, p in valuation['prices'].items()},
+        'returns': {sym: dec(r) for sym, r in valuation['returns'].items()},
+        'cagr': dec(valuation['cagr']),
+        'avg_return': dec(valuation['avg_return']),
+        'as_of': valuation['as_of'],
+    }
+
+
+def is_stale(valuation, now=None, max_age=None):
+    """
+    Whether a valuation is older than max_age seconds (VALUATION_MAX_AGE by
+    default), or has no as_of at all.
+    """
+    max_age = VALUATION_MAX_AGE if max_age is None else max_age
+    if not valuation.get('as_of'):
+        return True
+    age = (now or datetime.now(timezone.utc)) - datetime.fromisoformat(valuation['as_of'])
+    return age.total_seconds() > max_age
+
+
+def from_attribute(attribute):
+    return {
+        'total': float(attribute['total']),
+        'prices': {sym: float(p) for sym, p in attribute.get('prices', {}).items()},
+        'returns': {sym: float(r) for sym, r in attribute.get('returns', {}).items()},
+        'cagr': float(attribute['cagr']),
+        'avg_return': float(attribute['avg_return']),
+        'as_of': attribute.get('as_of'),
+    }
+
+
+class ValuationBook:
+    """
+    Index definitions with a reverse symbol -> indexes map, so a price
+    change revalues only the indexes holding that symbol. Each index is
+    compared against the prices its materialized valuation was built from.
+    """
+
+    def __init__(self):
+        self._indexes = {}     # (chat_id, index_name) -> index item
+        self._by_symbol = {}   # symbol -> {(chat_id, index_name)}
+        self._valued_at = {}   # (chat_id, index_name) -> {symbol: price}
+        self.prices = {}       # latest known price per symbol
+
+    def __len__(self):
+        return len(self._indexes)
+
+    def add(self, item):
+        key = index_key(item)
+        self.remove(*key)
+        self._indexes[key] = item
+        for sym in item['symbols']:
+            self._by_symbol.setdefault(sym, set()).add(key)
+        stored = (item.get('valuation') or {}).get('prices', {})
+        self._valued_at[key] = {sym: float(price) for sym, price in stored.items()}
+        for sym, price in self._valued_at[key].items():
+            self.prices.setdefault(sym, price)
+
+    def remove(self, chat_id, index_name):
+        item = self._indexes.pop((chat_id, index_name), None)
+        if item is None:
+            return
+        del self._valued_at[(chat_id, index_name)]
+        for sym in item['symbols']:
+            keys = self._by_symbol.get(sym, set())
+            keys.discard((chat_id, index_name))
+            if not keys:
+                self._by_symbol.pop(sym, None)
+
+    def load(self, items):
+        for item in items:
+            self.add(item)
+        return self
+
+    def symbols(self):
+        return list(self._by_symbol)
+
+    def index(self, key):
+        return self._indexes[key]
+
+    def indexes_for(self, symbol):
+        return set(self._by_symbol.get(symbol, ()))
+
+    def update_prices(self, prices, now=None):
+        """
+        Apply new prices and revalue the indexes holding a symbol whose
+        price changed. Returns (chat_id, index_name) -> valuation for those.
+        """
+        affected = set()
+        for sym, price in prices.items():
+            if price is None:
+                continue
+            self.prices[sym] = price
+            affected.update(
+                key for key in self._by_symbol.get(sym, ())
+                if self._valued_at[key].get(sym) != price
+            )
+        changed = {}
+        for key in affected:
+            changed[key] = valuate(self._indexes[key], self.prices, now)
+            self._valued_at[key] = dict(changed[key]['prices'])
+        return changed
+
+
+def symbol_refs(item):
+    """
+    The bookkeeping rows that point each of an index's symbols at it.
+    """
+    ref = f"{item['chat_id']}#{item['index_name']}"
+    return [{'chat_id': SYMBOL_REF_PREFIX + sym, 'index_name': ref} for sym in dict.fromkeys(item['symbols'])]
+
+
+def put_index(idx_tbl, item):
+    """
+    Store an index together with its symbol refs. The refs go first, so an
+    index is never stored without them; refs a replaced index no longer
+    needs are dropped by revalue_indexes when they next come up.
+    """
+    with idx_tbl.batch_writer() as batch:
+        for ref in symbol_refs(item):
+            batch.put_item(Item=ref)
+    idx_tbl.put_item(Item=item)
+
+
+def delete_index(idx_tbl, chat_id, index_name):
+    """
+    Delete an index and its symbol refs.
+    """
+    key = {'chat_id': chat_id, 'index_name': index_name}
+    item = idx_tbl.get_item(Key=key).get('Item')
+    idx_tbl.delete_item(Key=key)
+    if item:
+        with idx_tbl.batch_writer() as batch:
+            for ref in symbol_refs(item):
+                batch.delete_item(Key=ref)
+
+
+def _indexes_holding(idx_tbl, symbols):
+    """
+    Read the indexes that hold any of symbols through their refs, dropping
+    refs whose index was deleted or no longer holds the symbol.
+    """
+    from boto3.dynamodb.conditions import Key
+    from src.storage import iter_pages
+    items, stale = {}, []
+    for sym in symbols:
+        for ref in iter_pages(idx_tbl.query, KeyConditionExpression=Key('chat_id').eq(SYMBOL_REF_PREFIX + sym)):
+            chat_id, index_name = ref['index_name'].split('#', 1)
+            if (chat_id, index_name) not in items:
+                items[(chat_id, index_name)] = idx_tbl.get_item(Key={'chat_id': chat_id, 'index_name': index_name}).get('Item')
+            item = items[(chat_id, index_name)]
+            if not item or sym not in item['symbols']:
+                stale.append({'chat_id': ref['chat_id'], 'index_name': ref['index_name']})
+    if stale:
+        with idx_tbl.batch_writer() as batch:
+            for key in stale:
+                batch.delete_item(Key=key)
+    return [item for item in items.values() if item]
+
+
+def write_valuation(idx_tbl, key, stored, valuation):
+    """
+    Write an index's valuation in place of the stored one (an attribute, or
+    None) it was computed from. Returns False, writing nothing, if the index
+    was deleted or revalued by someone else since it was read.
+    """
+    from boto3.dynamodb.conditions import Attr
+    from botocore.exceptions import ClientError
+    try:
+        idx_tbl.update_item(
+            Key={'chat_id': key[0], 'index_name': key[1]},
+            UpdateExpression="SET valuation = :v",
+            ExpressionAttributeValues={':v': to_attribute(valuation)},
+            ConditionExpression=Attr('valuation').eq(stored) if stored else Attr('chat_id').exists() & Attr('valuation').not_exists(),
+        )
+        return True
+    except ClientError as err:
+        if err.response.get('Error', {}).get('Code') != 'ConditionalCheckFailedException':
+            raise
+        return False
+
+
+def revalue_indexes(idx_tbl, prices, now=None, attempts=3):
+    """
+    Revalue the indexes holding a symbol in prices and write back the
+    valuations that changed. prices are the quotes the alert checks fetched
+    this run (symbol -> price or None), so they only cover symbols whose
+    market moved since their alerts came due; nothing is quoted here.
+    Valuations of indexes no alert reaches are requoted when read, once
+    older than VALUATION_MAX_AGE.
+
+    Each write is conditioned on the valuation it was computed from. Shard
+    workers quoting different symbols of one index can then revalue it at
+    the same time: the one that loses re-reads the index and tries again.
+    """
+    prices = {sym: price for sym, price in prices.items() if price is not None}
+    book = ValuationBook().load(_indexes_holding(idx_tbl, prices) if prices else [])
+    # (chat_id, index_name) -> (valuation read, valuation to write)
+    pending = {key: (book.index(key).get('valuation'), valuation)
+               for key, valuation in (book.update_prices(prices, now) if len(book) else {}).items()}
+    written = 0
+    for _ in range(attempts):
+        retry = []
+        for key, (stored, valuation) in pending.items():
+            if write_valuation(idx_tbl, key, stored, valuation):
+                written += 1
+            else:
+                retry.append(key)
+        pending = {}
+        for chat_id, index_name in retry:
+            item = idx_tbl.get_item(Key={'chat_id': chat_id, 'index_name': index_name}).get('Item')
+            if item:  # otherwise deleted since it was read
+                ours = {sym: prices[sym] for sym in item['symbols'] if sym in prices}
+                for key, valuation in ValuationBook().load([item]).update_prices(ours, now).items():
+                    pending[key] = (item.get('valuation'), valuation)
+        if not pending:
+            break
+    return {'symbols': len(prices), 'indexes': len(book), 'revalued': written}
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="Maintain index symbol refs.")
+    parser.add_argument('--backfill-refs', action='store_true',
+                        help="write the symbol refs of indexes created before they existed")
+    args = parser.parse_args(argv)
+    if not args.backfill_refs:
+        parser.print_help()
+        return
+    from boto3.dynamodb.conditions import Attr
+    from src.bot_helpers import get_table
+    from src.storage import iter_pages
+    idx_tbl = get_table('INDEX_TABLE')
+    indexes = 0
+    with idx_tbl.batch_writer() as batch:
+        for item in iter_pages(idx_tbl.scan, FilterExpression=Attr('symbols').exists()):
+            for ref in symbol_refs(item):
+                batch.put_item(Item=ref)
+            indexes += 1
+    print(json.dumps({'backfilled_indexes': indexes}))
+
+
+if __name__ == '__main__':
+    main()
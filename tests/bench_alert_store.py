@@ -0,0 +1,117 @@
+"""
+Memory and CPU of the compact alert store against plain DynamoDB-style
+item dicts, at scheduler scale. Run from the repo root:
+
+    python tests/bench_alert_store.py --alerts 100000 --symbols 500
+
+Reports bytes per alert held in memory and microseconds per alert to decide
+one price check (the old dict loop vs AlertStore.evaluate_due, deciding
+which held alerts get rescheduled as the checker does). --rules mixes rule
+kinds into the store, e.g. --rules drop,rise,trail,move; the dict loop
+always checks plain drops for reference. --price sets the quote (at 92.5
+about half the alerts fire) and --interval their check interval in minutes.
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def rule_fields(rule, checked):
+    if rule == 'drop':
+        return {}
+    state = {'rule': rule}
+    if rule == 'trail':
+        state['peak_price'] = Decimal('100.0')
+    elif rule == 'move':
+        at = int(checked.timestamp())
+        state.update(window_minutes=Decimal('60'), window_high=Decimal('100.0'), window_high_at=at,
+                     window_low=Decimal('100.0'), window_low_at=at)
+    return state
+
+
+def make_items(alerts, symbols, rules=('drop',), interval=5):
+    checked = datetime.now(timezone.utc) - timedelta(hours=1)
+    return [
+        {
+            'chat_id': str(100000 + i // symbols),
+            'symbol': f"S{i % symbols:04d}",
+            'threshold_percent': Decimal(str(float(1 + i % 15))),
+            'interval_minutes': Decimal(interval),
+            'alert_sent': False,
+            'baseline_price': Decimal('100.0'),
+            'last_check': checked.isoformat(),
+            **rule_fields(rules[i % len(rules)], checked),
+        }
+        for i in range(alerts)
+    ]
+
+
+def measure(build):
+    tracemalloc.start()
+    value = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return value, size
+
+
+def dict_check(items, price, now):
+    """The per-item loop the checker ran before AlertStore."""
+    fired = held = 0
+    for item in items:
+        last_dt = datetime.fromisoformat(item['last_check'])
+        if (now - last_dt).total_seconds() < float(item.get('interval_minutes', 0)) * 60:
+            continue
+        baseline = float(item.get('baseline_price', 0))
+        threshold = float(item.get('threshold_percent', 0))
+        if price <= baseline * (1 - threshold / 100):
+            fired += 1
+        else:
+            held += 1
+    return fired, held
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--alerts', type=int, default=100000)
+    parser.add_argument('--symbols', type=int, default=500)
+    parser.add_argument('--rules', default='drop', help="comma-separated rule kinds to cycle through")
+    parser.add_argument('--price', type=float, default=92.5)
+    parser.add_argument('--interval', type=int, default=5)
+    args = parser.parse_args(argv)
+    sys.path.insert(0, ROOT)
+    from src.alert_store import AlertStore
+    from src.storage import needs_reschedule
+
+    items, dict_bytes = measure(lambda: make_items(args.alerts, args.symbols, interval=args.interval))
+    rules = args.rules.split(',')
+    store, store_bytes = measure(lambda: AlertStore.load(make_items(args.alerts, args.symbols, rules, args.interval)))
+    now = datetime.now(timezone.utc)
+    by_symbol = {}
+    for item in items:
+        by_symbol.setdefault(item['symbol'], []).append(item)
+
+    started = time.perf_counter()
+    for symbol, symbol_items in by_symbol.items():
+        dict_check(symbol_items, args.price, now)
+    dict_us = (time.perf_counter() - started) * 1e6 / args.alerts
+
+    started = time.perf_counter()
+    due = store.due(now.timestamp())
+    for symbol in due.symbols():
+        due.evaluate_due(symbol, args.price, now.timestamp(), needs_reschedule)
+    store_us = (time.perf_counter() - started) * 1e6 / args.alerts
+
+    print(f"{'':<14}{'bytes/alert':>14}{'us/alert':>12}")
+    print(f"{'dict items':<14}{dict_bytes / args.alerts:>14.0f}{dict_us:>12.3f}")
+    print(f"{'AlertStore':<14}{store_bytes / args.alerts:>14.0f}{store_us:>12.3f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
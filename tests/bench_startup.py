@@ -0,0 +1,153 @@
+"""
+Cold-start benchmark for the webhook and scheduler Lambdas.
+
+Each command runs in a fresh interpreter, which measures module import time
+and first/second invocation latency with Alpha Vantage, Telegram and DynamoDB
+answered locally (the real boto3 client is built, only the network call is
+skipped). Run from the repo root:
+
+    python tests/bench_startup.py --budget-ms 400
+
+Exits non-zero if importing the handler loads any of HEAVY_MODULES, or if
+any command's import + first call exceeds the budget.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+COMMANDS = [
+    '!start',
+    '!commands',
+    '!price AAPL',
+    '!set AAPL 5 60',
+    '!list',
+    '!createindex IDX AAPL MSFT',
+    '!index IDX',
+    'price_checker',
+]
+
+QUOTE = {'Global Quote': {'02. open': '99', '03. high': '101', '04. low': '98', '05. price': '100', '06. volume': '1'}}
+# Modules the webhook cold path must not import; loaded lazily where used
+HEAVY_MODULES = ('boto3', 'decimal')
+
+SERIES = {'Time Series (Daily)': {'2024-01-02': {'5. adjusted close': '100'}}}
+
+
+class FakeResponse:
+    def __init__(self, payload, status=200):
+        self.status = status
+        self.status_code = status
+        self.data = json.dumps(payload).encode()
+        self.headers = {}
+
+    def stream(self, amt, decode_content=True):
+        return iter([self.data[i:i + amt] for i in range(0, len(self.data), amt)])
+
+    def close(self):
+        pass
+
+    def release_conn(self):
+        pass
+
+
+def fake_http(method, url, **kwargs):
+    if 'sendMessage' in url:
+        return FakeResponse({'ok': True})
+    if 'TIME_SERIES' in url:
+        return FakeResponse(SERIES)
+    return FakeResponse(QUOTE)
+
+
+def fake_dynamodb(model=None, **kwargs):
+    """Answer DynamoDB calls before they hit the network."""
+    if model.name in ('Query', 'Scan'):
+        return FakeResponse({}), {'Items': [], 'Count': 0}
+    return FakeResponse({}), {}
+
+
+def child(command):
+    os.environ.setdefault('BOT_TOKEN', 'bench')
+    os.environ.setdefault('ALPHA_VANTAGE_KEY', 'bench')
+    os.environ.setdefault('DDB_TABLE', 'alerts')
+    os.environ.setdefault('INDEX_TABLE', 'indexes')
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-west-2')
+    os.environ.setdefault('HISTORY_DIR', tempfile.mkdtemp(prefix='bench-history-'))
+    os.environ.setdefault('MARKET_HOURS', '0')
+    os.environ.setdefault('RESPONSE_CACHE_DIR', tempfile.mkdtemp(prefix='bench-responses-'))
+    sys.path.insert(0, ROOT)
+    started = time.perf_counter()
+    import src.handler as handler
+    imported = time.perf_counter()
+    import src.bot_helpers as bot_helpers
+    import src.ddb as ddb
+    bot_helpers.HTTP.request = fake_http
+    build_client = ddb.dynamodb_client
+
+    def stubbed_client():
+        client = build_client()
+        client.meta.events.register('before-call.dynamodb.*', fake_dynamodb)
+        return client
+    ddb.dynamodb_client = stubbed_client
+    heavy_at_import = [name for name in HEAVY_MODULES if name in sys.modules]
+
+    def invoke():
+        if command == 'price_checker':
+            return handler.price_checker({}, None)
+        event = {'body': json.dumps({'message': {'chat': {'id': 1}, 'text': command}})}
+        return handler.lambda_handler(event, None)
+    t0 = time.perf_counter()
+    invoke()
+    t1 = time.perf_counter()
+    bot_helpers.QUOTE_CACHE.clear()
+    invoke()
+    t2 = time.perf_counter()
+    print(json.dumps({
+        'command': command,
+        'import_ms': round((imported - started) * 1000, 1),
+        'first_call_ms': round((t1 - t0) * 1000, 1),
+        'warm_call_ms': round((t2 - t1) * 1000, 1),
+        'heavy_at_import': heavy_at_import,
+        'boto3_loaded': 'boto3' in sys.modules,
+    }))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--budget-ms', type=float, default=None,
+                        help="fail if import + first call exceeds this for any command")
+    parser.add_argument('--repeat', type=int, default=3, help="fresh interpreters per command (median is reported)")
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.child:
+        child(args.child)
+        return 0
+    over_budget, heavy = [], set()
+    print(f"{'command':<30}{'import':>10}{'first':>10}{'warm':>10}  boto3")
+    for command in COMMANDS:
+        runs = []
+        for _ in range(args.repeat):
+            out = subprocess.run([sys.executable, __file__, '--child', command],
+                                 capture_output=True, text=True, check=True, cwd=ROOT)
+            runs.append(json.loads(out.stdout.strip().splitlines()[-1]))
+        runs.sort(key=lambda r: r['import_ms'] + r['first_call_ms'])
+        r = runs[len(runs) // 2]
+        print(f"{command:<30}{r['import_ms']:>10}{r['first_call_ms']:>10}{r['warm_call_ms']:>10}  "
+              f"{'yes' if r['boto3_loaded'] else 'no'}")
+        heavy.update(r['heavy_at_import'])
+        if args.budget_ms is not None and r['import_ms'] + r['first_call_ms'] > args.budget_ms:
+            over_budget.append(command)
+    if heavy:
+        print(f"loaded by import src.handler: {', '.join(sorted(heavy))}")
+    if over_budget:
+        print(f"over {args.budget_ms} ms budget: {', '.join(over_budget)}")
+    return 1 if heavy or over_budget else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,273 @@
+"""
+Throughput benchmark for lambda_handler and price_checker.
+
+Everything runs in-process against local stand-ins:
+- an HTTP stub serving Alpha Vantage and Telegram, with injectable latency;
+- MemoryTable alerts/index tables with pagination, batch writes and
+  capacity-unit accounting.
+
+Set AV_BULK_QUOTES=1 to measure the bulk quote path (the stub serves
+REALTIME_BULK_QUOTES too). Webhook bodies are replayed per command and scheduler runs are timed at the
+requested scale. Run from the repo root:
+
+    python tests/bench_throughput.py --alerts 10000 --symbols 500 --latency-ms 20
+    python tests/bench_throughput.py --save bench_baseline.json
+    python tests/bench_throughput.py --baseline bench_baseline.json --max-regression 0.25
+
+With --baseline the run exits non-zero when any p50/p99 or scheduler runtime
+grows by more than --max-regression (a fraction), or when upstream calls or
+capacity units per scheduler run go up at all.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def stub_price(symbol):
+    """Deterministic price per symbol: a 100 baseline minus 0-9.9%."""
+    return round(100 - (zlib.crc32(symbol.encode()) % 100) / 10, 2)
+
+
+class Upstream(ThreadingHTTPServer):
+    """Alpha Vantage + Telegram stub counting calls per function/method."""
+    daemon_threads = True
+
+    def __init__(self, latency):
+        super().__init__(('127.0.0.1', 0), UpstreamHandler)
+        self.latency = latency
+        self.calls = Counter()
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+class UpstreamHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True  # otherwise delayed ACKs add ~40 ms per reply
+
+    def _reply(self, payload):
+        time.sleep(self.server.latency)
+        body = json.dumps(payload).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        query = {k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()}
+        function = query.get('function', '')
+        with self.server.lock:
+            self.server.calls[function] += 1
+        if function == 'CURRENCY_EXCHANGE_RATE':
+            symbol = f"{query['from_currency']}-{query['to_currency']}"
+            return self._reply({'Realtime Currency Exchange Rate': {'5. Exchange Rate': str(stub_price(symbol))}})
+        symbol = query.get('symbol', '')
+        if function == 'REALTIME_BULK_QUOTES':
+            return self._reply({'data': [
+                {'symbol': s, 'open': '100', 'high': '101', 'low': str(stub_price(s)), 'close': str(stub_price(s)),
+                 'volume': '1000'}
+                for s in symbol.split(',')
+            ]})
+        if function == 'TIME_SERIES_DAILY_ADJUSTED':
+            return self._reply({'Time Series (Daily)': {'2024-01-02': {'5. adjusted close': str(stub_price(symbol))}}})
+        price = stub_price(symbol)
+        return self._reply({'Global Quote': {
+            '02. open': '100', '03. high': '101', '04. low': str(price), '05. price': str(price), '06. volume': '1000',
+        }})
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        with self.server.lock:
+            self.server.calls['sendMessage'] += 1
+        self._reply({'ok': True, 'result': {}})
+
+    def log_message(self, *args):
+        pass
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))] if ordered else 0.0
+
+
+def setup(upstream):
+    """Point the bot at the stub and import it; returns (handler, alerts, indexes)."""
+    os.environ.update({
+        'BOT_TOKEN': 'bench', 'ALPHA_VANTAGE_KEY': 'bench', 'DDB_TABLE': 'alerts', 'INDEX_TABLE': 'indexes',
+        'ALPHA_VANTAGE_URL': f"{upstream.url}/query", 'TELEGRAM_API_URL': upstream.url,
+        'AV_REQUESTS_PER_MINUTE': os.environ.get('AV_REQUESTS_PER_MINUTE', '1000000'),
+        'METRICS_NAMESPACE': os.environ.get('METRICS_NAMESPACE', ''),  # keep EMF lines out of the report
+        'HISTORY_DIR': tempfile.mkdtemp(prefix='bench-history-'),  # every run starts without local bars
+        'MARKET_HOURS': os.environ.get('MARKET_HOURS', '0'),  # same work whatever the weekday
+        'RESPONSE_CACHE_DIR': tempfile.mkdtemp(prefix='bench-responses-'),  # no bodies left from earlier runs
+    })
+    sys.path.insert(0, ROOT)
+    import src.bot_helpers as bot_helpers
+    import src.handler as handler
+    from src.memory_table import MemoryTable
+    from src.storage import ACTIVE_ALERTS_INDEX
+    tables = {
+        'DDB_TABLE': MemoryTable('alerts', indexes={ACTIVE_ALERTS_INDEX: ('due_shard', 'next_due')}),
+        'INDEX_TABLE': MemoryTable('indexes', key=('chat_id', 'index_name')),
+    }
+    bot_helpers.get_table = handler.get_table = tables.__getitem__
+    return handler, bot_helpers, tables
+
+
+def seed_alerts(tbl, alerts, symbols, chats):
+    from src.storage import due_fields
+    past = datetime.now(timezone.utc) - timedelta(hours=1)
+    for i in range(alerts):
+        symbol = symbols[i % len(symbols)]
+        tbl.put_item(Item={
+            'chat_id': chats[(i // len(symbols)) % len(chats)],
+            'symbol': symbol,
+            'threshold_percent': Decimal(str(1 + i % 15)),
+            'interval_minutes': Decimal('5'),
+            'alert_sent': False,
+            'baseline_price': Decimal('100'),
+            'last_check': past.isoformat(),
+            **due_fields(symbol, 5, past),
+        })
+
+
+def bench_webhook(handler, bot_helpers, symbols, chats, requests, rng):
+    commands = {
+        '!start': lambda: '!start',
+        '!commands': lambda: '!commands',
+        '!price': lambda: f"!price {rng.choice(symbols)}",
+        '!set': lambda: f"!set {rng.choice(symbols)} {rng.randint(1, 15)} 5",
+        '!list': lambda: '!list',
+        '!createindex': lambda: f"!createindex IDX{rng.randint(0, 9)} " + ' '.join(rng.sample(symbols, 5)),
+        '!index': lambda: f"!index IDX{rng.randint(0, 9)}",
+        '!indexes': lambda: '!indexes',
+    }
+    results = {}
+    for name, make_text in commands.items():
+        samples = []
+        for _ in range(requests):
+            event = {'body': json.dumps({'message': {'chat': {'id': rng.choice(chats)}, 'text': make_text()}})}
+            started = time.perf_counter()
+            handler.lambda_handler(event, None)
+            samples.append((time.perf_counter() - started) * 1000)
+        results[name] = {'p50_ms': round(percentile(samples, 50), 2), 'p99_ms': round(percentile(samples, 99), 2)}
+    return results
+
+
+def bench_scheduler(handler, bot_helpers, tables, upstream, runs, workers, executor):
+    alerts = tables['DDB_TABLE']
+    results = []
+    for _ in range(runs):
+        # Each scheduled run starts cold: no quotes in memory or bodies on disk
+        bot_helpers.QUOTE_CACHE.clear()
+        if bot_helpers.SCHEDULER.cache is not None:
+            shutil.rmtree(bot_helpers.SCHEDULER.cache.directory, ignore_errors=True)
+        calls_before = upstream.calls.copy()
+        read_before, write_before = alerts.consumed['read'], alerts.consumed['write']
+        started = time.perf_counter()
+        summary = handler.run_price_checker(alerts, workers=workers, executor=executor)
+        results.append({
+            'runtime_ms': round((time.perf_counter() - started) * 1000, 1),
+            'alerts_due': summary['alerts_due'],
+            'alerts_triggered': summary['alerts_triggered'],
+            'upstream_calls': sum(n for fn, n in (upstream.calls - calls_before).items() if fn != 'sendMessage'),
+            'messages_sent': (upstream.calls - calls_before)['sendMessage'],
+            'rcu': round(alerts.consumed['read'] - read_before, 1),
+            'wcu': round(alerts.consumed['write'] - write_before, 1),
+        })
+        # make everything due again for the next run
+        for item in alerts.items.values():
+            if 'next_due' in item:
+                item['next_due'] = 0
+    return results
+
+
+def check_regressions(report, baseline, max_regression):
+    failures = []
+    for name, now in report['webhook'].items():
+        before = baseline.get('webhook', {}).get(name)
+        for metric in ('p50_ms', 'p99_ms'):
+            if before and before[metric] > 0 and now[metric] > before[metric] * (1 + max_regression):
+                failures.append(f"{name} {metric}: {before[metric]} -> {now[metric]}")
+    first_now, first_before = report['scheduler'][0], baseline.get('scheduler', [{}])[0]
+    if first_before.get('runtime_ms') and first_now['runtime_ms'] > first_before['runtime_ms'] * (1 + max_regression):
+        failures.append(f"scheduler runtime_ms: {first_before['runtime_ms']} -> {first_now['runtime_ms']}")
+    for metric in ('upstream_calls', 'rcu', 'wcu'):
+        if metric in first_before and first_now[metric] > first_before[metric]:
+            failures.append(f"scheduler {metric}: {first_before[metric]} -> {first_now[metric]}")
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--alerts', type=int, default=10000)
+    parser.add_argument('--symbols', type=int, default=500)
+    parser.add_argument('--chats', type=int, default=1000)
+    parser.add_argument('--requests', type=int, default=50, help="webhook requests replayed per command")
+    parser.add_argument('--runs', type=int, default=2, help="scheduler runs")
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--executor', choices=['thread', 'process'], default='thread')
+    parser.add_argument('--latency-ms', type=float, default=5.0, help="added to every stub response")
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--save', help="write the report as JSON to this path")
+    parser.add_argument('--baseline', help="compare against a saved report")
+    parser.add_argument('--max-regression', type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    upstream = Upstream(args.latency_ms / 1000)
+    threading.Thread(target=upstream.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True).start()
+    try:
+        handler, bot_helpers, tables = setup(upstream)
+        rng = random.Random(args.seed)
+        symbols = [f"S{i:04d}" for i in range(args.symbols)]
+        chats = [str(100000 + i) for i in range(args.chats)]
+        seed_alerts(tables['DDB_TABLE'], args.alerts, symbols, chats)
+        for tbl in tables.values():
+            tbl.consumed.update(read=0.0, write=0.0)
+        report = {
+            'scale': {'alerts': args.alerts, 'symbols': args.symbols, 'latency_ms': args.latency_ms,
+                      'workers': args.workers},
+            'scheduler': bench_scheduler(handler, bot_helpers, tables, upstream, args.runs, args.workers, args.executor),
+            'webhook': bench_webhook(handler, bot_helpers, symbols, chats, args.requests, rng),
+            'quote_cache': bot_helpers.QUOTE_CACHE.stats(),
+        }
+    finally:
+        upstream.shutdown()
+
+    print(f"{'command':<16}{'p50 ms':>10}{'p99 ms':>10}")
+    for name, r in report['webhook'].items():
+        print(f"{name:<16}{r['p50_ms']:>10}{r['p99_ms']:>10}")
+    for i, run in enumerate(report['scheduler']):
+        print(f"scheduler run {i}: " + ', '.join(f"{k}={v}" for k, v in run.items()))
+    if args.save:
+        with open(args.save, 'w') as fh:
+            json.dump(report, fh, indent=2)
+    if args.baseline:
+        with open(args.baseline) as fh:
+            failures = check_regressions(report, json.load(fh), args.max_regression)
+        if failures:
+            print("regressions:\n  " + "\n  ".join(failures))
+            return 1
+        print("no regressions")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,51 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+class FakeClock:
+    """Manually advanced clock; sleeping advances it instead of blocking, and is safe across threads."""
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+        self.lock = threading.Lock()
+    def __call__(self):
+        return self.now
+    def sleep(self, seconds):
+        with self.lock:
+            self.sleeps.append(seconds)
+            self.now += seconds
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+class _Handler(BaseHTTPRequestHandler):
+    handle_get = None
+    def do_GET(self):
+        self.handle_get(self)
+    def reply_json(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def serve():
+    """Start local stand-ins for the provider: serve(handle) answers each GET with handle(request)."""
+    servers = []
+    def start(handle, protocol_version="HTTP/1.0"):
+        handler = type("Handler", (_Handler,), {"handle_get": staticmethod(handle), "protocol_version": protocol_version})
+        server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True).start()
+        server.base = f"http://127.0.0.1:{server.server_address[1]}/query"
+        servers.append(server)
+        return server
+    yield start
+    for server in servers:
+        server.shutdown()
@@ -0,0 +1,125 @@
+import pickle
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+from src.alert_store import AlertRecord, AlertStore
+
+def make_item(symbol, chat_id="c1", baseline="100.0", threshold="5.0", minutes="10", next_due=1000, **extra):
+    item = {
+        'chat_id': chat_id, 'symbol': symbol, 'baseline_price': Decimal(baseline),
+        'threshold_percent': Decimal(threshold), 'interval_minutes': Decimal(minutes),
+        'alert_sent': False, 'last_check': "2024-01-01T00:00:00+00:00", **extra,
+    }
+    if next_due is not None:
+        item.update(due_shard=3, next_due=next_due)
+    return item
+
+def test_check_splits_at_trigger_price():
+    """Alerts whose trigger is at or above the price fire; the rest are held."""
+    store = AlertStore.load([
+        make_item("AAA", chat_id="c1", threshold="5.0"),    # trigger 95
+        make_item("AAA", chat_id="c2", threshold="10.0"),   # trigger 90
+        make_item("AAA", chat_id="c3", threshold="2.0"),    # trigger 98
+        make_item("BBB", chat_id="c1"),
+        make_item("CCC", chat_id="c1", alert_sent=True),
+    ])
+    assert len(store) == 4 and sorted(store.symbols()) == ["AAA", "BBB"]
+    fired, held = store.check("AAA", 95.0)
+    assert sorted(r.chat_id for r in fired) == ["c1", "c3"]
+    assert [r.chat_id for r in held] == ["c2"]
+    assert store.check("ZZZ", 1.0) == ([], [])
+
+def test_due_filters_on_next_due_or_last_check():
+    now = datetime(2024, 1, 1, 1, 0, tzinfo=timezone.utc)
+    recent = (now - timedelta(minutes=5)).isoformat()
+    store = AlertStore.load([
+        make_item("AAA", chat_id="due", next_due=int(now.timestamp())),
+        make_item("AAA", chat_id="later", next_due=int(now.timestamp()) + 60),
+        make_item("BBB", chat_id="legacy", next_due=None),
+        dict(make_item("CCC", chat_id="recent", next_due=None), last_check=recent),
+    ])
+    due = store.due(now.timestamp())
+    assert {(s, r.chat_id) for s in due.symbols() for r in due.alerts(s)} == {("AAA", "due"), ("BBB", "legacy")}
+
+def test_to_item_round_trips_stored_values():
+    """Rebuilt items carry the Decimals !set wrote plus unknown attributes."""
+    item = make_item("AAA", baseline="187.23", threshold="2.5", minutes="60", note="keep me")
+    record = AlertStore.load([item]).alerts("AAA")[0]
+    rebuilt = record.to_item(False, "2024-01-02T00:00:00+00:00", {'due_shard': 3, 'next_due': 2000})
+    assert rebuilt['baseline_price'] == Decimal("187.23")
+    assert rebuilt['threshold_percent'] == Decimal("2.5")
+    assert str(rebuilt['interval_minutes']) == "60"
+    assert rebuilt['note'] == "keep me"
+    assert rebuilt['next_due'] == 2000
+    fired = record.to_item(True, "2024-01-02T00:00:00+00:00")
+    assert 'next_due' not in fired and fired['alert_sent'] is True
+
+def test_evaluate_runs_every_rule_kind_in_one_pass():
+    """Static rules split by bisect; trail and move rules carry rolling state."""
+    store = AlertStore.load([
+        make_item("AAA", chat_id="drop"),                                    # fires at <= 95
+        make_item("AAA", chat_id="rise", rule="rise"),                       # fires at >= 105
+        make_item("AAA", chat_id="trail", rule="trail", peak_price=Decimal("100.0")),
+        make_item("AAA", chat_id="move", threshold="3.0", rule="move", window_minutes=Decimal("10"),
+                  window_high=Decimal("100.0"), window_high_at=0, window_low=Decimal("100.0"), window_low_at=0),
+    ])
+    fired, held, changed = store.evaluate("AAA", 104.0, 60)
+    assert [r.chat_id for r in fired] == ["move"]          # 4% off the window low
+    assert [r.chat_id for r in held] == ["drop", "rise"]
+    assert [(r.chat_id, r.high) for r in changed] == [("trail", 104.0)]
+    fired, held, changed = store.evaluate("AAA", 98.0, 700)
+    assert [r.chat_id for r in fired] == ["trail"]         # 5.8% off the 104 peak
+    # Both move window extremes aged out and restart from 98
+    assert [(r.chat_id, r.high, r.low, r.high_at) for r in changed] == [("move", 98.0, 98.0, 700)]
+
+def test_evaluate_due_settles_held_alerts_per_interval():
+    """Held alerts come back as plain columns for the intervals that reschedule, and as a count otherwise."""
+    store = AlertStore.load([
+        make_item("AAA", chat_id="fires"),                           # trigger 95
+        make_item("AAA", chat_id="short", threshold="2.0", minutes="1"),
+        make_item("AAA", chat_id="long", threshold="3.0", minutes="60"),
+        make_item("AAA", chat_id="trail", minutes="1", rule="trail", peak_price=Decimal("100.0")),
+        make_item("AAA", chat_id="later", next_due=2000),
+    ]).due(1000)
+    asked = []
+    def reschedule(minutes):
+        asked.append(minutes)
+        return minutes > 1
+    fired, held, changed, skipped = store.evaluate_due("AAA", 101.0, 60, reschedule)
+    assert sorted(asked) == [1, 10, 60]
+    assert (fired, held, skipped) == ([], [("fires", 100.0, 10.0), ("long", 100.0, 60.0)], 1)
+    assert [(r.chat_id, r.high) for r in changed] == [("trail", 101.0)]
+    fired, held, changed, skipped = store.evaluate_due("AAA", 94.0, 120, reschedule)
+    assert [r.chat_id for r in fired] == ["fires", "long", "short", "trail"]
+    assert (held, changed, skipped) == ([], [], 0)
+    assert store.evaluate_due("ZZZ", 1.0, 0, reschedule) == ([], [], [], 0)
+
+def test_evaluate_due_always_returns_held_alerts_without_due_fields():
+    """A legacy alert is written back even when its interval wouldn't reschedule, so it gets due fields."""
+    store = AlertStore.load([
+        make_item("AAA", chat_id="legacy", minutes="1", next_due=None),
+        make_item("AAA", chat_id="indexed", minutes="1", next_due=0),
+        make_item("AAA", chat_id="trail", minutes="1", next_due=None, rule="trail", peak_price=Decimal("100.0")),
+    ]).due(2_000_000_000)
+    fired, held, changed, skipped = store.evaluate_due("AAA", 101.0, 2_000_000_000, lambda minutes: False)
+    assert (fired, held, skipped) == ([], [("legacy", 100.0, 1.0)], 1)
+    assert [(r.chat_id, r.scheduled) for r in changed] == [("trail", False)]
+
+def test_rule_state_round_trips_through_items():
+    item = make_item("AAA", rule="move", window_minutes=Decimal("30"), cooldown_minutes=Decimal("60"),
+                     window_high=Decimal("101.5"), window_high_at=50, window_low=Decimal("99.0"), window_low_at=40)
+    record = AlertStore.load([item]).alerts("AAA")[0]
+    assert (record.rule, record.window, record.cooldown, record.high, record.low_at) == ("move", 30.0, 60.0, 101.5, 40)
+    rebuilt = record.to_item(False, "2024-01-02T00:00:00+00:00")
+    for key in ('rule', 'window_minutes', 'cooldown_minutes', 'window_high', 'window_high_at', 'window_low', 'window_low_at'):
+        assert rebuilt[key] == item[key]
+    record.rearm(90.0, 500)
+    rearmed = record.to_item(False, "2024-01-02T00:00:00+00:00")
+    assert rearmed['baseline_price'] == rearmed['window_low'] == Decimal("90.0")
+    assert rearmed['window_high_at'] == 500
+
+def test_store_pickles_for_worker_processes():
+    store = AlertStore.load([make_item("AAA"), make_item("AAA", chat_id="c2")])
+    copy = pickle.loads(pickle.dumps(store))
+    assert len(copy) == 2
+    assert isinstance(copy.alerts("AAA")[0], AlertRecord)
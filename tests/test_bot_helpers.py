@@ -1,8 +1,17 @@
 import pytest
+import threading
 from decimal import Decimal
 from datetime import datetime, timedelta, timezone
 
-from src.bot_helpers import format_price_line, compute_cagr, avg_equal_return
+import src.bot_helpers as bot_helpers
+from src.bot_helpers import format_price_line, compute_cagr, avg_equal_return, fetch_quotes
+
+@pytest.fixture(autouse=True)
+def clear_quote_cache():
+    """Start every test with an empty shared quote cache."""
+    bot_helpers.QUOTE_CACHE.clear()
+    yield
+    bot_helpers.QUOTE_CACHE.clear()
 
 @pytest.mark.parametrize("data,expected_prefix", [
     # Stock up scenario
@@ -38,9 +47,91 @@ def test_avg_equal_return(monkeypatch):
     """avg_equal_return should calculate equal-weight returns correctly."""
     # Stub get_quote_data to return predictable prices
     monkeypatch.setattr("src.bot_helpers.get_quote_data",
-                        lambda sym, key: {"price": 2.0 if sym=="A" else 4.0})
+                        lambda sym, key, priority=None: {"price": 2.0 if sym=="A" else 4.0})
     baselines = [1, 2]
     symbols = ["A","B"]
     avg = avg_equal_return(baselines, symbols, alpha_key="DUMMY")
     # (2/1 -1)*100 =100%, (4/2 -1)*100 =100%, average =100
-    assert pytest.approx(100.0) == avg
\ No newline at end of file
+    assert pytest.approx(100.0) == avg
+
+def test_get_price_reuses_cached_quote(monkeypatch):
+    """get_price should serve from a fresh full quote instead of refetching."""
+    calls = []
+    def fake_fetch(sym, key, priority=None):
+        calls.append(sym)
+        return {"price": 12.5}
+    monkeypatch.setattr("src.bot_helpers._fetch_quote_data", fake_fetch)
+    monkeypatch.setattr("src.bot_helpers._fetch_price",
+                        lambda sym, key, priority=None: pytest.fail("price should come from the cached quote"))
+    bot_helpers.get_quote_data("AAA", "DUMMY")
+    bot_helpers.get_quote_data("AAA", "DUMMY")
+    assert bot_helpers.get_price("AAA", "DUMMY") == 12.5
+    assert calls == ["AAA"]
+    assert bot_helpers.QUOTE_CACHE.hits == 1
+
+
+def test_fetch_quotes_dedupes_and_runs_concurrently(monkeypatch):
+    """fetch_quotes should fetch each distinct symbol once, in parallel."""
+    barrier = threading.Barrier(3, timeout=2)
+    calls = []
+    def fake_quote(sym, key, priority=None):
+        calls.append(sym)
+        barrier.wait()  # only passes if all three fetches are in flight together
+        return {"price": float(len(sym))}
+    monkeypatch.setattr("src.bot_helpers.get_quote_data", fake_quote)
+    quotes = fetch_quotes(["A", "BB", "A", "CCC"], "DUMMY", max_workers=3)
+    assert sorted(calls) == ["A", "BB", "CCC"]
+    assert quotes == {"A": {"price": 1.0}, "BB": {"price": 2.0}, "CCC": {"price": 3.0}}
+
+def test_fetch_quotes_times_out_slow_symbols(monkeypatch):
+    """A symbol that overruns its timeout maps to a missing price."""
+    release = threading.Event()
+    def fake_quote(sym, key, priority=None):
+        if sym == "SLOW":
+            release.wait(2)
+        return {"price": 1.0}
+    monkeypatch.setattr("src.bot_helpers.get_quote_data", fake_quote)
+    quotes = fetch_quotes(["FAST", "SLOW"], "DUMMY", max_workers=2, timeout=0.05)
+    release.set()
+    assert quotes["FAST"] == {"price": 1.0}
+    assert quotes["SLOW"] == {"price": None}
+
+def test_fetch_quotes_bulk_endpoint_and_pairs(monkeypatch):
+    """Equities share one bulk call; pairs and symbols it missed are fetched one by one."""
+    monkeypatch.setattr(bot_helpers, "BULK_QUOTES", True)
+    urls = []
+    def fake_request(url, key, priority):
+        urls.append(url)
+        return {"data": [
+            {"symbol": "AAA", "open": "9", "high": "11", "low": "8", "close": "10", "volume": "5"},
+            {"symbol": "BBB", "close": "20"},
+        ]}
+    monkeypatch.setattr(bot_helpers.SCHEDULER, "request", fake_request)
+    singles = []
+    def fake_price(sym, key, priority=None):
+        singles.append(sym)
+        return 1.5
+    monkeypatch.setattr("src.bot_helpers.get_price", fake_price)
+    quotes = fetch_quotes(["AAA", "BTC-USD", "BBB", "ZZZ"], "DUMMY", adjusted=False)
+    assert len(urls) == 1 and "REALTIME_BULK_QUOTES" in urls[0] and "symbol=AAA,BBB,ZZZ" in urls[0]
+    assert sorted(singles) == ["BTC-USD", "ZZZ"]
+    assert quotes["AAA"]["price"] == 10.0 and quotes["AAA"]["open"] == 9.0
+    assert quotes["BBB"]["price"] == 20.0
+    assert quotes["BTC-USD"] == {"price": 1.5}
+    # Bulk results are cached, so a second call is served without fetching
+    urls.clear()
+    assert fetch_quotes(["AAA", "BBB"], "DUMMY", adjusted=False)["BBB"] == {"price": 20.0}
+    assert urls == []
+
+def test_fetch_quotes_marks_deferred_symbols(monkeypatch):
+    """Scheduled callers can tell a deferred symbol from a failed one."""
+    from src.rate_limit import SCHEDULED, UpstreamDeferred
+    def fake_price(sym, key, priority=None):
+        if sym == "LATER":
+            raise UpstreamDeferred("no budget")
+        if sym == "BROKEN":
+            raise ValueError("bad payload")
+        return 3.0
+    monkeypatch.setattr("src.bot_helpers.get_price", fake_price)
+    quotes = fetch_quotes(["OK", "LATER", "BROKEN"], "DUMMY", priority=SCHEDULED, adjusted=False)
+    assert quotes == {"OK": {"price": 3.0}, "LATER": {"price": None, "deferred": True}, "BROKEN": {"price": None}}
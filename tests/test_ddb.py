@@ -0,0 +1,66 @@
+from decimal import Decimal
+
+import boto3
+import pytest
+from boto3.dynamodb.conditions import Attr, Key
+from botocore.stub import Stubber
+
+from src.ddb import ClientTable
+
+@pytest.fixture
+def stubbed():
+    """A ClientTable over a real low-level client whose calls are stubbed."""
+    client = boto3.client('dynamodb', region_name='us-west-2',
+                          aws_access_key_id='test', aws_secret_access_key='test')
+    with Stubber(client) as stubber:
+        yield ClientTable('alerts', client=client), stubber
+        stubber.assert_no_pending_responses()
+
+def test_put_item_serializes_item_and_condition(stubbed):
+    """Plain items and Attr conditions are rendered for the low-level API."""
+    tbl, stubber = stubbed
+    stubber.add_response('put_item', {}, {
+        'TableName': 'alerts',
+        'Item': {'chat_id': {'S': 'c1'}, 'symbol': {'S': 'AAA'}, 'baseline_price': {'N': '10.5'}},
+        'ConditionExpression': 'attribute_not_exists(#n0)',
+        'ExpressionAttributeNames': {'#n0': 'chat_id'},
+    })
+    tbl.put_item(Item={'chat_id': 'c1', 'symbol': 'AAA', 'baseline_price': Decimal('10.5')},
+                 ConditionExpression=Attr('chat_id').not_exists())
+
+def test_query_deserializes_items_and_last_key(stubbed):
+    """Query results come back as plain Python values, like the Table resource."""
+    tbl, stubber = stubbed
+    stubber.add_response('query', {
+        'Items': [{'chat_id': {'S': 'c1'}, 'symbol': {'S': 'AAA'}, 'next_due': {'N': '5'}}],
+        'Count': 1,
+        'LastEvaluatedKey': {'chat_id': {'S': 'c1'}, 'symbol': {'S': 'AAA'}},
+    }, {
+        'TableName': 'alerts',
+        'KeyConditionExpression': '#n0 = :v0',
+        'ExpressionAttributeNames': {'#n0': 'chat_id'},
+        'ExpressionAttributeValues': {':v0': {'S': 'c1'}},
+    })
+    resp = tbl.query(KeyConditionExpression=Key('chat_id').eq('c1'))
+    assert resp['Items'] == [{'chat_id': 'c1', 'symbol': 'AAA', 'next_due': Decimal('5')}]
+    assert resp['LastEvaluatedKey'] == {'chat_id': 'c1', 'symbol': 'AAA'}
+
+def test_update_item_serializes_expression_values(stubbed):
+    tbl, stubber = stubbed
+    stubber.add_response('update_item', {}, {
+        'TableName': 'alerts',
+        'Key': {'chat_id': {'S': 'c1'}, 'symbol': {'S': 'AAA'}},
+        'UpdateExpression': 'SET alert_sent = :val',
+        'ExpressionAttributeValues': {':val': {'BOOL': True}},
+    })
+    tbl.update_item(Key={'chat_id': 'c1', 'symbol': 'AAA'}, UpdateExpression="SET alert_sent = :val",
+                    ExpressionAttributeValues={':val': True})
+
+def test_batch_writer_round_trips_unprocessed(stubbed):
+    """Unprocessed items are handed back to BatchWriter in Python form and resent."""
+    tbl, stubber = stubbed
+    put = {'PutRequest': {'Item': {'chat_id': {'S': 'c1'}, 'symbol': {'S': 'AAA'}}}}
+    stubber.add_response('batch_write_item', {'UnprocessedItems': {'alerts': [put]}}, {'RequestItems': {'alerts': [put]}})
+    stubber.add_response('batch_write_item', {'UnprocessedItems': {}}, {'RequestItems': {'alerts': [put]}})
+    with tbl.batch_writer() as batch:
+        batch.put_item(Item={'chat_id': 'c1', 'symbol': 'AAA'})
@@ -1,23 +1,83 @@
 import json
+from datetime import datetime, timedelta, timezone
 from decimal import Decimal
 import pytest
 
+from boto3.dynamodb.table import BatchWriter
+
 import src.handler as handler
+from src import market_hours
+from src.quote_cache import QuoteCache
+from src.rate_limit import SCHEDULED, UpstreamDeferred, UpstreamScheduler
+from src.memory_table import MemoryTable, evaluate as matches, conditional_check_failed
+from src.sharding import acquire_lease
+from src.storage import ACTIVE_ALERTS_INDEX, due_fields, due_shard
+from src.updates import InProcessQueue, UPDATE_CHAT_ID
 
 # A dummy in-memory table to simulate DynamoDB
 class DummyTable:
-    def __init__(self):
+    def __init__(self, page_size=2):
         self.storage = {}
-    def put_item(self, Item):
+        self.page_size = page_size
+        self.batches = []
+        self.updates = 0
+        self.unprocessed_once = False
+    def put_item(self, Item, ConditionExpression=None):
         key = (Item['chat_id'], Item.get('symbol') or Item.get('index_name'))
+        if ConditionExpression is not None and not matches(ConditionExpression, self.storage.get(key, {})):
+            raise conditional_check_failed('PutItem')
         self.storage[key] = Item
     def get_item(self, Key):
         key = (Key['chat_id'], Key.get('symbol') or Key.get('index_name'))
         return {'Item': self.storage.get(key)}
-    def scan(self, FilterExpression):
-        return {'Items': [v for k,v in self.storage.items() if k[0]==FilterExpression.values[0]]}
-    def delete_item(self, Key):
-        self.storage.pop((Key['chat_id'], Key.get('symbol') or Key.get('index_name')), None)
+    def scan(self, FilterExpression, ExclusiveStartKey=None):
+        return self._page([v for v in self.storage.values() if matches(FilterExpression, v)], ExclusiveStartKey)
+    def query(self, KeyConditionExpression, IndexName=None, ExclusiveStartKey=None):
+        return self._page([v for v in self.storage.values() if matches(KeyConditionExpression, v)], ExclusiveStartKey)
+    def _page(self, items, start_key):
+        """Return one page of items, with LastEvaluatedKey if more remain."""
+        keys = [(it['chat_id'], it.get('symbol') or it.get('index_name')) for it in items]
+        offset = keys.index(start_key) + 1 if start_key else 0
+        page = items[offset:offset + self.page_size]
+        resp = {'Items': page}
+        if offset + self.page_size < len(items):
+            resp['LastEvaluatedKey'] = keys[offset + self.page_size - 1]
+        return resp
+    def delete_item(self, Key, ConditionExpression=None):
+        key = (Key['chat_id'], Key.get('symbol') or Key.get('index_name'))
+        if ConditionExpression is not None and not matches(ConditionExpression, self.storage.get(key, {})):
+            raise conditional_check_failed('DeleteItem')
+        self.storage.pop(key, None)
+    def batch_writer(self, overwrite_by_pkeys=None):
+        # boto3's own BatchWriter, with this table standing in for the client
+        return BatchWriter('alerts', self, overwrite_by_pkeys=overwrite_by_pkeys)
+    def batch_write_item(self, RequestItems):
+        requests = RequestItems['alerts']
+        self.batches.append(len(requests))
+        if self.unprocessed_once:
+            # Simulate throttling: the last request comes back unprocessed
+            self.unprocessed_once = False
+            requests, unprocessed = requests[:-1], requests[-1:]
+        else:
+            unprocessed = []
+        for req in requests:
+            if 'PutRequest' in req:
+                self.put_item(req['PutRequest']['Item'])
+            else:
+                self.delete_item(req['DeleteRequest']['Key'])
+        return {'UnprocessedItems': {'alerts': unprocessed} if unprocessed else {}}
+    def update_item(self, Key, UpdateExpression, ExpressionAttributeValues, ConditionExpression=None):
+        key = (Key['chat_id'], Key.get('symbol') or Key.get('index_name'))
+        if ConditionExpression is not None and not matches(ConditionExpression, self.storage.get(key, {})):
+            raise conditional_check_failed('UpdateItem')
+        self.updates += 1
+        item = self.storage[key]
+        set_part, _, remove_part = UpdateExpression[len("SET "):].partition(" REMOVE ")
+        for assignment in set_part.split(','):
+            attr, placeholder = (p.strip() for p in assignment.split('='))
+            item[attr] = ExpressionAttributeValues[placeholder]
+        for attr in filter(None, (a.strip() for a in remove_part.split(','))):
+            item.pop(attr, None)
 
 @pytest.fixture(autouse=True)
 def mock_dynamodb(monkeypatch):
@@ -26,17 +86,43 @@ def mock_dynamodb(monkeypatch):
     monkeypatch.setattr(handler, "get_table", lambda name: dummy)
     return dummy
 
+@pytest.fixture(autouse=True)
+def sent(monkeypatch):
+    """Capture outgoing Telegram messages instead of hitting the network."""
+    messages = []
+    def fake_send(chat_id, text):
+        messages.append((chat_id, text))
+        return {'ok': True}
+    monkeypatch.setattr(handler, "send_message", fake_send)
+    return messages
+
+@pytest.fixture(autouse=True)
+def around_the_clock():
+    """These tests run on the wall clock, so keep every market open; market
+    hours are covered with a fixed clock below."""
+    market_hours.set_calendar(market_hours.MarketCalendar(enabled=False))
+    yield
+    market_hours.set_calendar(None)
+    market_hours.set_clock(None)
+
+@pytest.fixture(autouse=True)
+def history_dir(monkeypatch, tmp_path):
+    """Keep price history files out of the real HISTORY_DIR."""
+    monkeypatch.setattr("src.history.HISTORY_DIR", str(tmp_path))
+    return tmp_path
+
 def make_event(text, chat_id="user1"):
     """Helper to craft a Lambda event for a given chat text."""
     return {'body': json.dumps({'message': {'chat': {'id': chat_id}, 'text': text}})}
 
-def test_handle_set_and_list(mock_dynamodb):
+def test_handle_set_and_list(mock_dynamodb, monkeypatch):
     """Test that !set stores an alert and !list retrieves it."""
+    monkeypatch.setattr(handler, "get_quote_data", lambda sym, key: {"price": 50.0})
     # Simulate setting an alert
-    resp = handler.handle_set(make_event("!set ABC 5 10"))
+    resp = handler.lambda_handler(make_event("!set ABC 5 10"), None)
     assert resp["statusCode"] == 200
     # Now list alerts
-    resp = handler.handle_list(make_event("!list"))
+    resp = handler.lambda_handler(make_event("!list"), None)
     assert resp["statusCode"] == 200
     # Verify storage state
     assert ("user1","ABC") in mock_dynamodb.storage
@@ -49,20 +135,425 @@ def test_handle_price(monkeypatch):
     # Stub quote data
     monkeypatch.setattr(handler, "get_quote_data",
                         lambda sym, key: {"price":123.45,"open":100.0,"high":110,"low":90,"volume":"1","adj":122})
-    resp = handler.handle_price(make_event("!price XYZ"))
+    resp = handler.lambda_handler(make_event("!price XYZ"), None)
     assert resp["statusCode"] == 200
 
+def test_handle_price_many_symbols(monkeypatch, sent):
+    """!price with several symbols answers in one message from one bulk fetch."""
+    calls = []
+    def fake_quote(sym, key, priority=None):
+        calls.append(sym)
+        return {"price": 2.0} if sym != "NOPE" else None
+    monkeypatch.setattr("src.bot_helpers.get_quote_data", fake_quote)
+    handler.lambda_handler(make_event("!price aapl BTC-USD nope aapl"), None)
+    assert sorted(calls) == ["AAPL", "BTC-USD", "NOPE"]
+    assert len(sent) == 1
+    lines = sent[0][1].splitlines()
+    assert [line.split(":")[0] for line in lines] == ["⚪ • AAPL", "⚪ • BTC-USD", "⚪ • NOPE"]
+    assert lines[2].endswith("price unavailable")
+
+def test_handle_returns_served_from_local_history(monkeypatch, sent):
+    """!returns downloads the series once, then answers from the local store."""
+    urls = []
+    def fake_request(url, key, priority=None, parse=None):
+        urls.append(url)
+        return {'Time Series (Daily)': {
+            '2024-01-01': {'5. adjusted close': '100'},
+            '2024-01-05': {'5. adjusted close': '90'},
+            '2024-01-10': {'5. adjusted close': '110'},
+        }}
+    monkeypatch.setattr("src.bot_helpers.SCHEDULER.request", fake_request)
+    handler.lambda_handler(make_event("!returns aapl 5"), None)
+    handler.lambda_handler(make_event("!returns AAPL 9"), None)
+    assert len(urls) == 1 and "outputsize=compact" in urls[0]
+    assert sent[0][1].splitlines()[0] == "🟢 • AAPL 5d: +22.22%"
+    assert sent[1][1].splitlines()[0] == "🟢 • AAPL 9d: +10.00%"
+    handler.lambda_handler(make_event("!returns AAPL 30"), None)
+    assert "not enough history" in sent[2][1]
+    handler.lambda_handler(make_event("!returns AAPL"), None)
+    assert sent[3][1].startswith("Fam, use: !returns")
+    # Only a range older than the stored bars and the compact series needs the full download
+    handler.lambda_handler(make_event("!returns MSFT 400"), None)
+    assert len(urls) == 2 and "symbol=MSFT" in urls[1] and "outputsize=full" in urls[1]
+    handler.lambda_handler(make_event("!returns ../../etc 5"), None)
+    assert len(urls) == 2 and "stocks only" in sent[5][1]
+
+def test_fast_ack_queues_and_dedupes(mock_dynamodb, monkeypatch, sent):
+    """With a queue configured the webhook only acks; redelivered updates run once."""
+    queue = InProcessQueue(handler.command_worker)
+    monkeypatch.setattr("src.updates._queue", queue)
+    monkeypatch.setattr(handler, "get_quote_data", lambda sym, key: {"price": 1.0})
+    update = {'update_id': 42, 'message': {'chat': {'id': "u1"}, 'text': "!price XYZ"}}
+    for _ in range(2):  # Telegram retrying a slow ack
+        assert handler.lambda_handler({'body': json.dumps(update)}, None) == {'statusCode': 200}
+    assert sent == [] and len(queue.pending) == 1
+    assert (UPDATE_CHAT_ID, "ack#42") in mock_dynamodb.storage
+    assert queue.drain() == 1
+    assert len(sent) == 1
+    # A duplicate delivery to the worker is skipped too
+    handler.command_worker({'update': update}, None)
+    assert len(sent) == 1
+
+def test_command_worker_failure_allows_retry(mock_dynamodb, monkeypatch, sent):
+    """A failed command drops its run marker so the queue's retry runs it."""
+    outcomes = [RuntimeError("upstream down"), {"price": 1.0}]
+    def flaky_quote(sym, key):
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+    monkeypatch.setattr(handler, "get_quote_data", flaky_quote)
+    event = {'update': {'update_id': 7, 'message': {'chat': {'id': "u1"}, 'text': "!price XYZ"}}}
+    with pytest.raises(RuntimeError):
+        handler.command_worker(event, None)
+    handler.command_worker(event, None)
+    assert len(sent) == 1
+
 def test_handle_create_and_index(mock_dynamodb, monkeypatch):
     """Test !createindex then !index computes correct storage and output."""
-    # Stub price fetch
-    monkeypatch.setattr(handler, "get_quote_data",
-                        lambda sym, key: {"price":10.0,"open":5.0,"high":12.0,"low":4.0,"volume":"100","adj":9.0})
+    # Stub price fetch (multi-symbol commands fan out through bot_helpers)
+    calls = []
+    def fake_quote(sym, key, priority=None):
+        calls.append(sym)
+        return {"price":10.0,"open":5.0,"high":12.0,"low":4.0,"volume":"100","adj":9.0}
+    monkeypatch.setattr("src.bot_helpers.get_quote_data", fake_quote)
     # Create index
-    resp = handler.handle_createindex(make_event("!createindex IDX A B"))
+    resp = handler.lambda_handler(make_event("!createindex IDX A B"), None)
     assert resp["statusCode"] == 200
     # Index it
-    resp = handler.handle_index(make_event("!index IDX"))
+    resp = handler.lambda_handler(make_event("!index IDX"), None)
     assert resp["statusCode"] == 200
     # Ensure baseline and created_at are stored
     item = mock_dynamodb.storage[("user1","IDX")]
-    assert "baseline_prices" in item and "created_at" in item
\ No newline at end of file
+    assert "baseline_prices" in item and "created_at" in item
+    # Symbols are fetched once by !createindex; !index reads the stored valuation
+    assert sorted(calls) == ["A", "B"]
+    assert item["valuation"]["total"] == Decimal("20.0")
+
+def test_price_checker_revalues_only_affected_indexes(mock_dynamodb, monkeypatch, sent):
+    """Prices the alert checks fetched rewrite the valuations of indexes holding those symbols, and !index shows it."""
+    prices = {"A": 10.0, "B": 20.0, "C": 30.0}
+    quoted = []
+    def fake_price(sym, key, priority=None):
+        quoted.append(sym)
+        return prices[sym]
+    monkeypatch.setattr("src.bot_helpers.get_quote_data", lambda sym, key, priority=None: {"price": prices[sym]})
+    monkeypatch.setattr("src.bot_helpers.get_price", fake_price)
+    handler.lambda_handler(make_event("!createindex AB A B"), None)
+    handler.lambda_handler(make_event("!createindex BC B C", chat_id="user2"), None)
+    mock_dynamodb.put_item(Item=make_alert("A", chat_id="user3", baseline="10"))
+    mock_dynamodb.put_item(Item=make_alert("C", chat_id="user3", baseline="30"))
+    prices["A"] = 15.0
+    summary = json.loads(handler.price_checker({}, None)["body"])
+    # B has no alert, so it isn't quoted just to revalue; C's price didn't move
+    assert sorted(quoted) == ["A", "C"]
+    assert summary["valuations"] == {"symbols": 2, "indexes": 2, "revalued": 1}
+    assert mock_dynamodb.storage[("user1", "AB")]["valuation"]["total"] == Decimal("35.0")
+    assert mock_dynamodb.storage[("user2", "BC")]["valuation"]["total"] == Decimal("50.0")
+    monkeypatch.setattr("src.bot_helpers.get_quote_data", lambda *a, **k: pytest.fail("!index should not fetch"))
+    sent.clear()
+    handler.lambda_handler(make_event("!index AB"), None)
+    assert "🟢 • A: $15.00 (+50.00%)" in sent[0][1]
+    assert "Avg Symbol Return: 25.00%" in sent[0][1]
+    sent.clear()
+    handler.lambda_handler(make_event("!indexes"), None)
+    assert "• AB: A, B — $35.00 (+25.00%)" in sent[0][1]
+
+def test_index_requotes_valuations_older_than_max_age(mock_dynamodb, monkeypatch, sent):
+    """An index no alert quotes is requoted once its valuation ages out, and the new one is stored."""
+    prices = {"A": 10.0, "B": 20.0}
+    quoted = []
+    def fake_price(sym, key, priority=None):
+        quoted.append(sym)
+        return prices[sym]
+    monkeypatch.setattr("src.bot_helpers.get_quote_data", lambda sym, key, priority=None: {"price": prices[sym]})
+    monkeypatch.setattr("src.bot_helpers.get_price", fake_price)
+    monkeypatch.setattr("src.bot_helpers.QUOTE_CACHE", QuoteCache())
+    handler.lambda_handler(make_event("!createindex IX A B"), None)
+    prices.update(A=50.0, B=60.0)
+    handler.lambda_handler(make_event("!index IX"), None)
+    assert quoted == [] and "💰 Value: $30.00" in sent[-1][1]
+    mock_dynamodb.storage[("user1", "IX")]["valuation"]["as_of"] = "2024-01-02T15:04:00+00:00"
+    sent.clear()
+    handler.lambda_handler(make_event("!indexes"), None)
+    assert sorted(quoted) == ["A", "B"] and "• IX: A, B — $110.00" in sent[0][1]
+    valuation = mock_dynamodb.storage[("user1", "IX")]["valuation"]
+    assert valuation["total"] == Decimal("110.0") and valuation["as_of"] > "2024-01-02T15:04:00+00:00"
+    handler.lambda_handler(make_event("!index IX"), None)
+    assert len(quoted) == 2 and "💰 Value: $110.00" in sent[1][1]
+    assert f"🕒 As of {valuation['as_of'][:10]} {valuation['as_of'][11:16]} UTC" in sent[1][1]
+
+def make_alert(symbol, chat_id="user1", baseline="100", threshold="5", minutes="1", last_check=None):
+    """Helper to build a stored alert item, due now unless last_check is given."""
+    checked = datetime.fromisoformat(last_check) if last_check else datetime.now(timezone.utc) - timedelta(minutes=int(minutes))
+    return {
+        'chat_id': chat_id,
+        'symbol': symbol,
+        'threshold_percent': Decimal(threshold),
+        'interval_minutes': Decimal(minutes),
+        'alert_sent': False,
+        'baseline_price': Decimal(baseline),
+        'last_check': last_check,
+        **due_fields(symbol, minutes, checked),
+    }
+
+class QuoteProvider:
+    """urllib3 stand-in quoting every symbol at one price and recording the symbols asked for."""
+    def __init__(self, price):
+        self.price = price
+        self.symbols = []
+    def request(self, method, url, **kwargs):
+        symbols = url.split("symbol=")[1].split("&")[0]
+        self.symbols.append(symbols)
+        if "REALTIME_BULK_QUOTES" in url:
+            body = {"data": [{"symbol": sym, "close": str(self.price)} for sym in symbols.split(",")]}
+        else:
+            body = {"Global Quote": {"05. price": str(self.price)}}
+        body = json.dumps(body).encode()
+        return type("Response", (), {"status": 200, "data": body, "headers": {}})()
+
+def test_price_checker_fetches_each_symbol_once(mock_dynamodb, monkeypatch, sent):
+    """price_checker should quote each distinct due symbol once and check every alert against it."""
+    for i in range(5):
+        mock_dynamodb.put_item(Item=make_alert("AAA", chat_id=f"c{i}"))
+    mock_dynamodb.put_item(Item=make_alert("BBB", chat_id="c0", baseline="10"))
+    mock_dynamodb.put_item(Item=make_alert("BBB", chat_id="c1", baseline="10", minutes="5"))
+    recent = datetime.now(timezone.utc).isoformat()
+    mock_dynamodb.put_item(Item=make_alert("CCC", chat_id="c0", minutes="60", last_check=recent))
+    provider = QuoteProvider(90.0)
+    monkeypatch.setattr("src.bot_helpers.SCHEDULER", UpstreamScheduler(provider))
+    monkeypatch.setattr("src.bot_helpers.QUOTE_CACHE", QuoteCache())
+    resp = handler.price_checker({}, None)
+    summary = json.loads(resp["body"])
+    assert sorted(provider.symbols) == ["AAA", "BBB"]
+    assert summary["alerts_scanned"] == 7
+    assert summary["alerts_skipped"] == 0  # the due index only returns due alerts
+    assert summary["alerts_due"] == 7
+    assert summary["upstream_calls"] == 2
+    assert summary["upstream_calls_saved"] == 5
+    assert summary["alerts_triggered"] == 5
+    # Triggered and rescheduled alerts are updated in place; the 1-minute
+    # alert stays due without a write
+    assert summary["writes"] == 6
+    assert summary["writes_skipped"] == 1
+    assert mock_dynamodb.updates == 6 and mock_dynamodb.batches == []
+    assert len(sent) == 5
+    assert mock_dynamodb.storage[("c0", "AAA")]["alert_sent"] is True
+    assert "next_due" not in mock_dynamodb.storage[("c0", "AAA")]
+    assert mock_dynamodb.storage[("c0", "BBB")]["alert_sent"] is False
+    assert mock_dynamodb.storage[("c0", "BBB")]["next_due"] <= datetime.now(timezone.utc).timestamp()
+    assert mock_dynamodb.storage[("c1", "BBB")]["next_due"] > datetime.now(timezone.utc).timestamp()
+    assert mock_dynamodb.storage[("c0", "CCC")]["last_check"] == recent
+
+def test_upstream_calls_count_provider_requests(mock_dynamodb, monkeypatch, sent):
+    """A bulk quote is one upstream call, and quotes served from the cache are none."""
+    for sym in ("AAA", "BBB", "CCC"):
+        mock_dynamodb.put_item(Item=make_alert(sym))
+    provider = QuoteProvider(100.0)
+    monkeypatch.setattr("src.bot_helpers.SCHEDULER", UpstreamScheduler(provider))
+    monkeypatch.setattr("src.bot_helpers.QUOTE_CACHE", QuoteCache())
+    monkeypatch.setattr("src.bot_helpers.BULK_QUOTES", True)
+    summary = json.loads(handler.price_checker({}, None)["body"])
+    assert provider.symbols == ["AAA,BBB,CCC"]
+    assert summary["upstream_calls"] == 1 and summary["upstream_calls_saved"] == 2
+    # The 1-minute alerts stay due and are checked again from the cached quotes
+    summary = json.loads(handler.price_checker({}, None)["body"])
+    assert len(provider.symbols) == 1
+    assert summary["alerts_due"] == 3 and summary["upstream_calls"] == 0 and summary["upstream_calls_saved"] == 3
+
+def test_trailing_stop_tracks_peak_and_rearms_after_cooldown(mock_dynamodb, monkeypatch, sent):
+    """!set trail saves its rising peak each run, fires off the peak, then re-arms after the cooldown."""
+    prices = {"AAA": 100.0}
+    monkeypatch.setattr(handler, "get_quote_data", lambda sym, key: {"price": prices[sym]})
+    monkeypatch.setattr("src.bot_helpers.get_price", lambda sym, key, priority=None: prices[sym])
+    handler.lambda_handler(make_event("!set aaa trail 5 1 cooldown=60"), None)
+    assert sent[-1][1] == "💯 Bet! Alert set for AAA: 5.0% trailing stop, checked every 1 min, re-arms after 60 min."
+    item = mock_dynamodb.storage[("user1", "AAA")]
+    item["next_due"] = 0
+    prices["AAA"] = 120.0
+    summary = json.loads(handler.price_checker({}, None)["body"])
+    assert summary["alerts_triggered"] == 0 and summary["writes"] == 1
+    assert mock_dynamodb.storage[("user1", "AAA")]["peak_price"] == Decimal("120.0")
+    prices["AAA"] = 113.0
+    summary = json.loads(handler.price_checker({}, None)["body"])
+    assert summary["alerts_triggered"] == 1
+    assert sent[-1][1] == "🚨 AAA hit its 5.0% trailing stop at $113.00, off a $120.00 high (re-arms in 60 min)"
+    item = mock_dynamodb.storage[("user1", "AAA")]
+    assert item["alert_sent"] is False and item["peak_price"] == Decimal("113.0")
+    assert item["next_due"] > datetime.now(timezone.utc).timestamp() + 59 * 60
+    sent.clear()
+    handler.lambda_handler(make_event("!list"), None)
+    assert "• AAA – 5.0% trailing stop, checked every 1 min, re-arms after 60 min" in sent[0][1]
+
+def test_rule_state_change_leaves_later_symbols_intact(mock_dynamodb, monkeypatch, sent):
+    """A trail peak saved for one symbol must not disturb the symbols evaluated after it."""
+    for sym in ("AAA", "BBB"):
+        mock_dynamodb.put_item(Item=dict(make_alert(sym, chat_id="c0"), rule="trail", peak_price=Decimal("80")))
+        mock_dynamodb.put_item(Item=make_alert(sym, chat_id="c1"))
+    monkeypatch.setattr("src.bot_helpers.get_price", lambda sym, key, priority=None: 90.0)
+    summary = json.loads(handler.price_checker({}, None)["body"])
+    assert summary["alerts_triggered"] == 2
+    assert [chat for chat, _ in sent] == ["c1"]  # coalesced into one message
+    assert sorted(sent[0][1].split("\n")) == [
+        "🚨 AAA has dropped 5.0% from $100.00 to $90.00",
+        "🚨 BBB has dropped 5.0% from $100.00 to $90.00",
+    ]
+    for sym in ("AAA", "BBB"):
+        assert mock_dynamodb.storage[("c0", sym)]["peak_price"] == Decimal("90.0")
+        assert mock_dynamodb.storage[("c1", sym)]["alert_sent"] is True
+
+def test_alerts_deleted_or_reset_during_a_run_stay_as_the_user_left_them(mock_dynamodb, monkeypatch, sent):
+    """The checker's writes are conditional, so they never resurrect or roll back an alert."""
+    mock_dynamodb.put_item(Item=make_alert("AAA", chat_id="c0"))
+    mock_dynamodb.put_item(Item=make_alert("AAA", chat_id="c1"))
+    mock_dynamodb.put_item(Item=make_alert("AAA", chat_id="c2", threshold="20", minutes="5"))
+    def price_while_users_type(sym, key, priority=None):
+        mock_dynamodb.delete_item(Key={"chat_id": "c0", "symbol": "AAA"})
+        mock_dynamodb.put_item(Item=make_alert("AAA", chat_id="c1", baseline="90", threshold="2"))
+        return 90.0
+    monkeypatch.setattr("src.bot_helpers.get_price", price_while_users_type)
+    summary = json.loads(handler.price_checker({}, None)["body"])
+    assert summary["alerts_triggered"] == 2 and summary["writes"] == 1 and summary["writes_stale"] == 2
+    assert ("c0", "AAA") not in mock_dynamodb.storage
+    reset = mock_dynamodb.storage[("c1", "AAA")]
+    assert reset["baseline_price"] == Decimal("90") and reset["alert_sent"] is False and "next_due" in reset
+    assert mock_dynamodb.storage[("c2", "AAA")]["next_due"] > datetime.now(timezone.utc).timestamp()
+
+def test_rise_alert_fires_once(mock_dynamodb, monkeypatch, sent):
+    mock_dynamodb.put_item(Item=dict(make_alert("AAA"), rule="rise"))
+    monkeypatch.setattr("src.bot_helpers.get_price", lambda sym, key, priority=None: 106.0)
+    summary = json.loads(handler.price_checker({}, None)["body"])
+    assert summary["alerts_triggered"] == 1
+    assert sent[0][1] == "🚀 AAA has risen 5.0% from $100.00 to $106.00"
+    assert mock_dynamodb.storage[("user1", "AAA")]["alert_sent"] is True
+
+def test_price_checker_skips_equities_while_market_closed(mock_dynamodb, monkeypatch, sent):
+    """Off-hours runs quote only pairs; equities get one post-close check, then wait for the open."""
+    market_hours.set_calendar(market_hours.MarketCalendar())
+    clock = market_hours.FixedClock(datetime(2024, 1, 5, 20, 30, tzinfo=timezone.utc))  # Fri 3:30pm ET
+    market_hours.set_clock(clock)
+    for symbol in ("AAA", "BTC-USD"):
+        mock_dynamodb.put_item(Item=make_alert(symbol, minutes="60", last_check=(clock.now() - timedelta(hours=1)).isoformat()))
+    calls = []
+    def fake_price(sym, key, priority=None):
+        calls.append(sym)
+        return 100.0
+    monkeypatch.setattr("src.bot_helpers.get_price", fake_price)
+    monkeypatch.setattr("src.bot_helpers.QUOTE_CACHE.get_or_fetch", lambda key, fetch: fetch())
+    handler.price_checker({}, None)
+    assert sorted(calls) == ["AAA", "BTC-USD"]
+    close = int(datetime(2024, 1, 5, 21, 0, tzinfo=timezone.utc).timestamp())
+    assert mock_dynamodb.storage[("user1", "AAA")]["next_due"] == close  # pulled in to the close
+    clock.advance(minutes=31)
+    handler.price_checker({}, None)
+    assert calls[2:] == ["AAA"]
+    monday_open = int(datetime(2024, 1, 8, 14, 30, tzinfo=timezone.utc).timestamp())
+    assert mock_dynamodb.storage[("user1", "AAA")]["next_due"] == monday_open
+    # An alert scheduled before market hours existed, due after the close, is read but not quoted
+    mock_dynamodb.storage[("user1", "AAA")]["next_due"] = close + 3600
+    clock.advance(days=1)
+    summary = json.loads(handler.price_checker({}, None)["body"])
+    assert calls[3:] == ["BTC-USD"]
+    assert summary["symbols_idle"] == 1 and summary["alerts_idle"] == 1
+
+def test_price_checker_defers_when_out_of_budget(mock_dynamodb, monkeypatch):
+    """Deferred or unpriced symbols leave their alerts due instead of writing last_check."""
+    mock_dynamodb.put_item(Item=make_alert("AAA"))
+    mock_dynamodb.put_item(Item=make_alert("BBB"))
+    def fake_price(sym, key, priority=None):
+        if sym == "AAA":
+            raise UpstreamDeferred("no budget")
+        return None
+    monkeypatch.setattr("src.bot_helpers.get_price", fake_price)
+    summary = json.loads(handler.price_checker({}, None)["body"])
+    assert summary["alerts_deferred"] == 1
+    assert summary["alerts_errored"] == 1
+    assert mock_dynamodb.storage[("user1", "AAA")]["last_check"] is None
+    assert mock_dynamodb.storage[("user1", "BBB")]["last_check"] is None
+
+def test_list_and_reset_follow_pagination(mock_dynamodb, sent):
+    """Per-chat reads follow LastEvaluatedKey and !reset deletes in batches of 25."""
+    symbols = [f"S{i}" for i in range(30)]
+    for sym in symbols:
+        mock_dynamodb.put_item(Item=make_alert(sym))
+    mock_dynamodb.put_item(Item=make_alert("A", chat_id="other"))
+    handler.lambda_handler(make_event("!list"), None)
+    assert all(f"• {sym} " in sent[-1][1] for sym in symbols)
+    mock_dynamodb.unprocessed_once = True
+    handler.lambda_handler(make_event("!reset"), None)
+    # 30 deletes go out in chunks of 25; the unprocessed one rides along with the rest
+    assert mock_dynamodb.batches == [25, 6]
+    assert list(mock_dynamodb.storage) == [("other", "A")]
+
+def test_run_price_checker_sharded_locally(monkeypatch, sent):
+    """A local sharded run checks every due alert once and reports per-shard timing."""
+    tbl = MemoryTable(indexes={ACTIVE_ALERTS_INDEX: ('due_shard', 'next_due')})
+    symbols = [f"S{i}" for i in range(20)]
+    for sym in symbols:
+        for chat in ("c1", "c2"):
+            tbl.put_item(Item=make_alert(sym, chat_id=chat, minutes="5"))
+    calls = []
+    def fake_price(sym, key, priority=None):
+        calls.append(sym)
+        return 90.0 if sym == "S0" else 100.0
+    monkeypatch.setattr("src.bot_helpers.get_price", fake_price)
+    summary = handler.run_price_checker(tbl, workers=3, executor="thread")
+    assert sorted(calls) == sorted(symbols)
+    assert summary["alerts_due"] == 40
+    assert summary["alerts_triggered"] == 2 and len(sent) == 2
+    assert summary["messages_sent"] == 2
+    assert summary["writes"] == 40
+    assert len(summary["shards"]) == 3
+    assert all("elapsed_ms" in shard for shard in summary["shards"])
+    # Leases are released and nothing is due any more
+    assert not any(chat == "#lease" for chat, _ in tbl.items)
+    assert handler.run_price_checker(tbl, workers=3, executor="thread")["alerts_due"] == 0
+
+def test_run_price_checker_scan_fallback_checks_each_alert_once(monkeypatch, sent):
+    """With ACTIVE_ALERTS_INDEX empty, sharded workers still split the alerts between them."""
+    monkeypatch.setattr("src.storage.ACTIVE_ALERTS_INDEX", "")
+    tbl = MemoryTable()
+    for i, sym in enumerate(("AAA", "BBB", "CCC", "DDD")):
+        tbl.put_item(Item=make_alert(sym, chat_id=f"c{i}"))
+    monkeypatch.setattr("src.bot_helpers.get_price", lambda sym, key, priority=None: 90.0)
+    summary = handler.run_price_checker(tbl, workers=2)
+    assert summary["alerts_due"] == 4 and summary["alerts_triggered"] == 4
+    assert sorted(chat for chat, _ in sent) == ["c0", "c1", "c2", "c3"]
+
+def test_scan_fallback_gives_legacy_short_interval_alerts_due_fields(monkeypatch, sent):
+    """A held 1-minute alert without due fields is still written back, so the due index can find it."""
+    monkeypatch.setattr("src.storage.ACTIVE_ALERTS_INDEX", "")
+    tbl = MemoryTable()
+    item = make_alert("AAA")
+    del item["due_shard"], item["next_due"]
+    tbl.put_item(Item=item)
+    monkeypatch.setattr("src.bot_helpers.get_price", lambda sym, key, priority=None: 100.0)
+    summary = handler.run_price_checker(tbl)
+    assert summary["alerts_triggered"] == 0 and summary["writes_skipped"] == 0
+    stored = tbl.items[("user1", "AAA")]
+    assert stored["due_shard"] == due_shard("AAA") and stored["next_due"] > 0
+    assert not sent
+
+def test_run_price_checker_skips_alerts_the_stream_fired_mid_run(monkeypatch, sent):
+    """An alert the streaming runner marked sent while the checker was quoting is not announced again."""
+    tbl = MemoryTable(indexes={ACTIVE_ALERTS_INDEX: ('due_shard', 'next_due')})
+    tbl.put_item(Item=make_alert("AAA", chat_id="c0"))
+    tbl.put_item(Item=make_alert("AAA", chat_id="c1"))
+    def fired_by_stream(sym, key, priority=None):
+        tbl.update_item(Key={'chat_id': 'c0', 'symbol': sym}, UpdateExpression="SET alert_sent = :val REMOVE due_shard, next_due",
+                        ExpressionAttributeValues={':val': True})
+        return 90.0
+    monkeypatch.setattr("src.bot_helpers.get_price", fired_by_stream)
+    summary = handler.run_price_checker(tbl)
+    assert summary["alerts_triggered"] == 2 and summary["writes"] == 1 and summary["writes_stale"] == 1
+    assert [chat for chat, _ in sent] == ["c1"]
+
+def test_run_price_checker_skips_leased_partitions(monkeypatch, sent):
+    """Partitions held by an overlapping run are not checked again."""
+    tbl = MemoryTable(indexes={ACTIVE_ALERTS_INDEX: ('due_shard', 'next_due')})
+    tbl.put_item(Item=make_alert("AAA", baseline="200"))
+    acquire_lease(tbl, f"due-shard#{due_shard('AAA')}", "other-run", datetime.now(timezone.utc).timestamp())
+    monkeypatch.setattr("src.bot_helpers.get_price", lambda sym, key, priority=None: 1.0)
+    summary = handler.run_price_checker(tbl, workers=2, executor="thread")
+    assert summary["alerts_due"] == 0
+    assert sent == []
@@ -0,0 +1,109 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from src.history import (
+    RECORD, Bar, PriceHistory, day_timestamp, parse_daily_series,
+    update_history, period_return, index_cagr,
+)
+
+DAY = 86400
+
+def series(start, closes):
+    """A TIME_SERIES_DAILY_ADJUSTED payload with one bar per day from start."""
+    first = datetime.strptime(start, "%Y-%m-%d")
+    return {'Time Series (Daily)': {
+        (first + timedelta(days=i)).strftime("%Y-%m-%d"): {
+            '1. open': str(c - 1), '2. high': str(c + 1), '3. low': str(c - 2),
+            '4. close': str(c), '5. adjusted close': str(c / 2), '6. volume': '1000',
+        }
+        for i, c in enumerate(closes)
+    }}
+
+def test_append_only_keeps_newer_bars_and_range_bisects(tmp_path):
+    h = PriceHistory("AAA", str(tmp_path))
+    bars = parse_daily_series(series("2024-01-01", [10, 11, 12, 13]))
+    assert h.append(bars[:3]) == 3
+    assert h.append(bars) == 1            # only the bar after the last stored one
+    assert len(h) == 4
+    assert (tmp_path / "AAA.bin").stat().st_size == 4 * RECORD.size
+    jan2, jan3 = day_timestamp("2024-01-02"), day_timestamp("2024-01-03")
+    assert [b.close for b in h.range(jan2, jan3)] == [11.0, 12.0]
+    assert h.at_or_before(jan3 + DAY // 2).close == 12.0
+    assert h.at_or_before(day_timestamp("2024-01-01") - 1) is None
+    assert h.last() == Bar(day_timestamp("2024-01-04"), 12.0, 14.0, 11.0, 13.0, 6.5, 1000)
+
+def test_empty_history_reads_as_empty(tmp_path):
+    h = PriceHistory("NONE", str(tmp_path))
+    assert len(h) == 0 and h.last() is None and h.range() == []
+
+def test_parse_skips_rows_without_adjusted_close():
+    payload = {'Time Series (Daily)': {
+        '2024-01-02': {'5. adjusted close': '100'},
+        '2024-01-03': {'4. close': '101'},
+    }}
+    assert parse_daily_series(payload) == [Bar(day_timestamp("2024-01-02"), 100.0, 100.0, 100.0, 100.0, 100.0, 0)]
+
+def test_update_fetches_compact_first_and_full_only_for_older_bars(tmp_path, monkeypatch):
+    monkeypatch.setattr("src.history.HISTORY_REFRESH_SECONDS", 3600)
+    calls = []
+    payloads = {'full': series("2024-01-01", [10, 11, 12]), 'compact': series("2024-01-02", [11, 12, 13])}
+
+    def fetch(outputsize, newer_than=None):
+        calls.append((outputsize, newer_than))
+        return payloads[outputsize]
+    now = day_timestamp("2024-01-04")
+    h = update_history("AAA", fetch, now=now, directory=str(tmp_path))
+    assert calls == [("compact", None)] and len(h) == 3
+    # Refreshed a minute ago (file mtime): served locally, also for ranges compact covers
+    assert h.checked_at() == now
+    update_history("AAA", fetch, now=now + 60, directory=str(tmp_path), since=now - 30 * DAY)
+    assert len(calls) == 1
+    # A range older than both the stored bars and the compact series backfills once
+    h = update_history("AAA", fetch, now=now + 120, directory=str(tmp_path), since=now - 400 * DAY)
+    assert calls[1:] == [("full", None)] and h.complete()
+    assert [b.close for b in h.range()] == [10.0, 11.0, 12.0, 13.0]
+    update_history("AAA", fetch, now=now + 180, directory=str(tmp_path), since=now - 800 * DAY)
+    assert len(calls) == 2
+    # Stale and still recent enough for compact to close the gap
+    update_history("AAA", fetch, now=now + 7200, directory=str(tmp_path))
+    assert calls[2:] == [("compact", day_timestamp("2024-01-04"))]
+    # Stored bars end too long ago for compact to reach them
+    update_history("AAA", fetch, now=now + 200 * DAY, directory=str(tmp_path))
+    assert calls[3:] == [("full", day_timestamp("2024-01-04"))]
+
+def test_append_cuts_a_torn_trailing_record(tmp_path):
+    h = PriceHistory("AAA", str(tmp_path))
+    bars = parse_daily_series(series("2024-01-01", [10, 11]))
+    h.append(bars[:1])
+    with open(h.path, "ab") as fh:
+        fh.write(RECORD.pack(*bars[1])[:10])   # a writer died mid-record
+    assert h.append(bars) == 1
+    assert (tmp_path / "AAA.bin").stat().st_size == 2 * RECORD.size
+    assert [b.close for b in h.range()] == [10.0, 11.0]
+
+def test_symbols_that_are_not_tickers_never_name_a_file(tmp_path):
+    for symbol in ("../../X", "A/B", "", ".HIDDEN", "aapl"):
+        with pytest.raises(ValueError):
+            PriceHistory(symbol, str(tmp_path))
+    assert PriceHistory("BRK.B", str(tmp_path)).path == str(tmp_path / "BRK.B.bin")
+    assert index_cagr(["../../X"], "2024-01-01T00:00:00+00:00", directory=str(tmp_path)) is None
+    assert list(tmp_path.iterdir()) == []
+
+def test_period_return_uses_adjusted_closes(tmp_path):
+    h = PriceHistory("AAA", str(tmp_path))
+    h.append(parse_daily_series(series("2024-01-01", [10, 12, 9, 15])))
+    r = period_return(h, 2)
+    assert r['from'].close == 12.0 and r['to'].close == 15.0
+    assert r['return'] == pytest.approx(25.0)
+    assert (r['high'], r['low']) == (16.0, 7.0)
+    assert period_return(h, 30) is None
+
+def test_index_cagr_needs_history_back_to_creation(tmp_path):
+    for sym, closes in (("A", [10, 20]), ("B", [30, 20])):
+        PriceHistory(sym, str(tmp_path)).append(parse_daily_series(series("2024-01-01", closes)))
+    created = datetime(2024, 1, 1, 15, tzinfo=timezone.utc).isoformat()
+    now = datetime(2024, 1, 1, 20, tzinfo=timezone.utc)
+    assert index_cagr(["A", "B"], created, now=now, directory=str(tmp_path)) == pytest.approx(0.0)
+    assert index_cagr(["A", "C"], created, now=now, directory=str(tmp_path)) is None
+    assert index_cagr(["A"], None, directory=str(tmp_path)) is None
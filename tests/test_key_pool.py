@@ -0,0 +1,103 @@
+import threading
+from collections import Counter
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+import urllib3
+
+from src.key_pool import KeyPool, LocalQuotaStore, TableQuotaStore, key_id, route_of, with_key
+from src.memory_table import MemoryTable
+from src.rate_limit import SCHEDULED, UpstreamDeferred, UpstreamScheduler, UpstreamThrottled
+
+KEYS = ["KEY1", "KEY2", "KEY3"]
+
+@pytest.fixture
+def provider(serve, clock):
+    """Local Alpha Vantage stand-in allowing `limit` calls per key and minute; keys in `dead` are always throttled."""
+    served, throttled = Counter(), Counter()
+    def handle(request):
+        params = {k: v[0] for k, v in parse_qs(urlsplit(request.path).query).items()}
+        key, window = params["apikey"], int(clock() // 60)
+        with server.lock:
+            over = key in server.dead or served[key, window] >= server.limit
+            (throttled if over else served)[key, window] += 1
+        body = {"Note": "API call frequency exceeded"} if over else {"Global Quote": {"01. symbol": params["symbol"], "05. price": "1.0"}}
+        request.reply_json(200, body)
+    server = serve(handle)
+    server.lock, server.limit, server.dead = threading.Lock(), 5, set()
+    server.served, server.throttled = served, throttled
+    server.url = f"{server.base}?function=GLOBAL_QUOTE&symbol={{}}&apikey=KEY1"
+    return server
+
+def make_scheduler(clock, store=None, keys=KEYS, rpm=5, lease=1):
+    pool = KeyPool(keys, requests_per_minute=rpm, store=store or LocalQuotaStore(), lease=lease, clock=clock)
+    return UpstreamScheduler(urllib3.PoolManager(), requests_per_minute=rpm, clock=clock, sleep=clock.sleep,
+                             rand=lambda: 1.0, timeout=2, keys=pool)
+
+def test_route_and_key_rewriting():
+    assert route_of("https://h/q?function=GLOBAL_QUOTE&symbol=AAPL&apikey=K") == "AAPL"
+    assert route_of("https://h/q?function=CURRENCY_EXCHANGE_RATE&from_currency=BTC&to_currency=USD") == "BTC-USD"
+    assert with_key("https://h/q?symbol=A,B&apikey=K1&x=1", "K2") == "https://h/q?symbol=A,B&apikey=K2&x=1"
+    assert with_key("https://h/q?symbol=A", "K2") == "https://h/q?symbol=A&apikey=K2"
+
+def test_symbols_stick_to_keys_and_spread_evenly():
+    pool = KeyPool(KEYS, requests_per_minute=5)
+    symbols = [f"S{i}" for i in range(600)]
+    first = {sym: pool.candidates(sym)[0] for sym in symbols}
+    assert all(150 <= n <= 250 for n in Counter(first.values()).values())
+    smaller = KeyPool(KEYS[:2], requests_per_minute=5)
+    moved = [sym for sym in symbols if smaller.candidates(sym)[0] != first[sym]]
+    assert moved and all(first[sym] == "KEY3" for sym in moved)  # only the removed key's symbols move
+
+def test_throughput_scales_with_keys(provider, clock):
+    scheduler = make_scheduler(clock)
+    for i in range(15):
+        assert scheduler.request(provider.url.format(f"S{i}"), "KEY1", priority=SCHEDULED)["Global Quote"]
+    with pytest.raises(UpstreamDeferred):
+        scheduler.request(provider.url.format("S99"), "KEY1", priority=SCHEDULED)
+    assert sum(provider.served.values()) == 15 and not provider.throttled
+    assert {key for key, _ in provider.served} == set(KEYS)
+
+def test_invocations_share_quota_through_the_table(provider, clock):
+    """Two pools leasing from one table never push a key past its limit at the provider."""
+    table = MemoryTable()
+    first = make_scheduler(clock, TableQuotaStore(lambda: table), rpm=5, lease=2)
+    second = make_scheduler(clock, TableQuotaStore(lambda: table), rpm=5, lease=2)
+    served = 0
+    for i in range(30):
+        try:
+            (first if i % 2 else second).request(provider.url.format(f"S{i}"), "KEY1")
+            served += 1
+        except UpstreamThrottled:
+            pass  # the next window is further off than max_wait
+    assert not provider.throttled
+    assert 15 - 2 * len(KEYS) <= served <= 15              # at most one unused lease per pool and key lapses
+    for key in KEYS:
+        stored = table.get_item(Key={"chat_id": "#quota", "symbol": f"{key_id(key)}#0"})["Item"]
+        assert stored["request_count"] <= 5 and stored["expires_at"] == 120
+    clock.now = 60
+    assert first.request(provider.url.format("S99"), "KEY1")["Global Quote"]
+
+def test_throttled_key_is_ejected_for_everyone(provider, clock):
+    table = MemoryTable()
+    scheduler = make_scheduler(clock, TableQuotaStore(lambda: table))
+    symbol = next(f"S{i}" for i in range(100) if scheduler.keys.candidates(f"S{i}")[0] == "KEY1")
+    provider.dead.add("KEY1")
+    assert scheduler.request(provider.url.format(symbol), "KEY1")["Global Quote"]
+    assert clock.sleeps == []                              # moved to the next key, no backoff
+    assert provider.throttled[("KEY1", 0)] == 1
+    assert "KEY1" not in scheduler.keys.candidates(symbol)
+    other = make_scheduler(clock, TableQuotaStore(lambda: table))
+    other.request(provider.url.format(symbol), "KEY1")     # the store already marks KEY1 used up
+    assert provider.throttled[("KEY1", 0)] == 1
+    provider.dead.clear()
+    clock.now = 61
+    scheduler.request(provider.url.format(symbol), "KEY1")
+    assert provider.served[("KEY1", 1)] == 1               # back in rotation after the ejection
+
+def test_all_keys_throttled_gives_up_without_backoff(provider, clock):
+    provider.dead.update(KEYS)
+    scheduler = make_scheduler(clock)
+    with pytest.raises(UpstreamThrottled):
+        scheduler.request(provider.url.format("A"), "KEY1")
+    assert sum(provider.throttled.values()) == 3 and clock.sleeps == []
@@ -0,0 +1,60 @@
+from datetime import date, datetime, timedelta, timezone
+
+import pytest
+
+from src import market_hours
+from src.market_hours import MarketCalendar, FixedClock
+
+def ts(*args):
+    return int(datetime(*args, tzinfo=timezone.utc).timestamp())
+
+CAL = MarketCalendar()
+
+def test_sessions_follow_new_york_time_and_holidays():
+    assert CAL.session(date(2024, 1, 5)) == (ts(2024, 1, 5, 14, 30), ts(2024, 1, 5, 21, 0))    # EST
+    assert CAL.session(date(2024, 7, 5)) == (ts(2024, 7, 5, 13, 30), ts(2024, 7, 5, 20, 0))    # EDT
+    assert CAL.session(date(2024, 3, 11))[0] == ts(2024, 3, 11, 13, 30)                        # day after DST starts
+    assert CAL.session(date(2024, 11, 29))[1] == ts(2024, 11, 29, 18, 0)                       # early close
+    assert CAL.session(date(2024, 7, 4)) is None
+    assert CAL.session(date(2024, 1, 6)) is None
+
+def test_pairs_and_unknown_exchanges_never_close():
+    saturday = ts(2024, 1, 6, 12, 0)
+    assert not CAL.is_open("AAPL", saturday)
+    assert CAL.is_open("BTC-USD", saturday) and CAL.is_open("TSCO.LON", saturday)
+    assert MarketCalendar(enabled=False).is_open("AAPL", saturday)
+
+@pytest.mark.parametrize("now, minutes, expected", [
+    (ts(2024, 1, 5, 15, 0), 30, ts(2024, 1, 5, 15, 30)),     # in session
+    (ts(2024, 1, 5, 20, 45), 30, ts(2024, 1, 5, 21, 0)),     # pulled in to the close
+    (ts(2024, 1, 5, 21, 0), 1, ts(2024, 1, 8, 14, 30)),      # after the close: Monday's open
+    (ts(2024, 1, 6, 12, 0), 5, ts(2024, 1, 8, 14, 30)),      # weekend
+    (ts(2024, 1, 12, 21, 0), 1, ts(2024, 1, 16, 14, 30)),    # MLK day Monday
+    (ts(2024, 1, 8, 12, 0), 1, ts(2024, 1, 8, 14, 30)),      # pre-market
+])
+def test_next_check_plans_around_the_session(now, minutes, expected):
+    assert CAL.next_check("AAPL", minutes, now) == expected
+
+def test_next_check_for_pairs_is_one_interval():
+    assert CAL.next_check("ETH-USD", 5, ts(2024, 1, 6, 12, 0)) == ts(2024, 1, 6, 12, 5)
+
+def test_moved_since_last_check():
+    friday_close = ts(2024, 1, 5, 21, 0)
+    assert CAL.moved_since("AAPL", ts(2024, 1, 5, 20, 0), ts(2024, 1, 6, 9, 0))
+    assert not CAL.moved_since("AAPL", friday_close + 60, ts(2024, 1, 7, 9, 0))
+    assert CAL.moved_since("AAPL", friday_close + 60, ts(2024, 1, 8, 14, 31))
+    assert CAL.moved_since("BTC-USD", friday_close + 60, ts(2024, 1, 7, 9, 0))
+
+def test_clock_and_calendar_are_swappable(monkeypatch):
+    clock = FixedClock(datetime(2024, 1, 5, 20, 0, tzinfo=timezone.utc))
+    market_hours.set_clock(clock)
+    monkeypatch.setattr(market_hours, "MARKET_EXTRA_HOLIDAYS", "2024-01-08")
+    market_hours.set_calendar(None)
+    try:
+        assert market_hours.now() == clock.now()
+        assert clock.advance(hours=1) == market_hours.now() == datetime(2024, 1, 5, 21, 0, tzinfo=timezone.utc)
+        assert market_hours.get_calendar().next_open(ts(2024, 1, 6, 0, 0)) == ts(2024, 1, 9, 14, 30)
+    finally:
+        market_hours.set_clock(None)
+        market_hours.set_calendar(None)
+    assert market_hours.now() - datetime.now(timezone.utc) < timedelta(seconds=1)
@@ -0,0 +1,49 @@
+import pytest
+from boto3.dynamodb.conditions import Attr, Key
+from botocore.exceptions import ClientError
+
+from src.memory_table import MemoryTable
+from src.storage import iter_pages
+
+def test_sparse_index_query_is_sorted_and_paginated():
+    """Index queries skip items without index keys and page in sort-key order."""
+    tbl = MemoryTable(indexes={'due': ('shard', 'next_due')}, page_size=2)
+    for i in range(5):
+        tbl.put_item(Item={'chat_id': 'c', 'symbol': f"S{i}", 'shard': 0, 'next_due': 10 - i})
+    tbl.put_item(Item={'chat_id': 'c', 'symbol': 'OFF'})
+    resp = tbl.query(KeyConditionExpression=Key('shard').eq(0) & Key('next_due').lte(9), IndexName='due')
+    assert [it['symbol'] for it in resp['Items']] == ["S4", "S3"]
+    assert 'LastEvaluatedKey' in resp
+    items = iter_pages(tbl.query, KeyConditionExpression=Key('shard').eq(0) & Key('next_due').lte(9), IndexName='due')
+    assert [it['symbol'] for it in items] == ["S4", "S3", "S2", "S1"]
+
+def test_conditional_put_raises_client_error():
+    """A failed ConditionExpression raises the same error code as DynamoDB."""
+    tbl = MemoryTable()
+    tbl.put_item(Item={'chat_id': 'c', 'symbol': 'A'}, ConditionExpression=Attr('chat_id').not_exists())
+    with pytest.raises(ClientError) as err:
+        tbl.put_item(Item={'chat_id': 'c', 'symbol': 'A'}, ConditionExpression=Attr('chat_id').not_exists())
+    assert err.value.response['Error']['Code'] == 'ConditionalCheckFailedException'
+
+def test_batch_writer_and_update_item():
+    """Batched puts/deletes and SET/REMOVE updates land in storage."""
+    tbl = MemoryTable()
+    with tbl.batch_writer() as batch:
+        for i in range(30):
+            batch.put_item(Item={'chat_id': 'c', 'symbol': f"S{i}", 'n': i})
+        batch.delete_item(Key={'chat_id': 'c', 'symbol': 'S0'})
+    assert len(tbl.items) == 29
+    tbl.update_item(Key={'chat_id': 'c', 'symbol': 'S1'}, UpdateExpression="SET n = :n REMOVE x", ExpressionAttributeValues={':n': 7})
+    assert tbl.get_item(Key={'chat_id': 'c', 'symbol': 'S1'})['Item']['n'] == 7
+    tbl.update_item(Key={'chat_id': 'c', 'symbol': 'S1'}, UpdateExpression="ADD n :two, m :two SET x = :x",
+                    ExpressionAttributeValues={':two': 2, ':x': 'y'})
+    assert tbl.get_item(Key={'chat_id': 'c', 'symbol': 'S1'})['Item'] == {'chat_id': 'c', 'symbol': 'S1', 'n': 9, 'm': 2, 'x': 'y'}
+
+def test_capacity_accounting():
+    """Reads and writes are charged approximate capacity units, including GSI writes."""
+    tbl = MemoryTable(indexes={'due': ('shard', 'next_due')})
+    tbl.put_item(Item={'chat_id': 'c', 'symbol': 'A'})
+    tbl.put_item(Item={'chat_id': 'c', 'symbol': 'B', 'shard': 0, 'next_due': 1})
+    assert tbl.consumed['write'] == 3
+    tbl.query(KeyConditionExpression=Key('chat_id').eq('c'))
+    assert tbl.consumed['read'] == 0.5
@@ -0,0 +1,73 @@
+import json
+import time
+
+import pytest
+
+from src import metrics
+
+@pytest.fixture(autouse=True)
+def fresh_recorder():
+    metrics.RECORDER.reset()
+    yield
+    metrics.RECORDER.reset()
+
+def test_timed_and_instrument_accumulate():
+    """Timers sum wall time and calls; failures are counted as errors too."""
+    @metrics.instrument('work')
+    def work(fail=False):
+        if fail:
+            raise ValueError("boom")
+        return 1
+    work()
+    with pytest.raises(ValueError):
+        work(fail=True)
+    metrics.count('cache.hits', 3)
+    values = metrics.RECORDER.snapshot()
+    assert values['work.calls'] == 2
+    assert values['work.errors'] == 1
+    assert values['work.ms'] >= 0
+    assert values['cache.hits'] == 3
+
+def test_emf_record_shape():
+    """Metric units follow the name and dimension values sit at the top level."""
+    record = metrics.emf_record({'Function': 'webhook', 'Command': '!price'},
+                                {'Duration.ms': 12.5, 'cache.hits': 1}, timestamp_ms=1)
+    directive = record['_aws']['CloudWatchMetrics'][0]
+    assert directive['Dimensions'] == [['Command', 'Function']]
+    assert {'Name': 'Duration.ms', 'Unit': 'Milliseconds'} in directive['Metrics']
+    assert {'Name': 'cache.hits', 'Unit': 'Count'} in directive['Metrics']
+    assert record['Command'] == '!price' and record['Duration.ms'] == 12.5
+
+def test_invocation_emits_one_line(capsys):
+    """Everything recorded during an invocation goes out in a single EMF line."""
+    with metrics.invocation(Function='webhook', Command='!list'):
+        with metrics.timed('ddb.query'):
+            pass
+        metrics.count('cache.misses')
+    lines = capsys.readouterr().out.strip().splitlines()
+    assert len(lines) == 1
+    record = json.loads(lines[0])
+    assert record['Command'] == '!list'
+    assert record['ddb.query.calls'] == 1
+    assert record['cache.misses'] == 1
+    assert 'Duration.ms' in record
+
+def test_invocation_counts_errors(capsys):
+    with pytest.raises(RuntimeError):
+        with metrics.invocation(Function='webhook', Command='!set'):
+            raise RuntimeError("down")
+    assert json.loads(capsys.readouterr().out)['Errors'] == 1
+
+def test_slow_invocation_reports_hot_functions(monkeypatch, capsys):
+    """With profiling on, a slow invocation dumps its hottest functions."""
+    monkeypatch.setattr(metrics, 'PROFILE_SLOW_MS', 20)
+    monkeypatch.setattr(metrics, 'PROFILE_INTERVAL_MS', 1)
+    def spin():
+        deadline = time.perf_counter() + 0.1
+        while time.perf_counter() < deadline:
+            pass
+    with metrics.invocation(Function='price_checker'):
+        spin()
+    slow = json.loads(capsys.readouterr().out.splitlines()[0])['slow_invocation']
+    assert slow['samples'] > 0
+    assert any(entry['function'].endswith(':spin') for entry in slow['hot_functions'])
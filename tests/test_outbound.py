@@ -0,0 +1,47 @@
+import threading
+
+from src.outbound import OutboundQueue, coalesce
+
+def test_coalesce_respects_length_limit():
+    """Texts are joined with newlines without exceeding the limit."""
+    assert coalesce(["a", "b", "c"]) == ["a\nb\nc"]
+    assert coalesce(["aaaa", "bbbb", "cc"], limit=9) == ["aaaa\nbbbb", "cc"]
+
+def test_flush_coalesces_per_chat_and_counts(clock):
+    """Several alerts for one chat go out as one message."""
+    sent = []
+    lock = threading.Lock()
+    def send(chat_id, text):
+        with lock:
+            sent.append((chat_id, text))
+        return {'ok': True}
+    queue = OutboundQueue(send, global_rate=30, chat_rate=1, clock=clock, sleep=clock.sleep)
+    for text in ["one", "two", "three"]:
+        queue.enqueue("c1", text)
+    queue.enqueue("c2", "solo")
+    metrics = queue.flush()
+    assert sorted(sent) == [("c1", "one\ntwo\nthree"), ("c2", "solo")]
+    assert metrics == {'enqueued': 4, 'coalesced': 2, 'sent': 2, 'failed': 0, 'retried': 0}
+
+def test_retry_after_is_honored(clock):
+    """A 429 reply is retried after Telegram's retry_after."""
+    replies = [{'ok': False, 'error_code': 429, 'parameters': {'retry_after': 3}}, {'ok': True}]
+    queue = OutboundQueue(lambda chat_id, text: replies.pop(0), clock=clock, sleep=clock.sleep)
+    queue.enqueue("c1", "hi")
+    metrics = queue.flush()
+    assert metrics['sent'] == 1 and metrics['retried'] == 1
+    assert 3.0 in clock.sleeps
+
+def test_non_retryable_failure_is_counted(clock):
+    """Other errors are not retried and count as failed."""
+    queue = OutboundQueue(lambda chat_id, text: {'ok': False, 'error_code': 403}, clock=clock, sleep=clock.sleep)
+    queue.enqueue("c1", "hi")
+    assert queue.flush()['failed'] == 1
+
+def test_per_chat_rate_limit_spaces_sends(clock):
+    """Messages to one chat that don't fit in one send wait on the chat bucket."""
+    queue = OutboundQueue(lambda chat_id, text: {'ok': True}, chat_rate=1, clock=clock, sleep=clock.sleep)
+    queue.enqueue("c1", "x" * 4000)
+    queue.enqueue("c1", "y" * 4000)
+    assert queue.flush()['sent'] == 2
+    assert sum(clock.sleeps) >= 1.0
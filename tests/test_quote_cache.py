@@ -0,0 +1,53 @@
+from src.quote_cache import QuoteCache, MemoryBackend
+
+def counting_fetch(values):
+    """Return a fetch callable that yields successive values and records calls."""
+    calls = []
+    def fetch():
+        calls.append(1)
+        return values[len(calls) - 1]
+    fetch.calls = calls
+    return fetch
+
+def test_hit_and_miss_counts(clock):
+    """A fresh entry is a hit; an expired one is a miss and is refetched."""
+    cache = QuoteCache(ttl=60, clock=clock)
+    fetch = counting_fetch([1.0, 2.0])
+    assert cache.get_or_fetch("price:A", fetch) == 1.0
+    assert cache.get_or_fetch("price:A", fetch) == 1.0
+    clock.now += 61
+    assert cache.get_or_fetch("price:A", fetch) == 2.0
+    assert len(fetch.calls) == 2
+    assert cache.stats() == {'hits': 1, 'stale_hits': 0, 'misses': 2, 'size': 1}
+
+def test_none_is_not_cached(clock):
+    """Failed lookups are retried on the next call."""
+    cache = QuoteCache(ttl=60, clock=clock)
+    fetch = counting_fetch([None, 3.0])
+    assert cache.get_or_fetch("price:A", fetch) is None
+    assert cache.get_or_fetch("price:A", fetch) == 3.0
+
+def test_lru_eviction():
+    """The least recently used key is evicted once maxsize is exceeded."""
+    backend = MemoryBackend(maxsize=2)
+    backend.set("a", (1, 0))
+    backend.set("b", (2, 0))
+    backend.get("a")
+    backend.set("c", (3, 0))
+    assert backend.get("b") is None
+    assert backend.get("a") == (1, 0)
+    assert len(backend) == 2
+
+def test_stale_while_revalidate(clock):
+    """A stale entry is served immediately and refreshed in the background."""
+    cache = QuoteCache(ttl=60, stale_ttl=120, clock=clock)
+    fetch = counting_fetch([1.0, 2.0])
+    cache.get_or_fetch("price:A", fetch)
+    clock.now += 90
+    assert cache.get_or_fetch("price:A", fetch) == 1.0
+    for thread in list(cache._refreshing.values()):
+        thread.join()
+    assert cache.peek("price:A") == 2.0
+    assert cache.stale_hits == 1
+    clock.now += 500
+    assert cache.peek("price:A") is None
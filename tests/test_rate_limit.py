@@ -0,0 +1,85 @@
+import pytest
+import urllib3
+
+from src.rate_limit import (
+    INTERACTIVE,
+    SCHEDULED,
+    TokenBucket,
+    UpstreamDeferred,
+    UpstreamScheduler,
+    UpstreamThrottled,
+    is_throttled,
+)
+
+@pytest.fixture
+def fake_provider(serve):
+    """Local HTTP server replaying scripted (status, body) responses in order."""
+    script = []
+    hits = []
+    def handle(request):
+        hits.append(request.path)
+        status, body = script.pop(0) if script else (200, {"Global Quote": {"05. price": "1.0"}})
+        request.reply_json(status, body)
+    server = serve(handle)
+    server.script, server.hits = script, hits
+    server.url = f"{server.base}?function=GLOBAL_QUOTE&symbol=A&apikey=KEY1"
+    return server
+
+def make_scheduler(clock, **kwargs):
+    kwargs.setdefault("requests_per_minute", 60)
+    return UpstreamScheduler(urllib3.PoolManager(), clock=clock, sleep=clock.sleep,
+                             rand=lambda: 1.0, timeout=2, **kwargs)
+
+def test_token_bucket_refills_over_time(clock):
+    """Tokens are consumed and refill at the configured rate."""
+    bucket = TokenBucket(rate=1.0, capacity=2, clock=clock)
+    assert bucket.try_take() and bucket.try_take()
+    assert not bucket.try_take()
+    assert bucket.wait_time() == pytest.approx(1.0)
+    clock.now += 1.0
+    assert bucket.try_take()
+
+@pytest.mark.parametrize("status,data,expected", [
+    (429, None, True),
+    (200, {"Note": "Thank you for using Alpha Vantage! Our standard API call frequency is 5 calls per minute"}, True),
+    (200, {"Information": "You have reached the rate limit for your API key."}, True),
+    (200, {"Information": "This is a premium endpoint."}, False),
+    (200, {"Global Quote": {}}, False),
+])
+def test_is_throttled(status, data, expected):
+    assert is_throttled(status, data) is expected
+
+def test_backoff_on_throttle_then_success(fake_provider, clock):
+    """Throttle responses are retried with growing backoff until data arrives."""
+    fake_provider.script.extend([(429, {}), (200, {"Note": "call frequency"}), (200, {"Global Quote": {"05. price": "9.5"}})])
+    scheduler = make_scheduler(clock, base_delay=1.0)
+    data = scheduler.request(fake_provider.url, "KEY1")
+    assert data == {"Global Quote": {"05. price": "9.5"}}
+    assert len(fake_provider.hits) == 3
+    assert clock.sleeps == [1.0, 2.0]
+    assert scheduler.stats()["throttled"] == 2
+    assert scheduler.stats()["requests"] == 3
+
+def test_persistent_throttle_raises_or_defers(fake_provider, clock):
+    """Interactive calls surface the throttle; scheduled calls are deferred."""
+    fake_provider.script.extend([(429, {})] * 4)
+    scheduler = make_scheduler(clock, max_retries=1)
+    with pytest.raises(UpstreamThrottled):
+        scheduler.request(fake_provider.url, "KEY1", INTERACTIVE)
+    with pytest.raises(UpstreamDeferred):
+        scheduler.request(fake_provider.url, "KEY1", SCHEDULED)
+
+def test_scheduled_lane_leaves_reserve_for_interactive(fake_provider, clock):
+    """Scheduled work is deferred once only the interactive reserve remains."""
+    scheduler = make_scheduler(clock, burst=3, interactive_reserve=1)
+    scheduler.request(fake_provider.url, "KEY1", SCHEDULED)
+    scheduler.request(fake_provider.url, "KEY1", SCHEDULED)
+    with pytest.raises(UpstreamDeferred):
+        scheduler.request(fake_provider.url, "KEY1", SCHEDULED)
+    # Interactive requests still get the reserved token, then wait for refill
+    scheduler.request(fake_provider.url, "KEY1", INTERACTIVE)
+    scheduler.request(fake_provider.url, "KEY1", INTERACTIVE)
+    assert clock.sleeps == [pytest.approx(1.0)]
+    # Budgets are tracked per API key
+    scheduler.request(fake_provider.url.replace("KEY1", "KEY2"), "KEY2", SCHEDULED)
+    assert len(fake_provider.hits) == 5
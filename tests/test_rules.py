@@ -0,0 +1,35 @@
+from decimal import Decimal
+
+import pytest
+
+from src.rules import parse_rule, describe, is_one_shot_drop, initial_state
+
+def test_parse_rule_keeps_legacy_drop_items_unchanged():
+    assert parse_rule(["5", "60"]) == {'threshold_percent': Decimal("5.0"), 'interval_minutes': Decimal("60")}
+    assert parse_rule(["drop", "5", "60"]) == parse_rule(["5", "60"])
+
+def test_parse_rule_kinds_and_options():
+    fields = parse_rule(["MOVE", "3", "5", "window=30", "cooldown=120"])
+    assert fields['rule'] == "move"
+    assert fields['window_minutes'] == Decimal("30") and fields['cooldown_minutes'] == Decimal("120")
+    assert parse_rule(["move", "3", "5"])['window_minutes'] == Decimal("60")
+    assert parse_rule(["trail", "8", "15", "cooldown=0"]) == {
+        'threshold_percent': Decimal("8.0"), 'interval_minutes': Decimal("15"), 'rule': "trail",
+    }
+
+@pytest.mark.parametrize("args", [
+    ["5"], ["rise", "x", "5"], ["rise", "-2", "5"], ["5", "60", "window=10"], ["5", "60", "every=3"],
+])
+def test_parse_rule_rejects_bad_input(args):
+    with pytest.raises(ValueError):
+        parse_rule(args)
+
+def test_describe_and_stream_eligibility():
+    item = {'threshold_percent': Decimal("5.0"), 'interval_minutes': Decimal("60")}
+    assert describe(item) == "5.0% drop in 60 min"
+    assert is_one_shot_drop(item)
+    item.update(rule="move", window_minutes=Decimal("30"), cooldown_minutes=Decimal("120"))
+    assert describe(item) == "5.0% move within 30 min, checked every 60 min, re-arms after 120 min"
+    assert not is_one_shot_drop(item)
+    assert not is_one_shot_drop({'cooldown_minutes': Decimal("5")})
+    assert initial_state("trail", 10.5, 0) == {'peak_price': Decimal("10.5")}
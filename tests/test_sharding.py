@@ -0,0 +1,33 @@
+from src import sharding
+from src.memory_table import MemoryTable
+
+def test_plan_shards_covers_every_partition_once():
+    """Each due partition is owned by exactly one worker."""
+    plan = sharding.plan_shards(3, due_shards=8)
+    assert plan == [[0, 3, 6], [1, 4, 7], [2, 5]]
+    assert sharding.plan_shards(1, due_shards=4) == [[0, 1, 2, 3]]
+    # More workers than partitions leaves the extras idle
+    assert sharding.plan_shards(5, due_shards=2) == [[0], [1]]
+    # A misconfigured worker count falls back to one worker
+    assert sharding.plan_shards(0, due_shards=3) == [[0, 1, 2]]
+    assert sharding.plan_shards(-2, due_shards=3) == [[0, 1, 2]]
+
+def test_lease_excludes_other_owners_until_expiry():
+    """A held lease blocks other runs, is re-entrant, and expires."""
+    tbl = MemoryTable()
+    assert sharding.acquire_lease(tbl, "due-shard#0", "run-a", 1000, seconds=60)
+    assert not sharding.acquire_lease(tbl, "due-shard#0", "run-b", 1030, seconds=60)
+    assert sharding.acquire_lease(tbl, "due-shard#0", "run-a", 1030, seconds=60)
+    assert sharding.acquire_lease(tbl, "due-shard#0", "run-b", 1100, seconds=60)
+
+def test_release_only_drops_own_lease():
+    """Releasing a lease another run has taken over leaves it in place."""
+    tbl = MemoryTable()
+    sharding.acquire_lease(tbl, "due-shard#1", "run-b", 1000, seconds=60)
+    sharding.release_lease(tbl, "due-shard#1", "run-a")
+    assert tbl.get_item(Key={'chat_id': sharding.LEASE_CHAT_ID, 'symbol': "due-shard#1"})['Item']['owner'] == "run-b"
+    sharding.release_lease(tbl, "due-shard#1", "run-b")
+    assert tbl.get_item(Key={'chat_id': sharding.LEASE_CHAT_ID, 'symbol': "due-shard#1"}) == {}
+
+def test_map_shards_preserves_order():
+    assert sharding.map_shards(abs, [-3, -1, -2], executor="thread") == [3, 1, 2]
@@ -0,0 +1,105 @@
+from datetime import datetime, timezone
+from decimal import Decimal
+
+from src import storage
+from src.memory_table import MemoryTable
+
+class PagedOperation:
+    """Fake Query/Scan returning pre-split pages and recording call kwargs."""
+    def __init__(self, pages):
+        self.pages = pages
+        self.calls = []
+    def __call__(self, **kwargs):
+        self.calls.append(kwargs)
+        index = len(self.calls) - 1
+        resp = {'Items': self.pages[index]}
+        if index + 1 < len(self.pages):
+            resp['LastEvaluatedKey'] = {'page': index}
+        return resp
+
+def test_iter_pages_follows_last_evaluated_key():
+    """All pages are read, each continuing from the previous LastEvaluatedKey."""
+    op = PagedOperation([[1, 2], [3], [4]])
+    assert list(storage.iter_pages(op, Limit=2)) == [1, 2, 3, 4]
+    assert [c.get('ExclusiveStartKey') for c in op.calls] == [None, {'page': 0}, {'page': 1}]
+
+def test_due_fields_are_stable_per_symbol():
+    """An alert's shard depends only on its symbol; next_due is one interval out."""
+    now = datetime(2024, 1, 2, 15, 0, tzinfo=timezone.utc)
+    fields = storage.due_fields("AAPL", 5, now)
+    assert fields['due_shard'] == storage.due_shard("AAPL")
+    assert 0 <= fields['due_shard'] < storage.DUE_SHARDS
+    assert fields['next_due'] == int(now.timestamp()) + 300
+
+def test_iter_due_alerts_scan_fallback_keeps_to_its_shards(monkeypatch):
+    """Without the due index, each worker still only gets its own shards' alerts."""
+    monkeypatch.setattr(storage, "ACTIVE_ALERTS_INDEX", "")
+    tbl = MemoryTable()
+    for sym in ("A", "B", "C", "D", "E"):
+        tbl.put_item(Item={'chat_id': 'c', 'symbol': sym, 'alert_sent': False})
+    now = datetime(2024, 1, 2, 15, 0, tzinfo=timezone.utc)
+    everything = [it['symbol'] for it in storage.iter_due_alerts(tbl, now)]
+    shard = storage.due_shard("A")
+    mine = [it['symbol'] for it in storage.iter_due_alerts(tbl, now, shards=[shard])]
+    assert sorted(everything) == ["A", "B", "C", "D", "E"]
+    assert "A" in mine and all(storage.due_shard(sym) == shard for sym in mine)
+
+def test_backfill_due_fields_schedules_legacy_alerts_from_their_last_check(monkeypatch):
+    """Not-yet-due legacy alerts are backfilled too, keeping their place in the schedule."""
+    tbl = MemoryTable()
+    now = datetime(2024, 1, 2, 15, 0, tzinfo=timezone.utc)
+    checked = datetime(2024, 1, 2, 14, 59, tzinfo=timezone.utc)
+    tbl.put_item(Item={'chat_id': 'c', 'symbol': 'LATER', 'alert_sent': False,
+                       'interval_minutes': Decimal('60'), 'last_check': checked.isoformat()})
+    tbl.put_item(Item={'chat_id': 'c', 'symbol': 'NEW', 'alert_sent': False, 'interval_minutes': Decimal('5')})
+    tbl.put_item(Item={'chat_id': 'c', 'symbol': 'SENT', 'alert_sent': True, 'interval_minutes': Decimal('5')})
+    tbl.put_item(Item={'chat_id': 'c', 'symbol': 'DONE', 'alert_sent': False, 'interval_minutes': Decimal('5'),
+                       'due_shard': storage.due_shard('DONE'), 'next_due': 1})
+    assert storage.backfill_due_fields(tbl, now) == 2
+    later = tbl.items[('c', 'LATER')]
+    assert later['due_shard'] == storage.due_shard('LATER')
+    assert later['next_due'] == int(checked.timestamp()) + 3600
+    assert tbl.items[('c', 'NEW')]['next_due'] == int(now.timestamp())
+    assert 'next_due' not in tbl.items[('c', 'SENT')]
+    assert tbl.items[('c', 'DONE')]['next_due'] == 1
+    assert storage.backfill_due_fields(tbl, now) == 0
+
+def test_iter_due_alerts_queries_every_shard(monkeypatch):
+    """Due alerts are read from each shard of the sparse GSI up to now."""
+    calls = []
+    class Table:
+        def query(self, **kwargs):
+            calls.append(kwargs)
+            return {'Items': [{'symbol': 'A'}] if len(calls) == 1 else []}
+    monkeypatch.setattr(storage, "DUE_SHARDS", 4)
+    now = datetime(2024, 1, 2, 15, 0, tzinfo=timezone.utc)
+    assert list(storage.iter_due_alerts(Table(), now)) == [{'symbol': 'A'}]
+    assert len(calls) == 4
+    assert all(c['IndexName'] == storage.ACTIVE_ALERTS_INDEX for c in calls)
+
+def test_alert_write_buffer_skips_deleted_and_reset_alerts():
+    """Updates coalesce per key and only land on the alert as it was read."""
+    tbl = MemoryTable()
+    for sym, baseline in (("A", "100.0"), ("B", "100.0"), ("C", "100.0")):
+        tbl.put_item(Item={'chat_id': 'c', 'symbol': sym, 'alert_sent': False,
+                           'baseline_price': Decimal(baseline), 'threshold_percent': Decimal('5')})
+    tbl.put_item(Item={'chat_id': 'c', 'symbol': 'D', 'alert_sent': True, 'baseline_price': Decimal('100.0')})
+    buffer = storage.AlertWriteBuffer(tbl)
+    for sym in ("A", "B", "C", "D"):
+        buffer.update(*storage.alert_update('c', sym, 100.0, {'next_due': 1}))
+    buffer.update(*storage.alert_update('c', 'A', 100.0, {'next_due': 2, 'alert_sent': True}, ('due_shard',)))
+    tbl.delete_item(Key={'chat_id': 'c', 'symbol': 'B'})                     # !delete mid-run
+    tbl.put_item(Item={'chat_id': 'c', 'symbol': 'C', 'baseline_price': Decimal('90.5'), 'threshold_percent': Decimal('2')})
+    assert buffer.flush() == 1 and buffer.stale == 3
+    assert tbl.get_item(Key={'chat_id': 'c', 'symbol': 'A'})['Item']['next_due'] == 2
+    assert 'Item' not in tbl.get_item(Key={'chat_id': 'c', 'symbol': 'B'})  # not resurrected
+    assert tbl.get_item(Key={'chat_id': 'c', 'symbol': 'C'})['Item'] == {
+        'chat_id': 'c', 'symbol': 'C', 'baseline_price': Decimal('90.5'), 'threshold_percent': Decimal('2')}
+    assert 'next_due' not in tbl.get_item(Key={'chat_id': 'c', 'symbol': 'D'})['Item']  # fired by the stream
+    assert buffer.flush() == 0
+
+def test_needs_reschedule_against_checker_period(monkeypatch):
+    """Intervals no longer than the checker period skip the next_due write."""
+    monkeypatch.setattr(storage, "CHECKER_PERIOD_SECONDS", 60)
+    assert not storage.needs_reschedule(1)
+    assert storage.needs_reschedule(2)
@@ -0,0 +1,147 @@
+from decimal import Decimal
+
+import pytest
+
+from src import stream
+from src.memory_table import MemoryTable
+
+def alert(symbol, chat_id, baseline="100", threshold="5", sent=False):
+    return {
+        'chat_id': chat_id,
+        'symbol': symbol,
+        'baseline_price': Decimal(baseline),
+        'threshold_percent': Decimal(threshold),
+        'alert_sent': sent,
+    }
+
+def test_crossed_returns_only_alerts_the_tick_crosses():
+    """A tick fires exactly the alerts whose trigger price it reaches, once."""
+    index = stream.ThresholdIndex().load([
+        alert("AAA", "c1", threshold="5"),   # trigger 95
+        alert("AAA", "c2", threshold="10"),  # trigger 90
+        alert("AAA", "c3", threshold="20"),  # trigger 80
+        alert("BBB", "c1"),
+    ])
+    assert index.crossed("AAA", 96.0) == []
+    assert [it['chat_id'] for it in index.crossed("AAA", 90.0)] == ["c2", "c1"]
+    assert index.crossed("AAA", 89.0) == []
+    assert len(index) == 2
+
+def test_index_follows_replaced_and_other_rule_alerts():
+    """Re-adding an alert replaces its entry; other rule kinds leave the index."""
+    index = stream.ThresholdIndex()
+    index.add(alert("AAA", "c1", threshold="5"))
+    index.add(alert("AAA", "c1", threshold="50"))  # replaces, trigger now 50
+    index.add(alert("AAA", "c2"))
+    assert [it['chat_id'] for it in index.crossed("AAA", 90.0)] == ["c2"]
+    index.add(alert("CCC", "c2"))
+    index.add(dict(alert("CCC", "c2"), rule="rise"))
+    assert index.crossed("CCC", 1.0) == [] and len(index) == 1
+
+def test_apply_stream_record():
+    """DynamoDB Streams INSERT/REMOVE records update the index."""
+    index = stream.ThresholdIndex()
+    image = {
+        'chat_id': {'S': 'c1'}, 'symbol': {'S': 'AAA'}, 'alert_sent': {'BOOL': False},
+        'baseline_price': {'N': '100'}, 'threshold_percent': {'N': '5'},
+    }
+    stream.apply_stream_record(index, {'eventName': 'INSERT', 'dynamodb': {'NewImage': image}})
+    assert len(index) == 1
+    stream.apply_stream_record(index, {'eventName': 'REMOVE', 'dynamodb': {'Keys': {'chat_id': {'S': 'c1'}, 'symbol': {'S': 'AAA'}}}})
+    assert len(index) == 0
+
+@pytest.mark.parametrize("message,expected", [
+    ('{"symbol": "aapl", "price": 101.5}', ("AAPL", 101.5)),
+    ("BTC-USD,65000", ("BTC-USD", 65000.0)),
+    ("   ", None),
+])
+def test_parse_tick(message, expected):
+    assert stream.parse_tick(message) == expected
+
+def test_run_stream_replay(tmp_path):
+    """Replaying a file fires crossed alerts and marks them sent in the table."""
+    tbl = MemoryTable()
+    for item in [alert("AAA", "c1"), alert("AAA", "c2", threshold="50"), alert("BBB", "c1", sent=True)]:
+        tbl.put_item(Item=item)
+    replay = tmp_path / "ticks.txt"
+    replay.write_text("AAA,99\n{\"symbol\": \"AAA\", \"price\": 94}\nBBB,1\nAAA,93\n")
+    sent = []
+    index = stream.load_active_alerts(tbl)
+    result = stream.run_stream(stream.replay_file(replay), index, tbl, lambda chat_id, text: sent.append(chat_id))
+    assert result == {'ticks': 4, 'alerts_fired': 1}
+    assert sent == ["c1"]
+    assert tbl.get_item(Key={'chat_id': 'c1', 'symbol': 'AAA'})['Item']['alert_sent'] is True
+
+def test_run_stream_skips_alerts_deleted_after_the_snapshot():
+    """A crossed alert gone from the table is neither announced nor recreated as a stub."""
+    tbl = MemoryTable()
+    tbl.put_item(Item=alert("AAA", "c1"))
+    tbl.put_item(Item=alert("AAA", "c2"))
+    index = stream.load_active_alerts(tbl)
+    tbl.delete_item(Key={'chat_id': 'c1', 'symbol': 'AAA'})
+    tbl.put_item(Item=alert("AAA", "c2", sent=True))                # fired by the price checker meanwhile
+    sent = []
+    result = stream.run_stream([("AAA", 50.0)], index, tbl, lambda chat_id, text: sent.append(chat_id))
+    assert result == {'ticks': 1, 'alerts_fired': 0} and sent == []
+    assert 'Item' not in tbl.get_item(Key={'chat_id': 'c1', 'symbol': 'AAA'})
+
+def test_run_stream_skips_alerts_reset_after_the_snapshot():
+    """An alert re-set to a new baseline isn't fired off the old one it was indexed with."""
+    tbl = MemoryTable()
+    tbl.put_item(Item=alert("AAA", "c1"))
+    index = stream.load_active_alerts(tbl)
+    tbl.put_item(Item=alert("AAA", "c1", baseline="50"))              # !set again meanwhile
+    sent = []
+    result = stream.run_stream([("AAA", 90.0)], index, tbl, lambda chat_id, text: sent.append(chat_id))
+    assert result == {'ticks': 1, 'alerts_fired': 0} and sent == []
+    assert tbl.get_item(Key={'chat_id': 'c1', 'symbol': 'AAA'})['Item']['alert_sent'] is False
+
+class FakeStreams:
+    """DynamoDB Streams stand-in: shards hold record lists, iterators are (shard, offset)."""
+    def __init__(self, shards):
+        self.shards = shards  # shard id -> {'parent', 'closed', 'records'}
+    def describe_stream(self, StreamArn, ExclusiveStartShardId=None):
+        shards = []
+        for shard_id, shard in self.shards.items():
+            entry = {'ShardId': shard_id, 'SequenceNumberRange': {'StartingSequenceNumber': '1'}}
+            if shard.get('parent'):
+                entry['ParentShardId'] = shard['parent']
+            if shard.get('closed'):
+                entry['SequenceNumberRange']['EndingSequenceNumber'] = '9'
+            shards.append(entry)
+        return {'StreamDescription': {'Shards': shards}}
+    def get_shard_iterator(self, StreamArn, ShardId, ShardIteratorType):
+        return {'ShardIterator': (ShardId, len(self.shards[ShardId]['records']) if ShardIteratorType == 'LATEST' else 0)}
+    def get_records(self, ShardIterator):
+        shard_id, offset = ShardIterator
+        shard = self.shards[shard_id]
+        records = shard['records'][offset:]
+        drained = shard.get('closed')
+        return {'Records': records, **({} if drained else {'NextShardIterator': (shard_id, offset + len(records))})}
+
+def insert(chat_id, threshold="5"):
+    return {'eventName': 'INSERT', 'dynamodb': {'NewImage': {
+        'chat_id': {'S': chat_id}, 'symbol': {'S': 'AAA'}, 'alert_sent': {'BOOL': False},
+        'baseline_price': {'N': '100'}, 'threshold_percent': {'N': threshold},
+    }}}
+
+def remove(chat_id):
+    return {'eventName': 'REMOVE', 'dynamodb': {'Keys': {'chat_id': {'S': chat_id}, 'symbol': {'S': 'AAA'}}}}
+
+def test_stream_follower_applies_writes_made_after_priming_in_shard_order():
+    """Only records after prime() apply, and a child shard waits for its parent to drain."""
+    streams = FakeStreams({'s1': {'records': [insert("old")]}})
+    index = stream.ThresholdIndex()
+    follower = stream.StreamFollower(index, "arn:stream", client=streams)
+    follower.prime()
+    streams.shards['s1']['records'] += [insert("c1"), insert("c2")]
+    assert follower.poll_once() == 2 and len(index) == 2
+    # s1 closes with a last write and splits; the child holds the follow-up
+    streams.shards['s1']['records'].append(insert("c1", threshold="50"))
+    streams.shards['s1']['closed'] = True
+    streams.shards['s2'] = {'parent': 's1', 'records': [remove("c2")]}
+    assert follower.poll_once() == 1 and 's2' not in follower.iterators
+    assert follower.poll_once() == 1
+    assert [it['chat_id'] for it in index.crossed("AAA", 60.0)] == []
+    assert [it['chat_id'] for it in index.crossed("AAA", 50.0)] == ["c1"]
+    assert len(index) == 0 and follower.applied == 4
@@ -0,0 +1,44 @@
+import pytest
+
+from src import updates
+from src.memory_table import MemoryTable
+
+def test_mark_seen_dedupes_until_expiry():
+    """An update_id is accepted once per stage until its marker expires."""
+    tbl = MemoryTable()
+    assert updates.mark_seen(tbl, "ack", 1, 1000, ttl=60)
+    assert not updates.mark_seen(tbl, "ack", 1, 1030, ttl=60)
+    assert updates.mark_seen(tbl, "run", 1, 1030, ttl=60)
+    # Expired but not yet removed by DynamoDB TTL
+    assert updates.mark_seen(tbl, "ack", 1, 1061, ttl=60)
+    item = tbl.get_item(Key={'chat_id': updates.UPDATE_CHAT_ID, 'symbol': "ack#1"})['Item']
+    assert item['expires_at'] == 1121
+
+def test_enqueue_update_skips_duplicates():
+    tbl = MemoryTable()
+    queue = updates.InProcessQueue(worker=None)
+    update = {'update_id': 5, 'message': {'text': "!list"}}
+    assert updates.enqueue_update(tbl, queue, update, 1000)
+    assert not updates.enqueue_update(tbl, queue, update, 1001)
+    assert list(queue.pending) == [update]
+
+def test_enqueue_failure_forgets_marker():
+    """If the queue rejects an update, Telegram's retry is not treated as a duplicate."""
+    class DownQueue:
+        def send(self, update):
+            raise ConnectionError("queue unavailable")
+    tbl = MemoryTable()
+    update = {'update_id': 9}
+    with pytest.raises(ConnectionError):
+        updates.enqueue_update(tbl, DownQueue(), update, 1000)
+    assert updates.enqueue_update(tbl, updates.InProcessQueue(worker=None), update, 1001)
+
+def test_lambda_queue_invokes_worker_async():
+    calls = []
+    class FakeLambda:
+        def invoke(self, **kwargs):
+            calls.append(kwargs)
+    updates.LambdaQueue("bot-commandWorker", client=FakeLambda()).send({'update_id': 1})
+    assert calls[0]['FunctionName'] == "bot-commandWorker"
+    assert calls[0]['InvocationType'] == "Event"
+    assert calls[0]['Payload'] == b'{"update": {"update_id": 1}}'
@@ -0,0 +1,99 @@
+import gzip
+import json
+
+import pytest
+
+from src.history import read_daily_series
+from src.rate_limit import UpstreamScheduler
+from src.upstream import ResponseCache, MissingKey, make_pool, normalize_url, stream_items
+
+SERIES = {
+    'Meta Data': {'2. Symbol': 'AAA'},
+    'Time Series (Daily)': {
+        f"2024-01-{day:02d}": {'4. close': str(day), '5. adjusted close': str(day), 'note': 'ünïcode'}
+        for day in range(31, 0, -1)
+    },
+}
+
+def chunked(payload, size):
+    raw = json.dumps(payload).encode()
+    return [raw[i:i + size] for i in range(0, len(raw), size)]
+
+@pytest.fixture
+def provider(serve):
+    """Keep-alive server answering with gzip bodies and ETags, recording requests."""
+    seen = []
+    def handle(request):
+        seen.append((request.client_address[1], request.path, dict(request.headers)))
+        if request.headers.get("If-None-Match") == '"v1"':
+            request.send_response(304)
+            request.send_header("Content-Length", "0")
+            request.end_headers()
+            return
+        body = json.dumps(SERIES if "TIME_SERIES" in request.path else {"Global Quote": {"05. price": "1.0"}}).encode()
+        compress = "gzip" in request.headers.get("Accept-Encoding", "")
+        if compress:
+            body = gzip.compress(body)
+        request.send_response(200)
+        request.send_header("Content-Type", "application/json")
+        if compress:
+            request.send_header("Content-Encoding", "gzip")
+        request.send_header("ETag", '"v1"')
+        request.send_header("Content-Length", str(len(body)))
+        request.end_headers()
+        request.wfile.write(body)
+    server = serve(handle, protocol_version="HTTP/1.1")
+    server.seen = seen
+    return server
+
+def test_normalize_url_strips_key_and_sorts():
+    assert normalize_url("https://h/q?symbol=A&apikey=SECRET&function=X") == "https://h/q?function=X&symbol=A"
+
+def test_stream_items_across_tiny_chunks_and_early_stop():
+    items = stream_items(chunked(SERIES, 7), 'Time Series (Daily)')
+    first = [next(items) for _ in range(3)]
+    assert [name for name, _ in first] == ["2024-01-31", "2024-01-30", "2024-01-29"]
+    assert first[0][1]['note'] == 'ünïcode'
+    assert len(list(stream_items(chunked(SERIES, 4096), 'Time Series (Daily)'))) == 31
+
+def test_stream_items_returns_documents_without_the_key():
+    with pytest.raises(MissingKey) as err:
+        list(stream_items(chunked({"Note": "call frequency"}, 5), 'Time Series (Daily)'))
+    assert err.value.document == {"Note": "call frequency"}
+
+def test_read_daily_series_stops_at_stored_bars():
+    from src.history import day_timestamp
+    rows = read_daily_series(chunked(SERIES, 64), newer_than=day_timestamp("2024-01-28"))['Time Series (Daily)']
+    assert sorted(rows) == ["2024-01-29", "2024-01-30", "2024-01-31"]
+
+def test_response_cache_expiry_and_revalidation(tmp_path, clock):
+    cache = ResponseCache(str(tmp_path), ttl=60, clock=clock)
+    cache.store("https://h/q?symbol=A&apikey=K1", b'{"x": 1}', {'ETag': '"v1"'})
+    assert cache.fresh("https://h/q?apikey=K2&symbol=A") == b'{"x": 1}'  # keys don't matter
+    clock.now += 61
+    assert cache.fresh("https://h/q?symbol=A") is None
+    assert cache.validators("https://h/q?symbol=A") == {'If-None-Match': '"v1"'}
+    assert cache.revalidated("https://h/q?symbol=A") == b'{"x": 1}'
+    assert cache.fresh("https://h/q?symbol=A") == b'{"x": 1}'
+
+def test_scheduler_serves_disk_cache_and_revalidates(provider, tmp_path, clock):
+    cache = ResponseCache(str(tmp_path), ttl=60, clock=clock)
+    scheduler = UpstreamScheduler(make_pool(2, read_timeout=2), requests_per_minute=60, burst=2, cache=cache)
+    url = f"{provider.base}?function=GLOBAL_QUOTE&symbol=A&apikey=KEY1"
+    assert scheduler.request(url, "KEY1") == {"Global Quote": {"05. price": "1.0"}}
+    assert scheduler.request(url.replace("KEY1", "KEY9"), "KEY1")["Global Quote"]
+    assert len(provider.seen) == 1                       # second call came from disk, no budget spent
+    assert "gzip" in provider.seen[0][2]["Accept-Encoding"]
+    clock.now += 61
+    assert scheduler.request(url, "KEY1")["Global Quote"]
+    assert provider.seen[1][2]["If-None-Match"] == '"v1"'  # answered 304, body from disk
+
+def test_streamed_series_stops_early_and_keeps_the_connection(provider):
+    from src.history import day_timestamp
+    scheduler = UpstreamScheduler(make_pool(1, read_timeout=2), requests_per_minute=60)
+    url = f"{provider.base}?function=TIME_SERIES_DAILY_ADJUSTED&symbol=A&apikey=KEY1"
+    newest = day_timestamp("2024-01-30")
+    data = scheduler.request(url, "KEY1", parse=lambda chunks: read_daily_series(chunks, newest))
+    assert list(data['Time Series (Daily)']) == ["2024-01-31"]
+    scheduler.request(url, "KEY1", parse=lambda chunks: read_daily_series(chunks))
+    assert provider.seen[0][0] == provider.seen[1][0]    # same client socket: drained, not closed
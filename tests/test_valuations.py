@@ -0,0 +1,99 @@
+from datetime import datetime, timezone
+from decimal import Decimal
+
+import pytest
+
+from src.valuations import (
+    ValuationBook, valuate, to_attribute, from_attribute, is_stale, put_index, delete_index, revalue_indexes,
+)
+from src.memory_table import MemoryTable
+
+def make_index(name, symbols, baselines, chat_id="c1", valuation=None):
+    item = {
+        'chat_id': chat_id, 'index_name': name, 'symbols': symbols,
+        'baseline_prices': [Decimal(str(b)) for b in baselines],
+        'created_at': datetime.now(timezone.utc).isoformat(),
+    }
+    if valuation:
+        item['valuation'] = valuation
+    return item
+
+def test_valuate_skips_missing_prices():
+    v = valuate(make_index("IDX", ["A", "B", "C"], [10, 20, 30]), {"A": 12.0, "B": 18.0, "C": None})
+    assert v['total'] == 30.0
+    assert v['returns'] == {"A": pytest.approx(20.0), "B": pytest.approx(-10.0)}
+    assert v['avg_return'] == pytest.approx(5.0)
+    assert from_attribute(to_attribute(v))['returns']['A'] == pytest.approx(20.0)
+
+def test_book_revalues_only_indexes_holding_changed_symbols():
+    book = ValuationBook().load([
+        make_index("AB", ["A", "B"], [10, 20]),
+        make_index("BC", ["B", "C"], [20, 30]),
+        make_index("D", ["D"], [5]),
+    ])
+    assert book.indexes_for("B") == {("c1", "AB"), ("c1", "BC")}
+    first = book.update_prices({"A": 10.0, "B": 20.0, "C": 30.0, "D": 5.0})
+    assert len(first) == 3
+    assert set(book.update_prices({"A": 11.0, "B": 20.0, "C": 30.0, "D": 5.0})) == {("c1", "AB")}
+    assert book.update_prices({"A": 11.0, "D": None}) == {}
+    book.remove("c1", "AB")
+    assert book.indexes_for("A") == set()
+
+def test_book_compares_against_each_index_materialized_prices():
+    """An index valued at an older price is refreshed even if another index is current."""
+    current = to_attribute(valuate(make_index("X", ["A"], [10]), {"A": 12.0}))
+    stale = to_attribute(valuate(make_index("Y", ["A"], [10]), {"A": 11.0}))
+    book = ValuationBook().load([
+        make_index("X", ["A"], [10], valuation=current),
+        make_index("Y", ["A"], [10], valuation=stale),
+    ])
+    assert set(book.update_prices({"A": 12.0})) == {("c1", "Y")}
+
+def index_table():
+    return MemoryTable('indexes', key=('chat_id', 'index_name'))
+
+def test_is_stale_past_max_age():
+    now = datetime(2024, 1, 2, 15, 0, tzinfo=timezone.utc)
+    v = valuate(make_index("IDX", ["A"], [10]), {"A": 12.0}, now=now)
+    assert not is_stale(v, now=now.replace(minute=10), max_age=900)
+    assert is_stale(v, now=now.replace(minute=16), max_age=900)
+    assert is_stale({**v, 'as_of': None}, now=now)
+
+def test_revalue_reads_only_indexes_holding_quoted_symbols():
+    tbl = index_table()
+    put_index(tbl, make_index("AB", ["A", "B"], [10, 20]))
+    put_index(tbl, make_index("CD", ["C", "D"], [30, 40], chat_id="c2"))
+    scanned = tbl.scan
+    tbl.scan = lambda **kw: pytest.fail("revaluing should not scan the table")
+    assert revalue_indexes(tbl, {"A": 12.0, "E": 1.0, "F": None}) == {"symbols": 2, "indexes": 1, "revalued": 1}
+    assert tbl.get_item(Key={'chat_id': "c1", 'index_name': "AB"})["Item"]["valuation"]["prices"] == {"A": Decimal("12.0")}
+    assert "valuation" not in tbl.get_item(Key={'chat_id': "c2", 'index_name': "CD"})["Item"]
+    assert revalue_indexes(tbl, {}) == {"symbols": 0, "indexes": 0, "revalued": 0}
+    tbl.scan = scanned
+    delete_index(tbl, "c1", "AB")
+    delete_index(tbl, "c2", "CD")
+    assert tbl.items == {}
+
+def test_revalue_drops_refs_of_deleted_and_replaced_indexes():
+    tbl = index_table()
+    put_index(tbl, make_index("AB", ["A", "B"], [10, 20]))
+    put_index(tbl, make_index("X", ["A"], [10], chat_id="c2"))
+    put_index(tbl, make_index("AB", ["B"], [20]))                 # replaced without A
+    tbl.delete_item(Key={'chat_id': "c2", 'index_name': "X"})     # deleted without its refs
+    assert revalue_indexes(tbl, {"A": 1.0})["revalued"] == 0
+    assert [key for key in tbl.items if key[0] == "#symbol#A"] == []
+
+def test_concurrent_revaluations_keep_each_others_prices():
+    """Two shard workers quoting different symbols of one index both land."""
+    tbl = index_table()
+    put_index(tbl, make_index("AB", ["A", "B"], [10, 20], valuation=to_attribute(valuate(
+        make_index("AB", ["A", "B"], [10, 20]), {"A": 10.0, "B": 20.0}))))
+    update = tbl.update_item
+    def racing_update(**kwargs):
+        tbl.update_item = update
+        revalue_indexes(tbl, {"B": 25.0})       # the other worker writes first
+        return update(**kwargs)
+    tbl.update_item = racing_update
+    assert revalue_indexes(tbl, {"A": 12.0})["revalued"] == 1
+    valuation = from_attribute(tbl.get_item(Key={'chat_id': "c1", 'index_name': "AB"})["Item"]["valuation"])
+    assert valuation["prices"] == {"A": 12.0, "B": 25.0} and valuation["total"] == 37.0